@@ -0,0 +1,155 @@
+"""
+End to end benchmark of CMPD.download_modpack against the local fake server
+
+    python benchmarks/bench_download.py [--mods 200] [--latency 0.02] [--bandwidth 0] [-o bench_download.json]
+
+Runs every scenario in a fresh process so the peak rss is its own
+  cold    : empty store, empty output folder
+  warm    : store left by the cold run, empty output folder
+  partial : like warm, with a share of the stored mod files removed
+"""
+import argparse
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+SCENARIOS = ('cold', 'warm', 'partial')
+
+
+def _peak_rss():
+    try:
+        import resource
+    except ImportError:
+        return None
+
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on linux, bytes on macos
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+
+def child(config: dict):
+    from cmpd import CMPD
+    from cmpd.logger import setup_logging
+
+    setup_logging(None, 'warning')
+
+    downloader = CMPD(config['pack_id'], store_dir=config['store'], out_dir=config['out'], jobs=config['jobs'],
+                      progress='none', api_base=config['api_base'])
+
+    started = time.perf_counter()
+    downloader.download_modpack()
+    wall = time.perf_counter() - started
+
+    print('BENCH ' + json.dumps({
+        'wall': wall,
+        'peak_rss': _peak_rss(),
+        'mods': len(downloader.mod_files),
+        'failed': len(downloader.failed_mods),
+        'client': downloader.session.stats(),
+    }))
+
+
+def _run_child(config: dict, cwd: str):
+    out = subprocess.run([sys.executable, os.path.abspath(__file__), '--child', json.dumps(config)],
+                         cwd=cwd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, check=True)
+    for line in reversed(out.stdout.decode('utf-8', 'replace').splitlines()):
+        if line.startswith('BENCH '):
+            return json.loads(line[6:])
+    raise RuntimeError('Benchmark run printed no result:\n' + out.stderr.decode('utf-8', 'replace'))
+
+
+def _drop_stored(store: str, share: float):
+    files_dir = os.path.join(store, 'files')
+    uids = sorted(os.listdir(files_dir))
+    # Every n-th file so the same ones go on every run
+    step = max(1, int(round(1 / share))) if share > 0 else 0
+    dropped = uids[::step] if step else []
+    for i in dropped:
+        shutil.rmtree(os.path.join(files_dir, i))
+    shutil.rmtree(os.path.join(store, 'objects'), ignore_errors=True)
+    return len(dropped)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='End to end benchmark of CMPD.download_modpack')
+    parser.add_argument('--mods', type=int, default=200)
+    parser.add_argument('--min-size', type=int, default=16 * 1024)
+    parser.add_argument('--max-size', type=int, default=256 * 1024)
+    parser.add_argument('--overrides', type=int, default=50)
+    parser.add_argument('--latency', type=float, default=0.02, help='seconds added to every request')
+    parser.add_argument('--bandwidth', type=int, default=0, help='bytes/s per connection, 0 for unlimited')
+    parser.add_argument('--error-rate', type=float, default=0)
+    parser.add_argument('--partial', type=float, default=0.25, help='share of stored files the partial run loses')
+    parser.add_argument('-j', '--jobs', type=int, default=4)
+    parser.add_argument('-r', '--repeat', type=int, default=1)
+    parser.add_argument('-o', '--output', default='bench_download.json')
+    parser.add_argument('--child', help=argparse.SUPPRESS)
+
+    args = parser.parse_args(argv)
+    if args.child:
+        return child(json.loads(args.child))
+
+    from cmpd.fakeserver import FakeCurse
+
+    server = FakeCurse(latency=args.latency, bandwidth=args.bandwidth, error_rate=args.error_rate,
+                       mods=args.mods, min_size=args.min_size, max_size=args.max_size,
+                       overrides=args.overrides).start()
+    results = []
+    work = tempfile.mkdtemp(prefix='cmpd_bench_')
+
+    try:
+        for run in range(args.repeat):
+            store = os.path.join(work, 'store')
+            shutil.rmtree(store, ignore_errors=True)
+
+            for scenario in SCENARIOS:
+                out = os.path.join(work, 'out')
+                shutil.rmtree(out, ignore_errors=True)
+                dropped = _drop_stored(store, args.partial) if scenario == 'partial' else 0
+
+                server.reset_stats()
+                result = _run_child({
+                    'pack_id': server.fixtures.pack_id,
+                    'api_base': server.api_base,
+                    'store': store,
+                    'out': out,
+                    'jobs': args.jobs,
+                }, work)
+                served = server.stats()
+
+                result.update({
+                    'scenario': scenario,
+                    'run': run,
+                    'dropped': dropped,
+                    'requests': served.get('requests', 0),
+                    'bytes': served.get('bytes', 0),
+                    'bytes_per_s': served.get('bytes', 0) / result['wall'] if result['wall'] > 0 else 0,
+                    'server': served,
+                })
+                results.append(result)
+                print('{:>8} #{} :: {:7.3f}s :: {:6} requests :: {:10.0f} B/s :: peak rss {}'.format(
+                    scenario, run, result['wall'], result['requests'], result['bytes_per_s'], result['peak_rss']))
+    finally:
+        server.stop()
+        shutil.rmtree(work, ignore_errors=True)
+
+    with open(args.output, 'w') as f:
+        json.dump({
+            'created': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'python': sys.version,
+            'platform': platform.platform(),
+            'config': {k: v for k, v in vars(args).items() if k not in ('child', 'output')},
+            'results': results,
+        }, f, indent=2)
+    print('Results written to [{}]'.format(args.output))
+
+
+if __name__ == '__main__':
+    main()
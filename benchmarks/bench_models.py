@@ -0,0 +1,97 @@
+"""
+Micro benchmark of the addon models and of picking a pack's newest file from a store
+
+    python benchmarks/bench_models.py [--files 20000] [--packs 200] [--latest 30] [-o bench_models.json]
+
+  parse   : AddonFile.create_from_json over api like file infos, time and memory kept per file
+  resolve : get_addon_info + newest_file for every pack of a store, json and sqlite indexes
+"""
+import argparse
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+
+def _api_file(uid: int, addon_uid: int):
+    return {
+        'id': uid,
+        'projectId': addon_uid,
+        'displayName': 'Mod {} file {}'.format(addon_uid, uid),
+        'fileName': 'mod-{}-{}.jar'.format(addon_uid, uid),
+        'downloadUrl': 'https://edge.forgecdn.net/files/{}/{}/mod-{}-{}.jar'.format(uid // 1000, uid % 1000,
+                                                                                    addon_uid, uid),
+        'fileLength': 100000 + uid,
+        'fingerprint': uid * 7919 % (2 ** 32),
+        'fileDate': '2020-{:02d}-{:02d}T{:02d}:{:02d}:11.{:03d}Z'.format(uid % 12 + 1, uid % 28 + 1, uid % 24,
+                                                                        uid % 60, uid % 1000),
+    }
+
+
+def bench_parse(count: int):
+    from cmpd.Addons import AddonFile
+
+    sources = [_api_file(i, i % 500) for i in range(count)]
+
+    tracemalloc.start()
+    started = time.perf_counter()
+    files = [AddonFile.create_from_json(i) for i in sources]
+    wall = time.perf_counter() - started
+    size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return {'files': len(files), 'seconds': round(wall, 4), 'bytes_per_file': round(size / count, 1)}
+
+
+def bench_resolve(store_dir: str, index: str, packs: int, latest: int):
+    from cmpd.Addons import AddonFile, AddonInfo
+    from cmpd.ModStore import ModStore
+
+    store = ModStore(os.path.join(store_dir, index), index=index)
+    files = []
+    for pack in range(packs):
+        latest_files = [AddonFile.create_from_json(_api_file(pack * latest + i, pack)) for i in range(latest)]
+        files.extend(latest_files)
+        store.create_addon_details(AddonInfo(pack, 'Pack {}'.format(pack), '', '', latest_files))
+    store.create_file_details_many(files)
+
+    started = time.perf_counter()
+    for pack in range(packs):
+        store.get_addon_info(pack).newest_file()
+    wall = time.perf_counter() - started
+
+    return {'packs': packs, 'latest_files': latest, 'seconds': round(wall, 4),
+            'ms_per_pack': round(wall * 1000 / packs, 3)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmarks the addon models')
+    parser.add_argument('--files', type=int, default=20000, help='file infos to parse')
+    parser.add_argument('--packs', type=int, default=200, help='packs to resolve from the store')
+    parser.add_argument('--latest', type=int, default=30, help='latest files per pack')
+    parser.add_argument('-o', '--out', default='bench_models.json', help='where the results go')
+    args = parser.parse_args()
+
+    from cmpd.logger import setup_logging
+    setup_logging(None, 'warning')
+
+    results = {'parse': bench_parse(args.files), 'resolve': {}}
+    work = tempfile.mkdtemp(prefix='cmpd_bench_')
+    try:
+        for index in ('json', 'sqlite'):
+            results['resolve'][index] = bench_resolve(work, index, args.packs, args.latest)
+    finally:
+        shutil.rmtree(work, ignore_errors=True)
+
+    print(json.dumps(results, indent=2))
+    with open(args.out, 'w') as f:
+        json.dump(results, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
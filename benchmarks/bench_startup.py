@@ -0,0 +1,62 @@
+"""
+Startup benchmark, how long the cli and the common imports take before doing anything
+
+    python benchmarks/bench_startup.py [--runs 20] [--root .] [-o bench_startup.json]
+
+  every case runs in a fresh interpreter (cwd = --root, so another checkout can be compared),
+  the median wall time is kept along with whether requests got imported on the way
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+CASES = {
+    'interpreter': 'pass',
+    'import cmpd': 'import cmpd',
+    'cli --help': 'import runpy, sys; sys.argv = ["cmpd", "--help"]; runpy.run_module("cmpd", run_name="__main__")',
+    'daemon client': 'from cmpd.client import DaemonClient',
+    'ModStore': 'from cmpd.ModStore import ModStore',
+    'CMPD': 'from cmpd import CMPD',
+    # Everything a library user pays before the first request goes out
+    'build CMPD': 'import tempfile; from cmpd import CMPD; CMPD(1, store_dir=tempfile.mkdtemp())',
+}
+
+# --help leaves through SystemExit, whether requests got imported is printed last either way
+_SCRIPT = 'try:\n    {}\nexcept SystemExit:\n    pass\nimport sys\nprint(int("requests" in sys.modules))'
+
+
+def bench_case(code: str, root: str, runs: int):
+    times = []
+    requests = None
+    for _ in range(runs):
+        started = time.perf_counter()
+        _r = subprocess.run([sys.executable, '-c', _SCRIPT.format(code)], cwd=root, capture_output=True, text=True)
+        times.append(time.perf_counter() - started)
+        if _r.returncode != 0:
+            raise RuntimeError(_r.stderr)
+        requests = _r.stdout.strip().endswith('1')
+
+    return {'ms': round(statistics.median(times) * 1000, 1), 'requests': requests}
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmarks the cli startup')
+    parser.add_argument('--runs', type=int, default=20, help='runs per case, the median is kept')
+    parser.add_argument('--root', default=os.path.abspath(os.path.join(os.path.dirname(__file__), '..')),
+                        help='the checkout to benchmark')
+    parser.add_argument('-o', '--out', default='bench_startup.json', help='where the results go')
+    args = parser.parse_args()
+
+    results = {name: bench_case(code, args.root, args.runs) for name, code in CASES.items()}
+
+    print(json.dumps(results, indent=2))
+    with open(args.out, 'w') as f:
+        json.dump(results, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
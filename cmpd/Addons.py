@@ -1,11 +1,29 @@
 from datetime import datetime
 
-from typing import List
+from typing import List, TYPE_CHECKING
 
-from cmpd import ModStore
+# Only for the annotations, cmpd.ModStore imports this module
+if TYPE_CHECKING:
+    from cmpd.ModStore import ModStore
+
+
+def parse_file_date(value: str):
+    """
+    Reads an api fileDate (2020-05-12T18:32:11.123Z) the way it always has been, as naive local time
+    without the milliseconds, slicing instead of the replace/split when it's in the usual form
+    :param value: the fileDate
+    :return: the timestamp
+    """
+    if len(value) >= 19 and value[19:20] in ('', '.', 'Z'):
+        return datetime.fromisoformat(value[:19]).timestamp()
+    return datetime.fromisoformat(value.replace('Z', '').split('.')[0]).timestamp()
 
 
 class AddonFile:
+    # Plenty of these get made when resolving big packs, no per instance dict
+    __slots__ = ('uid', 'addon_uid', 'd_name', 'file_name', 'url', 'length', 'timestamp', 'fingerprint',
+                 'linked_file_loc')
+
     def __init__(self, uid: int, addon_uid: int, d_name: str, file_name: str, url: str,
                  length: int, fingerprint: int, timestamp: float):
         self.uid = uid
@@ -50,13 +68,8 @@ class AddonFile:
         length = addon_file['fileLength']
         fingerprint = addon_file['fingerprint'] if 'fingerprint' in addon_file else (fingerprint or -1)
 
-        # TODO : Figure out a less hacky way of dealing with this, perhaps with another lib/package?
-        # Converts timestamp to float, cracks up zulu format to allow python to read it
-        #  discards milliseconds since it's a paint to add new stuff just for this one part
-        #  lol
-        timestamp = datetime.fromisoformat(
-                addon_file['fileDate'].replace('Z', '').split('.')[0]
-            ).timestamp()
+        # Discards milliseconds and the zulu, read as local time (what's already in the stores)
+        timestamp = parse_file_date(addon_file['fileDate'])
 
         return AddonFile(uid, addon_uid, d_name, file_name, url, length, fingerprint, timestamp)
 
@@ -75,29 +88,87 @@ class AddonFile:
 
 
 class AddonInfo:
-    def __init__(self, uid: int, d_name: str, summary: str, url: str, latest_files: List[AddonFile], categories=None):
+    __slots__ = ('uid', 'd_name', 'summary', 'url', 'categories', '_latest_files', '_latest_ids', '_latest_times',
+                 '_store')
+
+    def __init__(self, uid: int, d_name: str, summary: str, url: str, latest_files: List[AddonFile], categories=None,
+                 store: 'ModStore' = None, latest_times: dict = None):
+        """
+        :param latest_files: the latest files, or only their ids if there's a store to load them from
+        :param store: loads latest_files on first use instead of right away
+        :param latest_times: timestamp of each latest file id (str keys), as kept in the addon record
+        """
         self.uid = uid
         self.d_name = d_name
         self.summary = summary
         self.url = url
-        self.latest_files = latest_files
         self.categories = categories
 
-    def get_json(self):
-        latest_files = []
-
-        for i in self.latest_files:
-            latest_files.append(i.uid)
+        self._store = store
+        if store is None:
+            self._latest_files = latest_files
+            self._latest_ids = None
+        else:
+            self._latest_files = None
+            self._latest_ids = list(latest_files)
+        self._latest_times = latest_times
+
+    @property
+    def latest_files(self) -> List[AddonFile]:
+        if self._latest_files is None:
+            # Latest files missing from the store are left out
+            self._latest_files = [i for i in (self._store.get_file_info(j) for j in self._latest_ids) if i]
+        return self._latest_files
+
+    @latest_files.setter
+    def latest_files(self, value: List[AddonFile]):
+        self._latest_files = value
+
+    @property
+    def latest_file_ids(self):
+        if self._latest_files is None:
+            return self._latest_ids
+        return [i.uid for i in self._latest_files]
+
+    @property
+    def latest_times(self):
+        """
+        :return: timestamp of each latest file id (str keys), None if the addon record didn't keep them
+        """
+        if self._latest_files is None:
+            return self._latest_times
+        return {str(i.uid): i.timestamp for i in self._latest_files}
+
+    def newest_file(self):
+        """
+        :return: the most recent of the latest files (the first one on ties), None if there's none.
+                 Loaded from the store only picks it from the index, the other files aren't loaded
+        """
+        if self._latest_files is None:
+            return self._store.newest_file(self._latest_ids, self._latest_times)
+
+        newest = None
+        for i in self._latest_files:
+            if newest is None or i.timestamp > newest.timestamp:
+                newest = i
+        return newest
 
-        return {
+    def get_json(self):
+        data = {
             'uid': self.uid,
             'd_name': self.d_name,
             'summary': self.summary,
             'url': self.url,
-            'latest_files': latest_files,
+            'latest_files': list(self.latest_file_ids),
             'categories': self.categories,
         }
 
+        # Lets the json index pick the newest file without opening every file record
+        latest_times = self.latest_times
+        if latest_times is not None:
+            data['latest_times'] = latest_times
+        return data
+
     @staticmethod
     def create_from_json(addon_info):
         uid = addon_info['id']
@@ -112,19 +183,14 @@ class AddonInfo:
         return AddonInfo(uid, d_name, summary, url, latest_files)
 
     @staticmethod
-    def create_from_store(addon_info, store: ModStore = None):
+    def create_from_store(addon_info, store: 'ModStore' = None):
         uid = addon_info['uid']
         d_name = addon_info['d_name']
         summary = addon_info['summary']
         url = addon_info['url']
         latest_files = addon_info['latest_files']
+        # Older records don't have them
+        latest_times = addon_info.get('latest_times')
 
-        if store:
-            _n_temp = []
-            for i in range(len(latest_files)):
-                temp = store.get_file_info(latest_files[i])
-                if temp:
-                    _n_temp.append(temp)
-            latest_files = _n_temp
-
-        return AddonInfo(uid, d_name, summary, url, latest_files)
+        # Their infos only get loaded once something asks for them
+        return AddonInfo(uid, d_name, summary, url, latest_files, store=store, latest_times=latest_times)
@@ -1,12 +1,25 @@
-import humanize
 import json
 import os
-import requests as req
+import re
+import shutil
+import threading
+import time
 
 from pathlib import Path
+from typing import List
+from urllib.parse import urlsplit
 
 from cmpd.Addons import AddonInfo, AddonFile
+from cmpd.archive import PackArchive
+from cmpd.fingerprint import fingerprint_file, file_stamp, stripped_length
+from cmpd.index import open_index
+from cmpd.locks import FileLock, merge_changed, update_json
 from cmpd.logger import logger
+from cmpd.metrics import NullMetrics
+from cmpd.policy import DownloadPolicy
+from cmpd.progress import Progress
+from cmpd.session import HttpSession
+from cmpd.usage import BUSY_FOR, StoreUsage
 
 
 # ------------------------------------
@@ -18,13 +31,28 @@ from cmpd.logger import logger
 #         - {addon_id}.json
 #     - files
 #         - {file_id}.json
+#     - manifests
+#         - {file_id}.json (manifest and overrides listing of a pack file, so its zip isn't opened for nothing)
+#     - verified.json
+#     - usage.json (when each file was last used and which output folders use it)
+#     - index.sqlite3 (replaces addons/ and files/ with the sqlite index)
 #   - files
 #     - {file_id}
 #         - {file_name}
+#   - objects
+#     - {fingerprint} (hardlinks to the verified files above, shared by identical contents)
+#   - locks
+#     - {file_id}.lock (held while a process downloads or repairs that file)
 # ------------------------------------
 
+class DownloadCancelled(Exception):
+    pass
+
+
 class ModStore:
-    def __init__(self, store_dir, headers=None, chunk_size: int = None):
+    def __init__(self, store_dir, headers=None, chunk_size: int = None, session: HttpSession = None,
+                 verify: bool = True, index: str = None, progress: Progress = None, offline: bool = False,
+                 metrics=None, policy: DownloadPolicy = None):
         p = os.path
 
         # TODO : Handle Exceptions
@@ -33,7 +61,9 @@ class ModStore:
             Path(store_dir).mkdir(parents=True, exist_ok=True)
 
         self.store_dir = store_dir
-        self.headers = headers or {
+        # Where the addon/file infos live, json or sqlite (auto picks sqlite if the store has one)
+        self.index = open_index(store_dir, index)
+        self.headers = headers or (session.headers if session else None) or {
             'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) '
                           'Chrome/79.0.3945.88 Safari/537.36',
             'DNT': '1',
@@ -44,9 +74,35 @@ class ModStore:
             'Accept-Language': 'en-US,en;q=0.9,ja;q=0.8,fil;q=0.7',
         }
 
+        # Shares the connection pool (and headers) with whoever made us
+        self.session = session or HttpSession(self.headers)
+
+        # Downloads report their bytes here instead of logging every chunk
+        self.progress = progress or Progress()
+
         # 1024 B * 512 = 512 KB
         self.chunk_size = chunk_size or (1024 * 512)
 
+        # Check fingerprints of whatever gets downloaded or reused
+        self.verify = verify
+        # Only hand out what's already stored, never download
+        self.offline = offline
+        # Download, hashing and lock timings, outcome counters
+        self.metrics = metrics or NullMetrics()
+        # Retries, backoff, mirrors and hedging of downloads
+        self.policy = policy or DownloadPolicy(metrics=self.metrics)
+        # Off once hardlinks turn out to be unsupported in the store
+        self.dedupe = True
+        # {relative path: [size, mtime_ns, fingerprint]}, loaded on first use
+        self._verified = None
+        # Paths verified by this process, merged into whatever other processes saved meanwhile
+        self._verified_changed = set()
+        self._verified_lock = threading.Lock()
+        # Last use and references of every file, for gc and eviction
+        self.usage = StoreUsage(store_dir)
+        # Files other processes wrote after this may belong to an install that hasn't recorded its refs yet
+        self.opened = time.time()
+
     def prep_folder(self, folder: str):
         """
         Prepares a folder for the app
@@ -79,37 +135,109 @@ class ModStore:
 
     def create_addon_details(self, addon_info: AddonInfo):
         """
-        Generates a json file with the addon's info
+        Saves the addon's info to the index
         :param addon_info: the info to use
         """
-        self.prep_data_folder()
-        detail_file = os.path.join(self.store_dir, 'data', 'addons', '{}.json'.format(addon_info.uid))
-
-        with open(detail_file, 'w') as f:
-            json.dump(addon_info.get_json(), f)
+        self.index.put_addon(addon_info.get_json())
 
     def create_file_details(self, addon_file: AddonFile):
         """
-        Generates a json file with the addon file's info
+        Saves the addon file's info to the index
         :param addon_file: the info to use
         """
-        self.prep_data_folder()
-        detail_file = os.path.join(self.store_dir, 'data', 'files', '{}.json'.format(addon_file.uid))
+        self.index.put_file(addon_file.get_json())
+
+    def create_file_details_many(self, addon_files: List[AddonFile]):
+        """
+        Saves several addon file infos at once (a single transaction on sqlite)
+        :param addon_files: the infos to use
+        """
+        if len(addon_files) == 0:
+            return
+        self.index.put_files([i.get_json() for i in addon_files])
+
+    def file_lock(self, file_id):
+        """
+        :param file_id: the file to lock
+        :return: the lock guarding files/{file_id}/ against other processes (and threads)
+        """
+        return FileLock(os.path.join(self.store_dir, 'locks', '{}.lock'.format(file_id)))
+
+    def file_path(self, addon_file: AddonFile):
+        """
+        :return: where the file is (or will be) stored
+        """
+        return os.path.join(self.store_dir, 'files', str(addon_file.uid), addon_file.file_name)
+
+    def manifest_path(self, file_id):
+        return os.path.join(self.store_dir, 'data', 'manifests', '{}.json'.format(file_id))
+
+    def open_pack(self, pack_file: AddonFile, path: str):
+        """
+        :param pack_file: the pack file
+        :param path: where it's stored (from download_to_store)
+        :return: a PackArchive, its manifest comes from the store once it's been read a first time
+        """
+        return PackArchive(path, self.manifest_path(pack_file.uid))
 
-        with open(detail_file, 'w') as f:
-            json.dump(addon_file.get_json(), f)
+    def plan_file(self, addon_file: AddonFile):
+        """
+        Works out what download_to_store would do with a file, from sizes only (nothing gets hashed)
+        :param addon_file: info of the file
+        :return: (cached, reused, partial or download, bytes it accounts for)
+        """
+        p = os.path
+        target = self.file_path(addon_file)
+
+        if p.isfile(target) and p.getsize(target) == addon_file.length:
+            return 'cached', addon_file.length
+        if self._find_object(addon_file) is not None:
+            return 'reused', addon_file.length
 
-    def download_to_store(self, addon_file: AddonFile):
+        part = target + '.part'
+        if p.isfile(part) and 0 < p.getsize(part) <= addon_file.length:
+            return 'partial', addon_file.length - p.getsize(part)
+        return 'download', addon_file.length
+
+    def bytes_to_fetch(self, addon_file: AddonFile):
         """
-        Downloads an addon file to the store and registers it
-        :param addon_file: info of the file to download
+        :return: how many bytes of the file would have to come over the network
         """
+        category, size = self.plan_file(addon_file)
+        return size if category in ('partial', 'download') else 0
 
-        # Save the current target's details to store
-        self.create_file_details(addon_file)
+    def download_to_store(self, addon_file: AddonFile, cancel: threading.Event = None):
+        """
+        Downloads an addon file to the store, while holding its lock.
+        If another process is already downloading it, waits for that one and reuses its file.
+        :param addon_file: info of the file to download, already in the index (see create_file_details)
+        :param cancel: once set, gives up between chunks (the part file stays, to resume later)
+        :return: where the file is stored, None if it couldn't be
+        """
+        lock = self.file_lock(addon_file.uid)
+        if not lock.acquire(blocking=False):
+            logger.info(' / File [{}] is being downloaded by another process, waiting for it.'
+                        .format(addon_file.d_name))
+            with self.metrics.timer('cmpd_lock_wait_seconds'):
+                if cancel is None:
+                    lock.acquire()
+                else:
+                    while not lock.acquire(blocking=False):
+                        if cancel.wait(FileLock.poll_interval):
+                            return None
+
+        try:
+            target = self._download_to_store(addon_file, cancel)
+        finally:
+            lock.release()
+
+        if target:
+            self.usage.touch(addon_file.uid)
+        return target
 
+    def _download_to_store(self, addon_file: AddonFile, cancel: threading.Event = None):
         # Downloader vars
-        _max_retries = 3
+        _max_retries = self.policy.retries
         _retries = 0
         _success = False
 
@@ -118,83 +246,647 @@ class ModStore:
         # Just making sure (srsly)
         self.prep_file_folder()
 
-        target = p.join(self.store_dir, 'files', str(addon_file.uid), addon_file.file_name)
+        target = self.file_path(addon_file)
+        # Partial data lives here until it's complete
+        part = target + '.part'
 
         # Check if file already exists and matches file length,
         #  else, make sure that all the preceding dirs are made
         if p.exists(target) and p.isfile(target):
-            if p.getsize(target) == addon_file.length:
+            if p.getsize(target) == addon_file.length and self.check_fingerprint(addon_file, target):
                 logger.info(' / File [{}] already exists seems valid.'
                             .format(addon_file.d_name))
+                self.metrics.inc('cmpd_store_total', result='cached')
                 return target
+            elif p.getsize(target) == addon_file.length:
+                logger.warning(' X File [{}] exists but fingerprint does not match, redownloading.'
+                               .format(addon_file.d_name))
+                os.remove(target)
+            elif p.getsize(target) < addon_file.length and not p.exists(part):
+                # Probably a run that died halfway, pick up from where it stopped
+                logger.warning(' X File [{}] exists but seems truncated, resuming.'
+                               .format(addon_file.d_name))
+                os.replace(target, part)
             else:
-                logger.warn(' X File [{}] exists but seems corrupted, redownloading.'
-                            .format(addon_file.d_name))
+                logger.warning(' X File [{}] exists but seems corrupted, redownloading.'
+                               .format(addon_file.d_name))
+                os.remove(target)
         else:
             Path(p.split(target)[0]).mkdir(parents=True, exist_ok=True)
 
+        # Same contents already stored under another file id
+        if self._link_object(addon_file, target):
+            logger.info(' / File [{}] reused from identical stored content.'.format(addon_file.d_name))
+            self.metrics.inc('cmpd_store_total', result='reused')
+            return target
+
+        if self.offline:
+            logger.error(' X File [{}] is not stored and we are offline, skipping.'.format(addon_file.d_name))
+            self.metrics.inc('cmpd_store_total', result='offline')
+            return None
+
+        # Bytes of this file the progress currently knows about, and the ones that came over the network
+        _counted = 0
+        _fetched = 0
+        _started = time.monotonic()
+        self.progress.begin(addon_file.d_name, addon_file.length)
+
+        _cancelled = False
+        _url = None
         while _retries < _max_retries:
             try:
-                _r = req.get(addon_file.url, stream=True)
+                if cancel is not None and cancel.is_set():
+                    raise DownloadCancelled(addon_file.d_name)
+
+                # Give whatever went wrong a moment, cut short by a cancel
+                _delay = self.policy.delay(_retries)
+                if _delay > 0:
+                    if cancel is not None and cancel.wait(_delay):
+                        raise DownloadCancelled(addon_file.d_name)
+                    elif cancel is None:
+                        time.sleep(_delay)
+
+                f_load = p.getsize(part) if p.exists(part) else 0
+                if f_load > addon_file.length:
+                    f_load = 0
+                self.progress.advance(f_load - _counted)
+                _counted = f_load
+
+                if f_load == addon_file.length:
+                    # Nothing left to fetch, a previous attempt got it all
+                    self._finish_part(addon_file, part, target)
+                    _success = True
+                    break
+
+                # Identity so content-length matches the bytes we end up writing
+                headers = {'accept-encoding': 'identity'}
+                if f_load > 0:
+                    headers['range'] = 'bytes={}-'.format(f_load)
+
+                # Healthiest of the url and its mirrors, possibly hedged
+                _url = None
+                _r, _url = self.policy.open(self.session, self.policy.candidates(addon_file.url), headers)
+                if _url != addon_file.url:
+                    self.metrics.inc('cmpd_download_failovers_total')
+                    logger.info(' ! Downloading [{}] from [{}]'.format(addon_file.d_name, urlsplit(_url).netloc))
+                _r.raise_for_status()
                 _size = _r.headers.get('content-length')
 
                 if _size is None:
-                    logger.error('XX Headers for downloading [] does not have content-length ?')
+                    logger.error('XX Headers for downloading [{}] does not have content-length ?'
+                                 .format(addon_file.d_name))
                     logger.error(_r.content)
                     _retries += 1
                     continue
 
-                with open(target, 'wb') as f:
-                    logger.info('   Attempt #{} :: Downloading {} :: [{}]'.format(
+                # Server ignored the range (or there was none), start from zero
+                if _r.status_code != 206:
+                    f_load = 0
+                    self.progress.advance(-_counted)
+                    _counted = 0
+                elif self._range_start(_r) != f_load:
+                    # Appending would put the bytes in the wrong place, the next attempt starts over
+                    _r.close()
+                    os.remove(part)
+                    raise IOError('Asked for [{}] from byte [{}], got Content-Range [{}]'
+                                  .format(addon_file.d_name, f_load, _r.headers.get('content-range')))
+                # What the server promised, and what the file has to end up as when we know it
+                f_size = f_load + int(_size)
+                f_expected = addon_file.length or f_size
+                # What the fingerprint will hash, only known when this attempt writes the whole file
+                _stripped = 0 if f_load == 0 else None
+
+                with open(part, 'ab' if f_load > 0 else 'wb') as f:
+                    # Costs a lot to import (pkg_resources), only pay for it once something gets downloaded
+                    import humanize
+                    logger.info('   Attempt #{} :: Downloading {} :: [{}]{}'.format(
                         _retries,
                         humanize.naturalsize(addon_file.length).rjust(8),
-                        addon_file.d_name)
+                        addon_file.d_name,
+                        ' from {}'.format(humanize.naturalsize(f_load)) if f_load > 0 else '')
                     )
 
-                    f_load = 0
-                    f_size = int(_size)
                     for data in _r.iter_content(chunk_size=self.chunk_size):
+                        if cancel is not None and cancel.is_set():
+                            _r.close()
+                            raise DownloadCancelled(addon_file.d_name)
                         f_load += len(data)
                         f.write(data)
-                        logger.info('   {}% :: {} of {}'.format(
-                            str(int((f_load / f_size) * 100)).rjust(9),
-                            humanize.naturalsize(f_load).rjust(8),
-                            humanize.naturalsize(f_size).rjust(8)
-                        ))
-
+                        if _stripped is not None:
+                            _stripped += stripped_length(data)
+                        self.progress.advance(len(data))
+                        _counted += len(data)
+                        _fetched += len(data)
+
+                # Keep the part around, the next attempt resumes from it, unless it's already too long
+                if p.getsize(part) != f_expected:
+                    _got = p.getsize(part)
+                    if _got > f_expected:
+                        os.remove(part)
+                    raise IOError('Got [{}] of [{}] bytes (server sent [{}])'.format(_got, f_expected, f_size))
+
+                self._finish_part(addon_file, part, target, _stripped)
                 _success = True
                 break
+            except DownloadCancelled:
+                _cancelled = True
+                break
             except Exception as e:
                 _retries += 1
+                # Failures once the headers are in count against the host too
+                if _url is not None:
+                    self.policy.record(_url, False)
+                self.metrics.inc('cmpd_download_retries_total')
                 logger.h_except(e)
                 logger.error(' X Failed, Retrying [{}].'.format(_retries))
 
+        self.progress.end(addon_file.d_name, addon_file.length, _success, left=addon_file.length - _counted)
+        self.metrics.inc('cmpd_download_bytes_total', _fetched)
+        self.metrics.inc('cmpd_store_total',
+                         result='downloaded' if _success else ('cancelled' if _cancelled else 'failed'))
+        if _success:
+            self.metrics.observe('cmpd_download_seconds', time.monotonic() - _started)
+
+        if _cancelled:
+            logger.warning(' x Cancelled [{}], kept what was downloaded so far.'.format(addon_file.d_name))
+            return None
+
         if not _success:
-            logger.error(' X Failed to download [x] after trying [y] times, skipping.')
+            logger.error(' X Failed to download [{}] after trying [{}] times, skipping.'
+                         .format(addon_file.d_name, _max_retries))
             return None
 
         logger.info(' / Downloaded [{}].'.format(addon_file.d_name))
         return target
 
-    def get_addon_info(self, addon_id: int):
+    @staticmethod
+    def _range_start(response):
         """
-        Checks if info about an addon is available
-        :param addon_id: the id of the addon
-        :return: the addon info
+        :return: where the body of a 206 starts in the file, None if its Content-Range can't be read
+        """
+        m = re.match(r'^\s*bytes\s+(\d+)-', response.headers.get('content-range', ''))
+        return int(m.group(1)) if m else None
+
+    def add_file(self, addon_file: AddonFile, src=None):
+        """
+        Stores a file from a stream instead of the network (bundle imports)
+        :param addon_file: info of the file, already in the index
+        :param src: readable with the file's contents, None to only take what's already stored
+        :return: where the file is stored, None if it couldn't be
         """
         p = os.path
-        addon_data = p.join(self.store_dir, 'data', 'addons', '{}.json'.format(addon_id))
+        target = self.file_path(addon_file)
+
+        with self.file_lock(addon_file.uid):
+            if p.isfile(target):
+                if p.getsize(target) == addon_file.length and self.check_fingerprint(addon_file, target):
+                    self.usage.touch(addon_file.uid)
+                    return target
+                os.remove(target)
+
+            Path(p.dirname(target)).mkdir(parents=True, exist_ok=True)
+            if not self._link_object(addon_file, target):
+                if src is None:
+                    return None
+
+                part = target + '.part'
+                with open(part, 'wb') as f:
+                    shutil.copyfileobj(src, f, self.chunk_size)
+                try:
+                    self._finish_part(addon_file, part, target)
+                except IOError as e:
+                    logger.h_except(e)
+                    return None
+
+        self.usage.touch(addon_file.uid)
+        return target
+
+    def _finish_part(self, addon_file: AddonFile, part: str, target: str, stripped: int = None):
+        """
+        Moves a complete part file into place, as long as its fingerprint checks out
+        :param addon_file: info of the downloaded file
+        :param part: the complete part file
+        :param target: where the file goes
+        :param stripped: its stripped length if it was counted while downloading, saves a read
+        """
+        if self.verify and addon_file.fingerprint not in (None, -1):
+            with self.metrics.timer('cmpd_fingerprint_seconds'):
+                fingerprint = fingerprint_file(part, stripped)
+            if fingerprint != addon_file.fingerprint:
+                # Not resumable, the bad bytes could be anywhere
+                os.remove(part)
+                raise IOError('Fingerprint mismatch for [{}], got [{}] expected [{}]'
+                              .format(addon_file.d_name, fingerprint, addon_file.fingerprint))
+            os.replace(part, target)
+            self._set_verified(target, fingerprint)
+            self._add_object(target, fingerprint)
+            return
+
+        os.replace(part, target)
+
+    def _load_verified(self):
+        if self._verified is not None:
+            return self._verified
+
+        verified_file = os.path.join(self.store_dir, 'data', 'verified.json')
+        try:
+            with open(verified_file, 'r') as f:
+                self._verified = json.load(f)
+        except (OSError, ValueError):
+            self._verified = {}
+
+        return self._verified
+
+    def _set_verified(self, path: str, fingerprint: int):
+        size, mtime = file_stamp(path)
+        with self._verified_lock:
+            key = os.path.relpath(path, self.store_dir)
+            self._load_verified()[key] = [size, mtime, fingerprint]
+            self._verified_changed.add(key)
+
+    def _get_verified(self, path: str):
+        with self._verified_lock:
+            entry = self._load_verified().get(os.path.relpath(path, self.store_dir))
+
+        if entry is None or list(file_stamp(path)) != entry[:2]:
+            return None
+        return entry[2]
+
+    def save_verified(self):
+        """
+        Writes the verification cache back to the store, if anything changed,
+        keeping what other processes sharing the store saved in the meantime
+        """
+        with self._verified_lock:
+            if len(self._verified_changed) == 0:
+                return
+
+            self._verified = update_json(os.path.join(self.store_dir, 'data', 'verified.json'),
+                                         lambda data: merge_changed(data, self._verified, self._verified_changed))
+            self._verified_changed = set()
+
+    def _forget_verified(self, path: str):
+        # A file or everything under a folder
+        rel = os.path.relpath(path, self.store_dir)
+        prefix = rel + os.sep
+        with self._verified_lock:
+            verified = self._load_verified()
+            for key in [i for i in verified.keys() if i == rel or i.startswith(prefix)]:
+                verified.pop(key)
+                self._verified_changed.add(key)
+
+    def check_fingerprint(self, addon_file: AddonFile, path: str):
+        """
+        Checks a stored file against its fingerprint, skips the hashing
+        if the file hasn't changed since it was last verified
+        :param addon_file: info of the file
+        :param path: the stored file
+        :return: whether the file matches (always true with verify off or no known fingerprint)
+        """
+        if not self.verify or addon_file.fingerprint in (None, -1):
+            return True
+
+        fingerprint = self._get_verified(path)
+        if fingerprint is None:
+            with self.metrics.timer('cmpd_fingerprint_seconds'):
+                fingerprint = fingerprint_file(path)
+            self._set_verified(path, fingerprint)
 
-        # Check if it exists first
-        if not (p.exists(addon_data) and p.isfile(addon_data)):
+        if fingerprint != addon_file.fingerprint:
             return False
 
-        # TODO : Handle Exceptions
-        a_data = open(addon_data, 'r').read()
-        if len(a_data) == 0:
-            logger.critical('XX [addon_data] for [{}] is empty!! returning a false!'.format(addon_id))
+        self._add_object(path, fingerprint)
+        return True
+
+    def _object_path(self, fingerprint: int):
+        return os.path.join(self.store_dir, 'objects', '{:08x}'.format(fingerprint))
+
+    def _add_object(self, path: str, fingerprint: int):
+        """
+        Registers a verified file as the stored copy of its contents
+        :param path: the verified file
+        :param fingerprint: its fingerprint
+        """
+        if not self.dedupe:
+            return
+
+        obj = self._object_path(fingerprint)
+        if os.path.exists(obj):
+            return
+
+        try:
+            Path(os.path.dirname(obj)).mkdir(parents=True, exist_ok=True)
+            os.link(path, obj)
+        except FileExistsError:
+            return
+        except OSError as e:
+            logger.h_except(e)
+            logger.warning(' ! Store does not support hardlinks, identical files will not be shared.')
+            self.dedupe = False
+            return
+
+        # Same inode, so the same stamp as the file that was just verified
+        self._set_verified(obj, fingerprint)
+
+    def _drop_object(self, obj: str):
+        try:
+            os.remove(obj)
+        except FileNotFoundError:
+            pass
+        self._forget_verified(obj)
+
+    def _find_object(self, addon_file: AddonFile):
+        """
+        :return: the stored object with the file's contents, None if there's none
+        """
+        if not (self.dedupe and self.verify) or addon_file.fingerprint in (None, -1):
+            return None
+
+        obj = self._object_path(addon_file.fingerprint)
+        if not (os.path.isfile(obj) and os.path.getsize(obj) == addon_file.length):
+            return None
+        return obj
+
+    def _link_object(self, addon_file: AddonFile, target: str):
+        """
+        Puts already stored identical contents at target instead of downloading them
+        :param addon_file: info of the file that's needed
+        :param target: where the file goes
+        :return: whether the file is now in place
+        """
+        obj = self._find_object(addon_file)
+        if obj is None:
+            return False
+
+        # Objects share their inode with stored files, whatever got written into one of those is in here too
+        fingerprint = self._get_verified(obj)
+        if fingerprint is None:
+            with self.metrics.timer('cmpd_fingerprint_seconds'):
+                fingerprint = fingerprint_file(obj)
+            self._set_verified(obj, fingerprint)
+        if fingerprint != addon_file.fingerprint:
+            logger.warning(' X Stored content for [{}] does not match its fingerprint, dropping it.'
+                           .format(addon_file.d_name))
+            self._drop_object(obj)
+            return False
+
+        try:
+            os.link(obj, target)
+        except OSError as e:
+            logger.h_except(e)
+            return False
+
+        self._set_verified(target, fingerprint)
+        return True
+
+    def verify_store(self, jobs: int = None, repair: bool = True):
+        """
+        Checks every stored file against its fingerprint, hashing in parallel
+        over all the cpu cores. Corrupted files get removed and, if asked to, downloaded again.
+        :param jobs: how many processes to hash with, defaults to the cpu count
+        :param repair: redownload corrupted files
+        :return: dict of counters
+        """
+        p = os.path
+        files_dir = p.join(self.store_dir, 'files')
+        summary = {'checked': 0, 'cached': 0, 'skipped': 0, 'corrupted': 0, 'repaired': 0}
+
+        if not p.isdir(files_dir):
+            return summary
+
+        pending = []
+        for uid in os.listdir(files_dir):
+            info = self.get_file_info(uid)
+            if not info:
+                logger.warning(' ! No info stored for [{}], cannot verify it'.format(uid))
+                summary['skipped'] += 1
+                continue
+
+            target = p.join(files_dir, uid, info.file_name)
+            if not p.isfile(target) or info.fingerprint in (None, -1):
+                summary['skipped'] += 1
+                continue
+
+            if self._get_verified(target) == info.fingerprint:
+                summary['cached'] += 1
+                continue
+
+            pending.append((info, target))
+
+        logger.info('-- Verifying [{}] files, [{}] already verified.'.format(len(pending), summary['cached']))
+
+        # Pulls in multiprocessing, only verify needs it
+        from concurrent.futures import ProcessPoolExecutor
+
+        corrupted = []
+        with ProcessPoolExecutor(max_workers=jobs) as pool:
+            fingerprints = pool.map(fingerprint_file, [i[1] for i in pending], chunksize=4)
+            for (info, target), fingerprint in zip(pending, fingerprints):
+                summary['checked'] += 1
+                self._set_verified(target, fingerprint)
+                if fingerprint != info.fingerprint:
+                    logger.warning(' X File [{}] does not match its fingerprint.'.format(info.d_name))
+                    corrupted.append((info, target))
+
+        self.save_verified()
+        summary['corrupted'] = len(corrupted)
+
+        for info, target in corrupted:
+            with self.file_lock(info.uid):
+                # Someone else may have repaired it while we were hashing
+                if self._get_verified(target) not in (None, info.fingerprint):
+                    # Corrupted in place means its object (same inode) is too
+                    obj = self._object_path(info.fingerprint)
+                    if p.isfile(obj) and p.samefile(obj, target):
+                        self._drop_object(obj)
+                    os.remove(target)
+            if repair and self.download_to_store(info):
+                summary['repaired'] += 1
+
+        self.save_verified()
+        return summary
+
+    def _stored_files(self):
+        """
+        :return: {file_id: (folder, size in bytes, last used, last modified)} of everything under files/
+        """
+        files_dir = os.path.join(self.store_dir, 'files')
+        stored = {}
+        if not os.path.isdir(files_dir):
+            return stored
+
+        for uid in os.listdir(files_dir):
+            folder = os.path.join(files_dir, uid)
+            if not os.path.isdir(folder):
+                continue
+
+            size = 0
+            mtime = 0
+            for entry in os.scandir(folder):
+                if entry.is_file(follow_symlinks=False):
+                    _stat = entry.stat(follow_symlinks=False)
+                    size += _stat.st_size
+                    mtime = max(mtime, _stat.st_mtime)
+            # Files from before usage was tracked count as used when they were written
+            stored[uid] = (folder, size, self.usage.last_used(uid, mtime), mtime)
+
+        return stored
+
+    def _in_use(self, stored: dict):
+        """
+        Files no output folder references that still must not go: the ones stored before usage
+        was tracked, and the ones another process wrote since we started, a running install
+        only records its refs once it's done with them
+        :param stored: from _stored_files
+        :return: their file ids
+        """
+        since = max(self.opened, time.time() - BUSY_FOR)
+        return set(uid for uid, (_, _, _, modified) in stored.items()
+                   if not self.usage.tracked(uid) or (modified >= since and not self.usage.touched(uid)))
+
+    def _remove_stored(self, file_id: str, folder: str):
+        """
+        Removes a stored file, unless another process is busy with it
+        :return: whether it was removed
+        """
+        lock = self.file_lock(file_id)
+        if not lock.acquire(blocking=False):
+            logger.info(' ! File [{}] is in use by another process, keeping it.'.format(file_id))
             return False
-        return AddonInfo.create_from_store(json.loads(a_data), self)
+
+        try:
+            shutil.rmtree(folder)
+            if os.path.isfile(self.manifest_path(file_id)):
+                os.remove(self.manifest_path(file_id))
+        finally:
+            lock.release()
+
+        self._forget_verified(folder)
+        self.usage.forget([file_id])
+        return True
+
+    def _sweep_objects(self, dry_run: bool = False):
+        """
+        Removes objects nothing under files/ links to anymore
+        :return: (objects removed, bytes freed)
+        """
+        objects_dir = os.path.join(self.store_dir, 'objects')
+        if not os.path.isdir(objects_dir):
+            return 0, 0
+
+        count = 0
+        size = 0
+        for entry in os.scandir(objects_dir):
+            _stat = entry.stat(follow_symlinks=False)
+            if _stat.st_nlink != 1:
+                continue
+            if not dry_run:
+                try:
+                    os.remove(entry.path)
+                except OSError as e:
+                    logger.h_except(e)
+                    continue
+                self._forget_verified(entry.path)
+            count += 1
+            size += _stat.st_size
+
+        return count, size
+
+    def collect_garbage(self, dry_run: bool = False):
+        """
+        Removes stored files no output folder uses anymore (nor a running install, see _in_use),
+        their infos and orphaned objects
+        :param dry_run: only count what would go
+        :return: dict of counters
+        """
+        summary = {'files': 0, 'bytes': 0, 'infos': 0, 'objects': 0}
+        used, _ = self.usage.referenced()
+
+        removed = set()
+        stored = self._stored_files()
+        busy = self._in_use(stored)
+        for uid, (folder, size, _, _) in stored.items():
+            if uid in used or uid in busy:
+                continue
+            if dry_run or self._remove_stored(uid, folder):
+                removed.add(uid)
+                summary['files'] += 1
+                summary['bytes'] += size
+
+        # Pack infos point at their latest files, those infos stay even without a payload
+        keep = set(used)
+        for addon in self.index.iter_addons():
+            keep.update(str(i) for i in addon['latest_files'])
+
+        orphans = [i['uid'] for i in self.index.iter_files()
+                   if str(i['uid']) not in keep and (str(i['uid']) not in stored or str(i['uid']) in removed)]
+        if not dry_run:
+            self.index.drop_files(orphans)
+        summary['infos'] = len(orphans)
+
+        summary['objects'], _freed = self._sweep_objects(dry_run)
+        summary['bytes'] += _freed
+
+        if not dry_run:
+            self.usage.save()
+            self.save_verified()
+        return summary
+
+    def evict(self, max_size: int, dry_run: bool = False):
+        """
+        Removes the least recently used files until the store fits in max_size,
+        files no output folder uses go first, files an output folder symlinks to,
+        a running install is applying or may be using (see _in_use) never do
+        :param max_size: bytes the store should fit in
+        :param dry_run: only count what would go
+        :return: dict of counters
+        """
+        _, freed = self._sweep_objects(dry_run)
+        used, pinned = self.usage.referenced()
+        stored = self._stored_files()
+
+        total = sum(i[1] for i in stored.values())
+        summary = {'files': 0, 'bytes': freed, 'size': total}
+        if total > max_size:
+            keep = pinned | self._in_use(stored)
+            order = sorted((i for i in stored.keys() if i not in keep), key=lambda i: (i in used, stored[i][2]))
+            for uid in order:
+                if total <= max_size:
+                    break
+                folder, size, _, _ = stored[uid]
+                if dry_run or self._remove_stored(uid, folder):
+                    total -= size
+                    summary['files'] += 1
+                    summary['bytes'] += size
+
+            # Objects of the evicted files
+            summary['bytes'] += self._sweep_objects(dry_run)[1]
+
+        summary['size'] = total
+        # Costs a lot to import (pkg_resources), only needed for the report
+        import humanize
+        if total > max_size:
+            logger.warning(' ! Store is still [{}], over the [{}] limit.'
+                           .format(humanize.naturalsize(total), humanize.naturalsize(max_size)))
+        elif summary['files'] > 0 and not dry_run:
+            logger.info(' / Evicted [{}] files, store is now [{}].'
+                        .format(summary['files'], humanize.naturalsize(total)))
+
+        if not dry_run:
+            self.usage.save()
+            self.save_verified()
+        return summary
+
+    def get_addon_info(self, addon_id: int):
+        """
+        Checks if info about an addon is available
+        :param addon_id: the id of the addon
+        :return: the addon info
+        """
+        a_data = self.index.get_addon(addon_id)
+        if not a_data:
+            return False
+        return AddonInfo.create_from_store(a_data, self)
 
     def get_file_info(self, file_id):
         """
@@ -202,19 +894,22 @@ class ModStore:
         :param file_id: the file id to test for
         :return:
         """
-        p = os.path
-        file_data = p.join(self.store_dir, 'data', 'files', '{}.json'.format(file_id))
-
-        # Check if it exists first
-        if not (p.exists(file_data) and p.isfile(file_data)):
+        a_data = self.index.get_file(file_id)
+        if not a_data:
             return False
+        return AddonFile.create_from_store(a_data)
 
-        # TODO : Handle Exceptions
-        a_data = open(file_data, 'r').read()
-        if len(a_data) == 0:
-            logger.critical('XX [file_data] for [{}] is empty!! returning a false!'.format(file_id))
-            return False
-        return AddonFile.create_from_store(json.loads(a_data))
+    def newest_file(self, file_ids: list, timestamps: dict = None):
+        """
+        Picks the most recent file from the index, without making infos of the others
+        :param file_ids: the files to pick from, the first one wins on ties
+        :param timestamps: their timestamps (str keys) if the addon record has them
+        :return: the file info, None if the store has none of them
+        """
+        f_data = self.index.get_newest_file(file_ids, timestamps)
+        if not f_data:
+            return None
+        return AddonFile.create_from_store(f_data)
 
     def get_file_with_id(self, file_id):
         """
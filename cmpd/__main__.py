@@ -1,15 +1,406 @@
 import argparse
+import json
+import os
+import sys
 
-from cmpd import CMPD
+from cmpd.linker import LINK_MODES
+from cmpd.logger import logger, move_info_logs, setup_logging, LOG_LEVELS
+from cmpd.metrics import METRICS_FORMATS
 
-parser = argparse.ArgumentParser(description='Tool for downloading modpacks from curseforge')
-parser.add_argument('addon_id', type=str, help='the project id of the modpack')
-parser.add_argument('-o', '--out', metavar='OUTPUT_FOLDER', default='modpack',
-                    help='where to save the modpack output (minecraft folder)')
-parser.add_argument('-s', '--store', metavar='APP_FOLDER', default='cmpd_store',
-                    help='where to store local copies of the mod files')
 
-args = parser.parse_args()
+# ------------------------------------
+# Command line
+# ------------------------------------
+#  every command imports what it needs itself, --help and the daemon client
+#   shouldn't wait on requests, sqlite, asyncio, ... to load
+#  options shared by several commands are declared once below and added as parents
+# ------------------------------------
 
-downloader = CMPD(args.addon_id, store_dir=args.store, out_dir=args.out)
-downloader.download_modpack()
+def _index_args():
+    parser = argparse.ArgumentParser(add_help=False)
+    parser.add_argument('--index', choices=['auto', 'json', 'sqlite'], default='auto',
+                        help='how the store keeps mod infos (auto uses sqlite if the store has been migrated)')
+    return parser
+
+
+def _download_args():
+    """
+    How mods get fetched into the store: install, batch and daemon
+    """
+    parser = argparse.ArgumentParser(add_help=False, parents=[_index_args()])
+    parser.add_argument('-t', '--timeout', metavar='SECONDS', type=float, default=60,
+                        help='how long to wait on a stalled connection before giving up')
+    parser.add_argument('--no-verify', action='store_true',
+                        help='skip checking the fingerprints of the mod files')
+    _cache = parser.add_mutually_exclusive_group()
+    _cache.add_argument('--refresh', action='store_const', dest='cache_mode', const='refresh', default='normal',
+                        help='ask the api again for everything, ignoring cached answers')
+    _cache.add_argument('--offline', action='store_const', dest='cache_mode', const='offline',
+                        help='only use what the store and cache already have, never touch the network')
+    parser.add_argument('--retries', metavar='N', type=int, default=3,
+                        help='attempts per download, with exponential backoff in between')
+    parser.add_argument('--mirror', metavar='URL', action='append', dest='mirrors', default=None,
+                        help='base url serving the same files as the download urls, can be given several times')
+    parser.add_argument('--hedge-after', metavar='SECONDS', type=float, default=None,
+                        help='send a second request for downloads that have not answered after SECONDS')
+    return parser
+
+
+def _pack_args():
+    """
+    How packs get applied to their output folder: install and batch
+    """
+    parser = argparse.ArgumentParser(add_help=False)
+    parser.add_argument('-b', '--batch-size', metavar='BATCH_SIZE', type=int, default=50,
+                        help='how many file infos to ask the api for at once')
+    parser.add_argument('--progress', choices=['auto', 'tty', 'log', 'json', 'none'], default='auto',
+                        help='how download progress is shown (auto picks tty on a terminal, log otherwise)')
+    parser.add_argument('--full', action='store_true',
+                        help='apply the whole pack again instead of only what changed since the last run')
+    parser.add_argument('--api-base', metavar='URL', default=None,
+                        help='root of the api (defaults to https://addons-ecs.forgesvc.net/api/v2/)')
+    parser.add_argument('--link-mode', choices=LINK_MODES, default='copy',
+                        help='how mods get from the store into the output folder (falls back to copy)')
+    parser.add_argument('--max-store-size', metavar='SIZE', default=None,
+                        help='evict least recently used store files after the run until the store fits (10G, 500M)')
+    parser.add_argument('--metrics', metavar='FILE', default=None,
+                        help='write timings and counters of every stage to FILE once done')
+    parser.add_argument('--metrics-format', choices=METRICS_FORMATS, default='json',
+                        help='format of the metrics file')
+    return parser
+
+
+def _json_progress(args):
+    # Json progress owns stdout, so whatever drives us can parse every line of it
+    if args.progress == 'json':
+        move_info_logs(sys.stderr)
+
+
+# Flags a daemon can't change per install, it keeps the ones it was started with
+_DAEMON_FIXED = (('jobs', '--jobs'), ('timeout', '--timeout'), ('index', '--index'), ('retries', '--retries'),
+                 ('mirrors', '--mirror'), ('hedge_after', '--hedge-after'))
+
+
+def install(argv):
+    parser = argparse.ArgumentParser(description='Tool for downloading modpacks from curseforge',
+                                     parents=[_download_args(), _pack_args()])
+    parser.add_argument('addon_id', type=str, help='the project id of the modpack')
+    parser.add_argument('-o', '--out', metavar='OUTPUT_FOLDER', default='modpack',
+                        help='where to save the modpack output (minecraft folder)')
+    parser.add_argument('-s', '--store', metavar='APP_FOLDER', default='cmpd_store',
+                        help='where to store local copies of the mod files')
+    parser.add_argument('-j', '--jobs', metavar='JOBS', type=int, default=4,
+                        help='how many mods to download at the same time')
+    parser.add_argument('--progress-interval', metavar='SECONDS', type=float, default=1.0,
+                        help='how often download progress is shown')
+    parser.add_argument('--plan', action='store_true',
+                        help='only show how much would be downloaded, reused or is already there')
+    parser.add_argument('--no-daemon', action='store_true',
+                        help='install in this process even if a daemon serves the store')
+
+    args = parser.parse_args(argv)
+    _json_progress(args)
+
+    from cmpd.client import DaemonClient
+
+    # A daemon serving the store does it with everything already warm, unless it'd have to drop some of the flags
+    if not (args.no_daemon or args.plan or args.metrics):
+        client = DaemonClient.find(args.store)
+        if client is not None:
+            fixed = [flag for dest, flag in _DAEMON_FIXED if getattr(args, dest) != parser.get_default(dest)]
+            if len(fixed) == 0:
+                return install_with_daemon(client, args)
+            logger.info(' / Not installing through the daemon at [{}:{}], it can\'t honour {}, '
+                        'installing in this process'.format(client.host, client.port, fixed))
+
+    from cmpd.installer import CMPD
+
+    downloader = CMPD(args.addon_id, store_dir=args.store, out_dir=args.out, jobs=args.jobs,
+                      batch_size=args.batch_size, timeout=(10, args.timeout), verify=not args.no_verify,
+                      index=args.index, link_mode=args.link_mode, progress=args.progress,
+                      progress_interval=args.progress_interval, api_base=args.api_base, full=args.full,
+                      cache_mode=args.cache_mode, max_store_size=args.max_store_size,
+                      metrics_path=args.metrics, metrics_format=args.metrics_format, retries=args.retries,
+                      mirrors=args.mirrors, hedge_after=args.hedge_after)
+    if args.plan:
+        if downloader.plan_modpack() is None:
+            sys.exit(1)
+        return
+    downloader.download_modpack()
+
+
+def install_with_daemon(client, args):
+    from cmpd.progress import make_sink
+
+    logger.info('-- Installing through the daemon at [{}:{}] (cache mode [{}], verify [{}], progress interval [{}] '
+                'forwarded)'.format(client.host, client.port, args.cache_mode, not args.no_verify,
+                                    args.progress_interval))
+    sink = make_sink(args.progress)
+
+    def on_event(event: dict):
+        kind = event.pop('type')
+        if kind == 'log':
+            logger.log(event['level'], event['message'])
+        elif kind == 'queued':
+            logger.info(' / Waiting for the daemon to finish installing [{}]'.format(event['running']))
+        elif sink is None:
+            return
+        elif kind == 'progress':
+            sink.report(event)
+        elif kind == 'done':
+            sink.close(event)
+        else:
+            sink.event(kind, event)
+
+    result = client.install({
+        'project_id': args.addon_id,
+        'out_dir': os.path.abspath(args.out),
+        'full': args.full,
+        'link_mode': args.link_mode,
+        'batch_size': args.batch_size,
+        'api_base': args.api_base,
+        'max_store_size': args.max_store_size,
+        'cache_mode': args.cache_mode,
+        'verify': not args.no_verify,
+        'progress_interval': args.progress_interval,
+    }, on_event)
+
+    # Same as in process, no pack info is the only thing that fails the command
+    if result.get('name') is None:
+        sys.exit(-1)
+
+
+def daemon(argv):
+    parser = argparse.ArgumentParser(prog='cmpd daemon',
+                                     description='Serves installs against a store, keeping it warm in between',
+                                     parents=[_download_args()])
+    parser.add_argument('-s', '--store', metavar='APP_FOLDER', default='cmpd_store',
+                        help='the store to serve')
+    parser.add_argument('-p', '--port', type=int, default=0,
+                        help='port to listen on (127.0.0.1), any free one by default')
+    parser.add_argument('-j', '--jobs', metavar='JOBS', type=int, default=4,
+                        help='how many mods each install downloads at the same time')
+    parser.add_argument('--progress-interval', metavar='SECONDS', type=float, default=1.0,
+                        help='how often download progress is sent to clients')
+    _action = parser.add_mutually_exclusive_group()
+    _action.add_argument('--status', action='store_true',
+                         help='show what the daemon serving the store is up to')
+    _action.add_argument('--stop', action='store_true',
+                         help='stop the daemon serving the store')
+
+    args = parser.parse_args(argv)
+
+    from cmpd.client import DaemonClient
+
+    client = DaemonClient.find(args.store)
+    if args.status or args.stop:
+        if client is None:
+            logger.error(' x No daemon is serving [{}]'.format(args.store))
+            sys.exit(1)
+        if args.stop:
+            client.shutdown()
+            logger.info('-- Daemon stopping.')
+        else:
+            print(json.dumps(client.status(), indent=2))
+        return
+
+    if client is not None:
+        logger.error(' x A daemon already serves [{}] on [{}:{}]'.format(args.store, client.host, client.port))
+        sys.exit(1)
+
+    from cmpd.daemon import CMPDDaemon
+    from cmpd.policy import DownloadPolicy
+
+    policy = DownloadPolicy(retries=args.retries, mirrors=args.mirrors, hedge_after=args.hedge_after)
+    CMPDDaemon(args.store, port=args.port, jobs=args.jobs, timeout=(10, args.timeout), verify=not args.no_verify,
+               index=args.index, cache_mode=args.cache_mode, policy=policy,
+               progress_interval=args.progress_interval).serve()
+
+
+def verify(argv):
+    parser = argparse.ArgumentParser(prog='cmpd verify',
+                                     description='Checks every file in the store against its fingerprint',
+                                     parents=[_index_args()])
+    parser.add_argument('-s', '--store', metavar='APP_FOLDER', default='cmpd_store',
+                        help='the store to check')
+    parser.add_argument('-j', '--jobs', metavar='JOBS', type=int, default=None,
+                        help='how many processes to hash with (defaults to the cpu count)')
+    parser.add_argument('--no-repair', action='store_true',
+                        help='only remove corrupted files instead of downloading them again')
+
+    args = parser.parse_args(argv)
+
+    from cmpd.ModStore import ModStore
+
+    store = ModStore(args.store, index=args.index)
+    summary = store.verify_store(jobs=args.jobs, repair=not args.no_repair)
+    logger.info('-- Checked [{checked}], already verified [{cached}], skipped [{skipped}], '
+                'corrupted [{corrupted}], repaired [{repaired}]'.format(**summary))
+
+
+def migrate(argv):
+    parser = argparse.ArgumentParser(prog='cmpd migrate',
+                                     description='Imports the json mod infos of a store into a sqlite index')
+    parser.add_argument('-s', '--store', metavar='APP_FOLDER', default='cmpd_store',
+                        help='the store to migrate')
+
+    args = parser.parse_args(argv)
+
+    from cmpd.index import JsonIndex, SqliteIndex
+
+    source = JsonIndex(args.store)
+    target = SqliteIndex(args.store)
+    addons, files = target.import_from(source)
+    target.close()
+    logger.info('-- Imported [{}] addons and [{}] files into [{}]'.format(addons, files, target.db_file))
+
+
+def gc(argv):
+    parser = argparse.ArgumentParser(prog='cmpd gc',
+                                     description='Removes store files no output folder uses anymore',
+                                     parents=[_index_args()])
+    parser.add_argument('-s', '--store', metavar='APP_FOLDER', default='cmpd_store',
+                        help='the store to clean up')
+    parser.add_argument('--max-store-size', metavar='SIZE', default=None,
+                        help='then evict least recently used files until the store fits (10G, 500M)')
+    parser.add_argument('--dry-run', action='store_true',
+                        help='only show what would be removed')
+
+    args = parser.parse_args(argv)
+
+    import humanize
+    from cmpd.ModStore import ModStore
+    from cmpd.usage import parse_size
+
+    store = ModStore(args.store, index=args.index)
+    summary = store.collect_garbage(dry_run=args.dry_run)
+    logger.info('-- {} [{}] unused files, [{}] infos and [{}] objects, [{}]'.format(
+        'Would remove' if args.dry_run else 'Removed', summary['files'], summary['infos'], summary['objects'],
+        humanize.naturalsize(summary['bytes'])))
+
+    if args.max_store_size:
+        summary = store.evict(parse_size(args.max_store_size), dry_run=args.dry_run)
+        logger.info('-- {} [{}] more files, [{}], store is [{}]'.format(
+            'Would evict' if args.dry_run else 'Evicted', summary['files'],
+            humanize.naturalsize(summary['bytes']), humanize.naturalsize(summary['size'])))
+
+
+def export(argv):
+    parser = argparse.ArgumentParser(prog='cmpd export',
+                                     description='Writes a pack and every mod it uses from the store to one bundle',
+                                     parents=[_index_args()])
+    parser.add_argument('addon_id', type=str, help='the project id of the modpack')
+    parser.add_argument('-o', '--out', metavar='BUNDLE', default=None,
+                        help='the bundle to write (defaults to {addon_id}.cmpd.zip)')
+    parser.add_argument('-s', '--store', metavar='APP_FOLDER', default='cmpd_store',
+                        help='the store the pack was installed from')
+    parser.add_argument('--file-id', metavar='FILE_ID', default=None,
+                        help='the pack file to export (defaults to the newest one)')
+
+    args = parser.parse_args(argv)
+
+    import humanize
+    from cmpd.ModStore import ModStore
+    from cmpd.bundle import export_bundle
+
+    store = ModStore(args.store, index=args.index)
+    out = args.out or '{}.cmpd.zip'.format(args.addon_id)
+    summary = export_bundle(store, args.addon_id, out, file_id=args.file_id)
+    if summary is None:
+        sys.exit(1)
+    logger.info('-- Exported [{}] files as [{}] blobs, [{}] to [{}]'.format(
+        summary['files'], summary['blobs'], humanize.naturalsize(summary['bytes']), out))
+
+
+def import_(argv):
+    parser = argparse.ArgumentParser(prog='cmpd import',
+                                     description='Fills a store from a bundle, without touching the network',
+                                     parents=[_index_args()])
+    parser.add_argument('bundle', help='the bundle to import')
+    parser.add_argument('-s', '--store', metavar='APP_FOLDER', default='cmpd_store',
+                        help='the store to fill')
+    parser.add_argument('--no-verify', action='store_true',
+                        help='skip checking imported files against their fingerprint')
+
+    args = parser.parse_args(argv)
+
+    import humanize
+    from cmpd.ModStore import ModStore
+    from cmpd.bundle import import_bundle
+
+    store = ModStore(args.store, index=args.index, verify=not args.no_verify, offline=True)
+    summary = import_bundle(store, args.bundle)
+    logger.info('-- Imported [{}], already stored [{}], failed [{}], [{}]'.format(
+        summary['imported'], summary['present'], summary['failed'], humanize.naturalsize(summary['bytes'])))
+    if summary['failed'] > 0:
+        sys.exit(1)
+
+
+def batch(argv):
+    parser = argparse.ArgumentParser(prog='cmpd batch',
+                                     description='Installs several modpacks against one shared store',
+                                     parents=[_download_args(), _pack_args()])
+    parser.add_argument('packs', nargs='*', metavar='PACK_ID:OUTPUT_FOLDER',
+                        help='the packs to install and where to')
+    parser.add_argument('-f', '--file', metavar='JOBS_FILE',
+                        help='file with one `pack_id output_folder` per line')
+    parser.add_argument('-s', '--store', metavar='APP_FOLDER', default='cmpd_store',
+                        help='where to store local copies of the mod files')
+    parser.add_argument('-j', '--jobs', metavar='JOBS', type=int, default=4,
+                        help='how many mods to download at the same time, over all the packs')
+
+    args = parser.parse_args(argv)
+    _json_progress(args)
+
+    from cmpd.batch import CMPDBatch, read_jobs
+
+    try:
+        jobs = read_jobs(args.packs)
+        if args.file:
+            with open(args.file, 'r') as f:
+                jobs += read_jobs(f)
+    except ValueError as e:
+        parser.error(str(e))
+    if len(jobs) == 0:
+        parser.error('no packs given')
+
+    runner = CMPDBatch(jobs, store_dir=args.store, jobs=args.jobs, timeout=(10, args.timeout),
+                       verify=not args.no_verify, index=args.index, progress=args.progress,
+                       cache_mode=args.cache_mode, batch_size=args.batch_size, link_mode=args.link_mode,
+                       full=args.full, api_base=args.api_base, max_store_size=args.max_store_size,
+                       metrics_path=args.metrics, metrics_format=args.metrics_format, retries=args.retries,
+                       mirrors=args.mirrors, hedge_after=args.hedge_after)
+    summary = runner.run()
+    if not all(i['ok'] and len(i['failed']) == 0 for i in summary):
+        sys.exit(1)
+
+
+COMMANDS = {
+    'batch': batch,
+    'daemon': daemon,
+    'export': export,
+    'import': import_,
+    'gc': gc,
+    'verify': verify,
+    'migrate': migrate,
+}
+
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+
+    # Shared by every command, taken out before the command parses the rest
+    _log = argparse.ArgumentParser(add_help=False, allow_abbrev=False)
+    _log.add_argument('--log-file', metavar='FILE', default='cmpd2.log')
+    _log.add_argument('--no-log-file', action='store_const', dest='log_file', const=None)
+    _log.add_argument('--log-level', choices=LOG_LEVELS, default='debug')
+    log_args, argv = _log.parse_known_args(argv)
+    setup_logging(log_args.log_file, log_args.log_level)
+
+    if len(argv) > 0 and argv[0] in COMMANDS:
+        return COMMANDS[argv[0]](argv[1:])
+    return install(argv)
+
+
+if __name__ == '__main__':
+    main()
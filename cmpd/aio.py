@@ -0,0 +1,170 @@
+import asyncio
+import time
+
+from concurrent.futures import Executor
+
+from cmpd.installer import CMPD
+from cmpd.logger import logger
+
+
+# ------------------------------------
+# Asyncio front
+# ------------------------------------
+#  AsyncCMPD builds its CMPD (store folders, index, api cache) and runs each
+#   blocking phase of it (prepare, pipeline, finish) on an executor thread,
+#   the event loop never waits on the network or the disk.
+#  the pipeline keeps its own download threads and pooled connections,
+#   so an install costs the loop one executor thread, not one per download.
+#  cancelling the task (or calling cancel()) stops the downloads at their next
+#   chunk, what made it to the output folder is kept for the next run
+# ------------------------------------
+
+class InstallResult:
+    def __init__(self, project_id, out_dir: str):
+        self.project_id = project_id
+        self.out_dir = out_dir
+        self.name = None
+        self.pack_file_id = None
+
+        self.ok = False
+        self.cancelled = False
+        self.error = None
+
+        # Mods applied this run, and the ones already there from the last one
+        self.files = []
+        self.unchanged = 0
+        self.failed = []
+        # Bytes of this run's downloads, resumed parts included
+        self.bytes = 0
+        # Seconds per phase
+        self.timings = {'prepare': 0, 'download': 0, 'finish': 0, 'total': 0}
+
+    def get_json(self):
+        return {
+            'project_id': self.project_id,
+            'out_dir': self.out_dir,
+            'name': self.name,
+            'pack_file_id': self.pack_file_id,
+            'ok': self.ok,
+            'cancelled': self.cancelled,
+            'error': self.error,
+            'files': self.files,
+            'unchanged': self.unchanged,
+            'failed': self.failed,
+            'bytes': self.bytes,
+            'timings': self.timings,
+        }
+
+    def __repr__(self):
+        return '<InstallResult {} ok={} files={} failed={} cancelled={}>'.format(
+            self.project_id, self.ok, len(self.files), len(self.failed), self.cancelled)
+
+
+class AsyncCMPD:
+    def __init__(self, project_id, executor: Executor = None, **kwargs):
+        """
+        :param project_id: the modpack's project id
+        :param executor: where the blocking phases run, defaults to the loop's default executor
+        :param kwargs: passed on to CMPD (store_dir, out_dir, jobs, store, session, ...)
+        """
+        kwargs.setdefault('progress', 'none')
+        self.project_id = project_id
+        self.executor = executor
+        # Built on the executor by download_modpack, it opens the store
+        self.cmpd: CMPD = None
+        self._kwargs = kwargs
+        self._cancelled = False
+
+    def _build(self):
+        if self.cmpd is None:
+            self.cmpd = CMPD(self.project_id, **self._kwargs)
+            # Cancelled while it was being built
+            if self._cancelled:
+                self.cmpd.cancel()
+        return self.cmpd
+
+    def cancel(self):
+        """
+        Stops the install, download_modpack then returns a result with cancelled set
+        """
+        self._cancelled = True
+        if self.cmpd is not None:
+            self.cmpd.cancel()
+
+    async def _offload(self, func, *args):
+        loop = asyncio.get_running_loop()
+        future = loop.run_in_executor(self.executor, func, *args)
+        try:
+            return await asyncio.shield(future)
+        except asyncio.CancelledError:
+            # The thread can't be interrupted, tell it to stop and wait until it has
+            self.cancel()
+            await asyncio.wait([future])
+            raise
+
+    async def download_modpack(self):
+        """
+        Installs the modpack without blocking the event loop
+        :return: an InstallResult, failures are reported there instead of raised
+        :raise asyncio.CancelledError: when the task gets cancelled, once everything has stopped
+        """
+        c = None
+        result = InstallResult(self.project_id, self._kwargs.get('out_dir'))
+        started = time.monotonic()
+        phase = started
+
+        def lap(name):
+            nonlocal phase
+            now = time.monotonic()
+            result.timings[name] = round(now - phase, 3)
+            phase = now
+
+        try:
+            c = await self._offload(self._build)
+            result.out_dir = c.out_dir
+            ready = await self._offload(c.prepare_modpack)
+            lap('prepare')
+            result.name = c.info.d_name if c.info else None
+
+            if not ready:
+                result.cancelled = c.cancelled.is_set()
+                result.error = 'Cancelled' if result.cancelled else 'Could not get the modpack or its manifest'
+                return result
+
+            result.pack_file_id = c.pack_file.uid
+            result.unchanged = len(c.pack_files) - len(c.new_files)
+
+            # Applied on the same thread, so a cancelled task still records what landed
+            await self._offload(lambda: c.apply_results(c.run_pipeline()))
+            lap('download')
+
+            if c.cancelled.is_set():
+                await self._offload(c.abort_modpack)
+                result.cancelled = True
+                result.error = 'Cancelled'
+            else:
+                await self._offload(c.finish_modpack)
+                result.ok = len(c.failed_mods) == 0
+            lap('finish')
+        except asyncio.CancelledError:
+            if c is not None:
+                await asyncio.shield(self._offload(c.abort_modpack))
+            raise
+        except Exception as e:
+            logger.h_except(e)
+            result.error = '{}: {}'.format(type(e).__name__, e)
+        finally:
+            # Nothing ran if the CMPD couldn't be built
+            if c is not None:
+                result.files = [{
+                    'uid': i.uid,
+                    'addon_uid': i.addon_uid,
+                    'file_name': i.file_name,
+                    'length': i.length,
+                } for i in c.mod_files]
+                result.failed = [str(i) for i in c.failed_mods]
+                result.bytes = c.progress.done
+                c.export_metrics()
+            result.timings['total'] = round(time.monotonic() - started, 3)
+
+        return result
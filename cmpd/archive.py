@@ -0,0 +1,152 @@
+import json
+import mmap
+import os
+import threading
+import zipfile
+
+from cmpd.fingerprint import file_stamp
+from cmpd.locks import atomic_write
+from cmpd.logger import logger
+
+
+# ------------------------------------
+# Pack archives
+# ------------------------------------
+#  pack files never change for a given file id, so what a run needs from the zip
+#   (the manifest and the [size, crc] of every override) is kept next to the store infos
+#   in data/manifests/{file_id}.json, keyed by the archive's size and mtime.
+#  an unchanged pack gets applied from that alone, the zip is only opened
+#   once overrides actually have to be extracted.
+#  the zip is read through a read only mmap, entries come straight from the page cache
+#   and one handle serves every extraction thread (zipfile serializes the seeks, not the inflating)
+# ------------------------------------
+
+def override_target(root: str, rel: str):
+    """
+    :param root: the output folder, absolute
+    :param rel: a path relative to it, from the pack or the state file
+    :return: where rel ends up, None if that's outside of root (zip entries can say ../../)
+    """
+    target = os.path.abspath(os.path.join(root, rel))
+    return target if target.startswith(root + os.sep) else None
+
+
+# Any absolute folder does, overrides only get checked against staying inside of it
+_ANY_ROOT = os.path.abspath(os.sep + 'overrides')
+
+
+def list_overrides(archive: zipfile.ZipFile):
+    """
+    :param archive: the modpack archive
+    :return: {path relative to the output folder: [size, crc]} of every override,
+             ones pointing outside of it are left out
+    """
+    overrides = {}
+    for i in archive.infolist():
+        if i.filename.startswith('overrides/') and not i.is_dir():
+            rel = i.filename[len('overrides/'):]
+            if override_target(_ANY_ROOT, rel) is not None:
+                overrides[rel] = [i.file_size, i.CRC]
+    return overrides
+
+
+class _MappedFile(mmap.mmap):
+    # zipfile wants a file object, mmap has all of it but seekable() before python 3.13
+    def seekable(self):
+        return True
+
+
+class PackArchive:
+    def __init__(self, path: str, cache_path: str = None):
+        """
+        :param path: the pack file
+        :param cache_path: where its manifest and overrides listing get cached, None to always read the zip
+        """
+        self.filename = path
+        self.cache_path = cache_path
+
+        self._lock = threading.Lock()
+        self._manifest = None
+        self._overrides = None
+        self._file = None
+        self._map = None
+        self._zip = None
+
+    def _load(self):
+        if self._manifest is not None:
+            return
+
+        stamp = list(file_stamp(self.filename))
+        if self.cache_path:
+            try:
+                with open(self.cache_path, 'r') as f:
+                    cached = json.load(f)
+                if cached['stamp'] == stamp:
+                    self._manifest = cached['manifest']
+                    self._overrides = cached['overrides']
+                    return
+            except (OSError, ValueError, KeyError):
+                pass
+
+        archive = self.zip
+        manifest = json.loads(archive.read('manifest.json').decode('utf-8'))
+        self._overrides = list_overrides(archive)
+        self._manifest = manifest
+
+        if self.cache_path:
+            try:
+                os.makedirs(os.path.dirname(self.cache_path), exist_ok=True)
+                with atomic_write(self.cache_path) as f:
+                    json.dump({'stamp': stamp, 'manifest': manifest, 'overrides': self._overrides}, f)
+            except OSError as e:
+                logger.h_except(e)
+
+    @property
+    def manifest(self):
+        with self._lock:
+            self._load()
+        return self._manifest
+
+    @property
+    def overrides(self):
+        with self._lock:
+            self._load()
+        return self._overrides
+
+    @property
+    def opened(self):
+        return self._zip is not None
+
+    @property
+    def zip(self):
+        """
+        The archive itself, mapped on first use
+        """
+        if self._zip is not None:
+            return self._zip
+
+        self._file = open(self.filename, 'rb')
+        try:
+            self._map = _MappedFile(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        except (ValueError, OSError):
+            # Empty or unmappable, zipfile reads it the usual way
+            self._map = None
+        self._zip = zipfile.ZipFile(self._map if self._map is not None else self._file, 'r')
+        return self._zip
+
+    def close(self):
+        if self._zip is not None:
+            self._zip.close()
+            self._zip = None
+        if self._map is not None:
+            self._map.close()
+            self._map = None
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
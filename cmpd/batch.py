@@ -0,0 +1,202 @@
+import os
+import re
+import time
+
+from typing import List, Tuple
+
+from cmpd.installer import CMPD
+from cmpd.ModStore import ModStore
+from cmpd.cache import ApiCache
+from cmpd.logger import logger
+from cmpd.metrics import Metrics, NullMetrics
+from cmpd.pipeline import ModPipeline
+from cmpd.policy import DownloadPolicy
+from cmpd.progress import Progress, make_sink
+from cmpd.session import HttpSession
+from cmpd.usage import parse_size
+
+
+class CMPDBatch:
+    def __init__(self, packs: List[Tuple[object, str]], store_dir=None, jobs: int = None, timeout=None,
+                 verify: bool = True, index: str = None, progress: str = None, progress_interval: float = 1.0,
+                 cache_mode: str = 'normal', cache_ttls: dict = None, max_store_size=None, metrics=None,
+                 metrics_path: str = None, metrics_format: str = 'json', policy: DownloadPolicy = None,
+                 retries: int = 3, mirrors: list = None, hedge_after: float = None, **pack_args):
+        """
+        Installs several modpacks against one store. Manifests are all resolved first,
+        mods shared by several packs are downloaded once and every pack shares the same jobs budget.
+        :param packs: list of (pack id, output folder)
+        :param store_dir: the shared store
+        :param jobs: how many mods get downloaded at the same time, over all the packs
+        :param max_store_size: evict least recently used store files once every pack is done
+        :param metrics: a Metrics shared by every pack, made for you if there's a metrics_path
+        :param metrics_path: where the metrics of the whole batch get written (metrics_format: json or prometheus)
+        :param policy: how downloads are retried, failed over to mirrors and hedged, made from
+                       retries/mirrors/hedge_after if not given
+        :param pack_args: passed on to each pack's CMPD (batch_size, link_mode, api_base, full, ...)
+        """
+        self.store_dir = store_dir or 'cmpd_store'
+        self.jobs = max(1, jobs or 4)
+        self.max_store_size = parse_size(max_store_size) if max_store_size else None
+        self.metrics = metrics or (Metrics() if metrics_path else NullMetrics())
+        self.metrics_path = metrics_path
+        self.metrics_format = metrics_format
+
+        _sink = make_sink(progress) if progress is None or isinstance(progress, str) else progress
+        self.progress = Progress(_sink, progress_interval)
+
+        # Headers get filled in by the packs, they all use the same defaults
+        policy = policy or DownloadPolicy(retries=retries, mirrors=mirrors, hedge_after=hedge_after,
+                                          metrics=self.metrics)
+        self.session = HttpSession(None, pool_size=self.jobs * (2 if policy.hedge_after else 1), timeout=timeout,
+                                   metrics=self.metrics)
+        self.store = ModStore(self.store_dir, session=self.session, verify=verify, index=index,
+                              progress=self.progress, offline=cache_mode == 'offline', metrics=self.metrics,
+                              policy=policy)
+        self.cache = ApiCache(self.store_dir, ttls=cache_ttls, mode=cache_mode, metrics=self.metrics)
+
+        self.packs: List[CMPD] = []
+        for pack_id, out_dir in packs:
+            self.packs.append(CMPD(pack_id, store_dir=self.store_dir, out_dir=out_dir, jobs=self.jobs,
+                                   session=self.session, store=self.store, cache=self.cache, metrics=self.metrics,
+                                   **pack_args))
+
+        self.summary = []
+
+    def run(self):
+        """
+        Installs every pack
+        :return: the per pack summary, one dict per pack
+        """
+        started = time.monotonic()
+
+        logger.info('-- Preparing [{}] packs.'.format(len(self.packs)))
+        ready = []
+        prepared_in = {}
+        errors = {}
+        for pack in self.packs:
+            _pack_started = time.monotonic()
+            try:
+                _ok = pack.prepare_modpack()
+            except Exception as e:
+                # A broken pack (truncated archive, bad manifest, ...) shouldn't take the others down
+                logger.h_except(e)
+                errors[id(pack)] = '{}: {}'.format(type(e).__name__, e)
+                if pack.pack_archive is not None:
+                    pack.pack_archive.close()
+                _ok = False
+            prepared_in[id(pack)] = time.monotonic() - _pack_started
+            if _ok:
+                ready.append(pack)
+            else:
+                logger.error(' x Could not prepare pack [{}], skipping it.'.format(pack.project_id))
+
+        # One queue entry per file id, no matter how many packs want it
+        items = []
+        wanted_by = {}
+        for pack in ready:
+            for item in pack.new_files:
+                file_id = item['fileID']
+                if file_id not in wanted_by:
+                    wanted_by[file_id] = []
+                    items.append(item)
+                wanted_by[file_id].append(pack)
+
+        _wanted = sum(len(i.new_files) for i in ready)
+        logger.info('-- Downloading [{}] mods for [{}] pack entries.'.format(len(items), _wanted))
+
+        def copy(info):
+            # Every pack gets its copy, even if an earlier one failed
+            return all([pack.copy_mod_file(info) for pack in wanted_by[info.uid]])
+
+        resolver = ready[0] if len(ready) > 0 else None
+        pipeline = ModPipeline(resolver.resolve_file_infos if resolver else None,
+                               self.store.download_to_store, copy, self.jobs, cost=self.store.bytes_to_fetch)
+        self.progress.start()
+        try:
+            with self.metrics.timer('cmpd_stage_seconds', stage='pipeline'):
+                results = pipeline.run(items) if resolver else []
+        finally:
+            self.progress.stop()
+
+        by_id = {item['fileID']: result for item, result in zip(items, results)}
+
+        # Downloads are shared, so each pack gets its own prepare and finish time
+        finished_in = {}
+        for pack in ready:
+            _pack_started = time.monotonic()
+            try:
+                pack.apply_results([by_id[i['fileID']] for i in pack.new_files])
+                pack.finish_modpack()
+            except Exception as e:
+                logger.h_except(e)
+                logger.error(' x Could not finish pack [{}].'.format(pack.project_id))
+                errors[id(pack)] = '{}: {}'.format(type(e).__name__, e)
+            finished_in[id(pack)] = time.monotonic() - _pack_started
+
+        # Only once every pack has recorded what it uses
+        if self.max_store_size:
+            self.store.evict(self.max_store_size)
+
+        self.summary = []
+        for pack in self.packs:
+            self.summary.append({
+                'pack_id': pack.project_id,
+                'name': pack.info.d_name if pack.info else None,
+                'out_dir': pack.out_dir,
+                'ok': pack in ready and id(pack) not in errors,
+                'error': errors.get(id(pack)),
+                'mods': len(pack.pack_files),
+                'updated': len(pack.mod_files),
+                'shared': sum(1 for i in pack.new_files if len(wanted_by.get(i['fileID'], ())) > 1),
+                'failed': list(pack.failed_mods),
+                'prepare_seconds': round(prepared_in[id(pack)], 3),
+                'finish_seconds': round(finished_in.get(id(pack), 0), 3),
+            })
+
+        self.print_summary(time.monotonic() - started)
+        if self.metrics_path:
+            self.metrics.write(self.metrics_path, self.metrics_format)
+            logger.info(' / Metrics written to [{}].'.format(self.metrics_path))
+        return self.summary
+
+    def print_summary(self, seconds: float):
+        logger.info('-- Batch done in [{:.1f}s]'.format(seconds))
+        for i in self.summary:
+            logger.info('   {} [{}] :: {} :: {} mods, {} updated ({} shared), {} failed :: {}'.format(
+                ' / ' if i['ok'] and len(i['failed']) == 0 else ' x ',
+                i['pack_id'],
+                i['name'] or '?',
+                i['mods'],
+                i['updated'],
+                i['shared'],
+                len(i['failed']),
+                os.path.abspath(i['out_dir']),
+            ))
+            if i['error']:
+                logger.error('       {}'.format(i['error']))
+
+
+_JOB_LINE = re.compile(r'^(\S+?)\s*[:\s]\s*(.+)$')
+_JOB_COMMENT = re.compile(r'(^|\s)#.*$')
+
+
+def read_jobs(lines):
+    """
+    Parses batch jobs, one `pack_id out_dir` (or `pack_id:out_dir`) per line,
+    # starts a comment at the start of a line or after a space
+    :param lines: the lines to parse
+    :return: list of (pack id, output folder)
+    """
+    jobs = []
+    for line in lines:
+        line = _JOB_COMMENT.sub('', line.rstrip('\r\n')).strip()
+        if len(line) == 0:
+            continue
+        m = _JOB_LINE.match(line)
+        if m is None:
+            raise ValueError('Expected `pack_id out_dir`, got [{}]'.format(line))
+        if not m.group(1).isdigit():
+            raise ValueError('Pack id [{}] is not a number, in [{}]'.format(m.group(1), line))
+        jobs.append((m.group(1), m.group(2).strip()))
+    return jobs
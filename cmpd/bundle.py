@@ -0,0 +1,181 @@
+import json
+import os
+import shutil
+import zipfile
+
+from cmpd.Addons import AddonFile
+from cmpd.ModStore import ModStore
+from cmpd.locks import atomic_write
+from cmpd.logger import logger
+
+
+# ------------------------------------
+# Pack bundles
+# ------------------------------------
+#  one file with everything a store needs to install a pack without the network
+#  {pack}.cmpd.zip (stored, mods and packs are already compressed)
+#    - bundle.json : the first entry, so it can be read before anything else
+#        {version, pack_id, pack_file_id, addon: addon info,
+#         files: {file_id: {info: file info, blob: entry name}}}
+#    - blobs
+#      - {fingerprint} (or f{file_id} for files without one), each content only once,
+#          the pack file first then in manifest order
+#  imports only read the blobs the store is missing, in the order they're laid out
+# ------------------------------------
+
+BUNDLE_VERSION = 1
+
+_BUFFER = 1024 * 1024
+
+
+def _blob_name(addon_file: AddonFile):
+    if addon_file.fingerprint in (None, -1):
+        return 'blobs/f{}'.format(addon_file.uid)
+    return 'blobs/{:08x}'.format(addon_file.fingerprint)
+
+
+def export_bundle(store: ModStore, pack_id, path: str, file_id=None):
+    """
+    Writes a pack, its infos and every mod it uses from the store to a bundle
+    :param store: the store the pack was installed from
+    :param pack_id: the modpack's project id
+    :param path: the bundle to write
+    :param file_id: the pack file to export, defaults to the newest one the store knows about
+    :return: dict of counters, None if the store doesn't have everything (or some of it is corrupted)
+    """
+    p = os.path
+
+    info = store.get_addon_info(pack_id)
+    if not info:
+        logger.error(' x Pack [{}] is not in the store, install it first.'.format(pack_id))
+        return None
+
+    pack_file = store.get_file_info(file_id) if file_id is not None else info.newest_file()
+    pack_path = store.file_path(pack_file) if pack_file else None
+    if pack_path is None or not p.isfile(pack_path) or not store.check_fingerprint(pack_file, pack_path):
+        logger.error(' x Pack file [{}] of [{}] is missing from the store or corrupted, install it (again) first.'
+                     .format(file_id or '?', pack_id))
+        return None
+
+    with store.open_pack(pack_file, pack_path) as archive:
+        manifest = archive.manifest
+
+    files = [pack_file]
+    missing = []
+    for item in manifest['files']:
+        f_store = store.get_file_info(item['fileID'])
+        f_path = store.file_path(f_store) if f_store else None
+        # A corrupted file would only show up on the host importing the bundle, with no way to get it again
+        if f_path is None or not p.isfile(f_path) or p.getsize(f_path) != f_store.length \
+                or not store.check_fingerprint(f_store, f_path):
+            missing.append(item['fileID'])
+            continue
+        files.append(f_store)
+
+    store.save_verified()
+    if len(missing) > 0:
+        logger.error(' x [{}] mods of [{}] are missing from the store or corrupted, install the pack (again) first: {}'
+                     .format(len(missing), pack_id, missing))
+        return None
+
+    addon = info.get_json()
+    addon['latest_files'] = [pack_file.uid]
+    addon['latest_times'] = {str(pack_file.uid): pack_file.timestamp}
+
+    entries = {}
+    blobs = {}
+    for i in files:
+        name = _blob_name(i)
+        entries[str(i.uid)] = {'info': i.get_json(), 'blob': name}
+        blobs.setdefault(name, store.file_path(i))
+
+    index = {
+        'version': BUNDLE_VERSION,
+        'pack_id': str(pack_id),
+        'pack_file_id': pack_file.uid,
+        'addon': addon,
+        'files': entries,
+    }
+
+    logger.info('-- Exporting [{}] with [{}] files ([{}] unique) to [{}]'
+                .format(info.d_name, len(entries), len(blobs), path))
+
+    size = 0
+    with atomic_write(path, 'wb') as raw:
+        with zipfile.ZipFile(raw, 'w', zipfile.ZIP_STORED, allowZip64=True) as bundle:
+            bundle.writestr('bundle.json', json.dumps(index))
+            for name, src in blobs.items():
+                z_info = zipfile.ZipInfo.from_file(src, name)
+                z_info.compress_type = zipfile.ZIP_STORED
+                with open(src, 'rb') as s, bundle.open(z_info, 'w') as d:
+                    shutil.copyfileobj(s, d, _BUFFER)
+                size += z_info.file_size
+
+    return {'files': len(entries), 'blobs': len(blobs), 'bytes': size}
+
+
+def read_index(bundle: zipfile.ZipFile):
+    """
+    :param bundle: an opened bundle
+    :return: its bundle.json
+    """
+    index = json.loads(bundle.read('bundle.json').decode('utf-8'))
+    if index.get('version') != BUNDLE_VERSION:
+        raise ValueError('Unsupported bundle version [{}]'.format(index.get('version')))
+    return index
+
+
+def import_bundle(store: ModStore, path: str):
+    """
+    Puts a bundle's pack, infos and mods in the store, never touches the network.
+    Files the store already has are left alone, only the missing ones get read
+    :param store: the store to fill
+    :param path: the bundle
+    :return: dict of counters
+    """
+    summary = {'files': 0, 'present': 0, 'imported': 0, 'failed': 0, 'bytes': 0}
+
+    with open(path, 'rb') as raw, zipfile.ZipFile(raw, 'r') as bundle:
+        index = read_index(bundle)
+
+        infos = [AddonFile.create_from_store(i['info']) for i in index['files'].values()]
+        store.create_file_details_many(infos)
+
+        # Keep whatever other pack files the store already knew about
+        addon = dict(index['addon'])
+        stored = store.index.get_addon(addon['uid'])
+        if stored:
+            addon['latest_files'] = stored['latest_files'] + [i for i in addon['latest_files']
+                                                              if i not in stored['latest_files']]
+            # Only kept if both records had them, get_newest_file opens the files otherwise
+            if 'latest_times' in stored and 'latest_times' in addon:
+                addon['latest_times'] = dict(stored['latest_times'], **addon['latest_times'])
+            else:
+                addon.pop('latest_times', None)
+        store.index.put_addon(addon)
+
+        missing = []
+        for info in infos:
+            summary['files'] += 1
+            if store.plan_file(info)[0] in ('cached', 'reused') and store.add_file(info):
+                summary['present'] += 1
+                continue
+            missing.append((bundle.getinfo(index['files'][str(info.uid)]['blob']), info))
+
+        logger.info('-- Importing [{}] of [{}] files from [{}]'.format(len(missing), summary['files'], path))
+
+        # In bundle order, the reads stay sequential
+        missing.sort(key=lambda i: i[0].header_offset)
+        for z_info, info in missing:
+            with bundle.open(z_info, 'r') as src:
+                target = store.add_file(info, src)
+            if target is None:
+                logger.error(' X Could not import [{}].'.format(info.d_name))
+                summary['failed'] += 1
+                continue
+            summary['imported'] += 1
+            summary['bytes'] += info.length
+
+    store.save_verified()
+    store.usage.save()
+    return summary
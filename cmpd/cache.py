@@ -0,0 +1,214 @@
+import json
+import os
+import threading
+import time
+
+from cmpd.locks import merge_changed, update_json
+from cmpd.logger import logger
+from cmpd.metrics import NullMetrics
+
+
+# ------------------------------------
+# Api cache
+# ------------------------------------
+#  store/data/api_cache.json
+#   {url (or key): {status, body, etag, last_modified, fetched, endpoint}}
+#  entries are fresh for their endpoint's ttl, stale ones get revalidated
+#   with If-None-Match / If-Modified-Since, failed lookups (404/410) are
+#   remembered for negative_ttl so dead ids don't get asked for every run
+#  save() drops failed lookups past negative_ttl and answers stale for
+#   longer than keep_stale, so the file doesn't keep growing run after run
+# ------------------------------------
+
+CACHE_MODES = ('normal', 'refresh', 'offline')
+
+# Seconds, None means the entry never goes stale
+DEFAULT_TTLS = {
+    # latest_files moves whenever the pack gets a new version
+    'addon_info': 60 * 60,
+    # A file id always points at the same file
+    'file_info': None,
+}
+
+
+class ApiCache:
+    def __init__(self, store_dir: str, ttls: dict = None, negative_ttl: float = 10 * 60, mode: str = 'normal',
+                 metrics=None, keep_stale: float = 7 * 24 * 60 * 60):
+        """
+        :param store_dir: the store the cache lives in
+        :param ttls: {endpoint: seconds} on top of DEFAULT_TTLS
+        :param negative_ttl: how long a failed lookup is remembered
+        :param mode: normal, refresh (revalidate everything) or offline (never touch the network)
+        :param metrics: where hits, misses and api latencies go
+        :param keep_stale: how long an answer is kept once stale, to revalidate or fall back on
+        """
+        if mode not in CACHE_MODES:
+            raise ValueError('Unknown cache mode [{}], expected one of {}'.format(mode, CACHE_MODES))
+
+        self.cache_file = os.path.join(store_dir, 'data', 'api_cache.json')
+        self.ttls = dict(DEFAULT_TTLS, **(ttls or {}))
+        self.negative_ttl = negative_ttl
+        self.keep_stale = keep_stale
+        self.mode = mode
+        self.metrics = metrics or NullMetrics()
+
+        self._lock = threading.Lock()
+        # Keys touched by this process, merged into whatever other processes saved meanwhile
+        self._changed = set()
+        self.entries = {}
+
+        try:
+            with open(self.cache_file, 'r') as f:
+                self.entries = json.load(f)
+        except (OSError, ValueError):
+            pass
+
+    @property
+    def offline(self):
+        return self.mode == 'offline'
+
+    @property
+    def refresh(self):
+        return self.mode == 'refresh'
+
+    def _get(self, key: str):
+        with self._lock:
+            return self.entries.get(key)
+
+    def _put(self, key: str, entry: dict):
+        with self._lock:
+            self.entries[key] = entry
+            self._changed.add(key)
+
+    def _drop(self, key: str):
+        with self._lock:
+            self.entries.pop(key, None)
+            self._changed.add(key)
+
+    def _is_fresh(self, endpoint: str, entry: dict):
+        if entry is None:
+            return False
+
+        ttl = self.negative_ttl if entry['status'] != 200 else self.ttls.get(endpoint)
+        return ttl is None or (time.time() - entry['fetched']) < ttl
+
+    def is_fresh(self, endpoint: str, key: str):
+        """
+        :return: whether the url (or key) was looked up recently enough to not ask again
+        """
+        return not self.refresh and self._is_fresh(endpoint, self._get(key))
+
+    def is_negative(self, endpoint: str, key: str):
+        """
+        :return: whether the url (or key) recently turned out to not exist
+        """
+        entry = self._get(key)
+        if entry is None or entry['status'] == 200:
+            return False
+        return self.offline or self.is_fresh(endpoint, key)
+
+    def put_negative(self, key: str, status: int = 404):
+        self._put(key, {'status': status, 'body': None, 'fetched': time.time()})
+
+    def fetch(self, session, endpoint: str, url: str, remember: bool = True, key: str = None):
+        """
+        Gets a url through the cache
+        :param session: the http session to use when the cache can't answer
+        :param endpoint: which ttl applies
+        :param url: the url to get
+        :param remember: keep the body of good responses, off for things the store already keeps
+        :param key: what the answer is kept under, defaults to the url
+        :return: (status, body), (None, None) if there was no answer at all
+        """
+        key = key or url
+        entry = self._get(key)
+
+        if self.offline or self.is_fresh(endpoint, key):
+            if entry is None:
+                self.metrics.inc('cmpd_api_cache_total', endpoint=endpoint, result='miss')
+                return None, None
+            self.metrics.inc('cmpd_api_cache_total', endpoint=endpoint,
+                             result='hit' if entry['status'] == 200 else 'negative')
+            return entry['status'], entry.get('body')
+
+        headers = {}
+        if entry is not None and entry['status'] == 200:
+            if entry.get('etag'):
+                headers['if-none-match'] = entry['etag']
+            if entry.get('last_modified'):
+                headers['if-modified-since'] = entry['last_modified']
+
+        try:
+            with self.metrics.timer('cmpd_api_seconds', endpoint=endpoint):
+                _r = session.get(url, headers=headers)
+        except Exception as e:
+            logger.h_except(e)
+            if entry is not None:
+                logger.warning(' ! Using stale cached answer for [{}]'.format(url))
+                return entry['status'], entry.get('body')
+            return None, None
+
+        if _r.status_code == 304 and entry is not None:
+            self.metrics.inc('cmpd_api_cache_total', endpoint=endpoint, result='revalidated')
+            self._put(key, dict(entry, fetched=time.time()))
+            return entry['status'], entry.get('body')
+
+        if _r.status_code == 200:
+            self.metrics.inc('cmpd_api_cache_total', endpoint=endpoint, result='fetched')
+            body = _r.content.decode('utf-8')
+            if not remember:
+                # Whatever was remembered about it (a past 404 say) no longer holds
+                if entry is not None:
+                    self._drop(key)
+            else:
+                self._put(key, {
+                    'status': 200,
+                    'body': body,
+                    'etag': _r.headers.get('etag'),
+                    'last_modified': _r.headers.get('last-modified'),
+                    'fetched': time.time(),
+                    'endpoint': endpoint,
+                })
+            return 200, body
+
+        if _r.status_code in (404, 410):
+            self.put_negative(key, _r.status_code)
+            return _r.status_code, None
+
+        # Server trouble, not the url's fault, so nothing gets remembered
+        if entry is not None:
+            logger.warning(' ! Got [{}], using stale cached answer for [{}]'.format(_r.status_code, url))
+            return entry['status'], entry.get('body')
+        return _r.status_code, None
+
+    def _expired(self, entry: dict, now: float):
+        age = now - entry['fetched']
+        if entry['status'] != 200:
+            return age >= self.negative_ttl
+
+        # Older entries don't say which endpoint they're from, they only get keep_stale
+        ttl = self.ttls.get(entry.get('endpoint'), 0)
+        return ttl is not None and age >= ttl + self.keep_stale
+
+    def _prune(self, data: dict):
+        # Offline can't ask again, so whatever it has stays
+        if self.offline:
+            return data
+
+        now = time.time()
+        for key in [k for k, v in data.items() if self._expired(v, now)]:
+            data.pop(key)
+        return data
+
+    def save(self):
+        """
+        Writes what this process changed, merged into whatever other processes saved meanwhile,
+        and drops what expired along the way
+        """
+        with self._lock:
+            if len(self._changed) == 0:
+                return
+
+            self.entries = update_json(self.cache_file,
+                                       lambda data: self._prune(merge_changed(data, self.entries, self._changed)))
+            self._changed = set()
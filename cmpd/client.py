@@ -0,0 +1,93 @@
+import http.client
+import json
+import os
+
+
+# ------------------------------------
+# Daemon client
+# ------------------------------------
+#  talks to a running `cmpd daemon` (see cmpd.daemon) through store/daemon.json,
+#  only uses the standard library so asking the daemon stays cheap
+# ------------------------------------
+
+DAEMON_FILE = 'daemon.json'
+TOKEN_HEADER = 'X-Cmpd-Token'
+
+
+class DaemonClient:
+    def __init__(self, host: str, port: int, token: str, timeout: float = 5):
+        """
+        :param timeout: seconds to wait on the daemon, installs wait as long as they take
+        """
+        self.host = host
+        self.port = port
+        self.token = token
+        self.timeout = timeout
+
+    @classmethod
+    def find(cls, store_dir: str):
+        """
+        :param store_dir: the store the daemon serves
+        :return: a client, None if the store has no daemon (or it doesn't answer)
+        """
+        try:
+            with open(os.path.join(store_dir, DAEMON_FILE), 'r') as f:
+                info = json.load(f)
+            client = cls(info['host'], info['port'], info['token'])
+            client.status()
+        except (OSError, ValueError, KeyError, http.client.HTTPException):
+            return None
+        return client
+
+    def _request(self, method: str, path: str, body: dict = None, timeout: float = None):
+        conn = http.client.HTTPConnection(self.host, self.port, timeout=timeout)
+        headers = {TOKEN_HEADER: self.token}
+        data = None
+        if body is not None:
+            data = json.dumps(body).encode('utf-8')
+            headers['Content-Type'] = 'application/json'
+        conn.request(method, path, body=data, headers=headers)
+        return conn, conn.getresponse()
+
+    def _call(self, method: str, path: str):
+        conn, _r = self._request(method, path, timeout=self.timeout)
+        try:
+            data = json.loads(_r.read().decode('utf-8'))
+        finally:
+            conn.close()
+        if _r.status != 200:
+            raise ValueError('Daemon answered [{}]: {}'.format(_r.status, data.get('error')))
+        return data
+
+    def status(self):
+        return self._call('GET', '/status')
+
+    def shutdown(self):
+        return self._call('POST', '/shutdown')
+
+    def install(self, job: dict, on_event=None):
+        """
+        Has the daemon install a pack, waits until it's done
+        :param job: project_id, out_dir and the other per install options (see cmpd.daemon.JOB_OPTIONS)
+        :param on_event: called with every event the daemon sends (log, progress, begin, end, ...)
+        :return: the InstallResult json
+        """
+        conn, _r = self._request('POST', '/install', job)
+        try:
+            if _r.status != 200:
+                raise ValueError('Daemon answered [{}]: {}'.format(_r.status, _r.read().decode('utf-8')))
+
+            result = None
+            for line in _r:
+                event = json.loads(line.decode('utf-8'))
+                if event['type'] == 'result':
+                    result = event
+                elif on_event is not None:
+                    on_event(event)
+        finally:
+            conn.close()
+
+        if result is None:
+            raise ConnectionError('Daemon stopped before the install was done')
+        result.pop('type')
+        return result
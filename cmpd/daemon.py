@@ -0,0 +1,279 @@
+import asyncio
+import json
+import logging
+import os
+import secrets
+import threading
+import time
+
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+from cmpd.ModStore import ModStore
+from cmpd.aio import AsyncCMPD
+from cmpd.cache import ApiCache, CACHE_MODES
+from cmpd.client import DAEMON_FILE, TOKEN_HEADER
+from cmpd.locks import atomic_write
+from cmpd.logger import logger
+from cmpd.policy import DownloadPolicy
+from cmpd.progress import JsonSink, Progress
+from cmpd.session import HttpSession
+
+
+# ------------------------------------
+# Install daemon
+# ------------------------------------
+#  keeps one store (index, verified fingerprints, api cache), one connection pool
+#   and the hosts' health around between installs, served on 127.0.0.1
+#  GET  /status
+#  POST /install   {project_id, out_dir, full, link_mode, batch_size, api_base, max_store_size,
+#                   cache_mode, verify, progress_interval}
+#                  answers with json lines as the install goes
+#                  (queued, log, begin, end, progress, done, then the result)
+#  POST /shutdown
+#  store/daemon.json tells clients where to find it, requests need its token.
+#  installs run one after the other, the store is shared so they'd only fight over it
+# ------------------------------------
+
+# What a client can set per install, the rest is the daemon's
+JOB_OPTIONS = ('out_dir', 'full', 'link_mode', 'batch_size', 'api_base', 'max_store_size')
+# Same, but they live on the shared store/cache, set for the install and put back after it
+JOB_SETTINGS = ('cache_mode', 'verify', 'progress_interval')
+
+
+class _EventStream:
+    """
+    Json lines to a client, an install gets cancelled once the client is gone
+    """
+
+    def __init__(self, wfile):
+        self.wfile = wfile
+        self.closed = False
+        self.on_close = None
+        self._lock = threading.Lock()
+
+    def write(self, data: str):
+        with self._lock:
+            if self.closed:
+                return
+            try:
+                self.wfile.write(data.encode('utf-8'))
+            except OSError:
+                self.closed = True
+                if self.on_close is not None:
+                    self.on_close()
+
+    def flush(self):
+        with self._lock:
+            if self.closed:
+                return
+            try:
+                self.wfile.flush()
+            except OSError:
+                self.closed = True
+
+    def send(self, kind: str, data: dict = None):
+        self.write(json.dumps(dict(data or {}, type=kind)) + '\n')
+        self.flush()
+
+
+class _LogForwarder(logging.Handler):
+    def __init__(self, stream: _EventStream):
+        super().__init__(logging.INFO)
+        self.stream = stream
+
+    def emit(self, record: logging.LogRecord):
+        # Exceptions stay in the daemon's own log
+        if record.levelno == logging.HIDDEN_EXCEPTION:
+            return
+        self.stream.send('log', {'level': record.levelno, 'message': record.getMessage()})
+
+
+class _Handler(BaseHTTPRequestHandler):
+    server: 'CMPDDaemon'
+
+    def log_message(self, fmt, *args):
+        logger.debug(' * [daemon] ' + fmt % args)
+
+    def _json(self, code: int, data: dict):
+        body = json.dumps(data).encode('utf-8')
+        self.send_response(code)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _authorized(self):
+        if secrets.compare_digest(self.headers.get(TOKEN_HEADER, ''), self.server.token):
+            return True
+        self._json(403, {'error': 'bad token'})
+        return False
+
+    def _body(self):
+        length = int(self.headers.get('Content-Length', 0))
+        return json.loads(self.rfile.read(length).decode('utf-8')) if length > 0 else {}
+
+    def do_GET(self):
+        if not self._authorized():
+            return
+        if self.path == '/status':
+            return self._json(200, self.server.status())
+        self._json(404, {'error': 'not found'})
+
+    def do_POST(self):
+        if not self._authorized():
+            return
+
+        if self.path == '/shutdown':
+            self._json(200, {'ok': True})
+            threading.Thread(target=self.server.shutdown, daemon=True).start()
+            return
+
+        if self.path != '/install':
+            return self._json(404, {'error': 'not found'})
+
+        try:
+            job = self._body()
+            if 'project_id' not in job:
+                raise ValueError('project_id is missing')
+            if job.get('cache_mode') is not None and job['cache_mode'] not in CACHE_MODES:
+                raise ValueError('Unknown cache mode [{}], expected one of {}'.format(job['cache_mode'], CACHE_MODES))
+            if job.get('progress_interval') is not None and not float(job['progress_interval']) > 0:
+                raise ValueError('progress_interval has to be more than 0, got [{}]'.format(job['progress_interval']))
+        except (TypeError, ValueError) as e:
+            return self._json(400, {'error': str(e)})
+
+        # No length, the stream ends with the connection
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/x-ndjson')
+        self.send_header('Connection', 'close')
+        self.end_headers()
+        self.close_connection = True
+
+        stream = _EventStream(self.wfile)
+        result = self.server.install(job, stream)
+        stream.send('result', result)
+
+
+class CMPDDaemon(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, store_dir: str = None, port: int = 0, jobs: int = None, timeout=None, verify: bool = True,
+                 index: str = None, cache_mode: str = 'normal', policy: DownloadPolicy = None,
+                 progress_interval: float = 1.0):
+        """
+        :param store_dir: the store every install goes through
+        :param port: port to listen on (127.0.0.1), 0 for any free one
+        :param jobs: download workers of each install
+        :param progress_interval: seconds between the progress lines sent to clients
+        the rest is the same as for CMPD
+        """
+        super().__init__(('127.0.0.1', port), _Handler)
+
+        self.store_dir = store_dir or 'cmpd_store'
+        self.jobs = max(1, jobs or 4)
+        self.verify = verify
+        self.cache_mode = cache_mode
+        self.progress_interval = progress_interval
+        self.token = secrets.token_hex(16)
+        self.started = time.time()
+
+        policy = policy or DownloadPolicy()
+        self.session = HttpSession(None, pool_size=self.jobs * (2 if policy.hedge_after else 1), timeout=timeout)
+        self.store = ModStore(self.store_dir, session=self.session, verify=verify, index=index,
+                              offline=cache_mode == 'offline', policy=policy)
+        self.cache = ApiCache(self.store_dir, mode=cache_mode)
+
+        self._job_lock = threading.Lock()
+        self._lock = threading.Lock()
+        self.running = None
+        self.queued = 0
+        self.installs = 0
+
+    @property
+    def daemon_file(self):
+        return os.path.join(self.store_dir, DAEMON_FILE)
+
+    def status(self):
+        with self._lock:
+            return {
+                'pid': os.getpid(),
+                'store': os.path.abspath(self.store_dir),
+                'uptime': round(time.time() - self.started, 3),
+                'running': self.running,
+                'queued': self.queued,
+                'installs': self.installs,
+                'jobs': self.jobs,
+                'session': self.session.stats(),
+                'hosts': self.store.policy.stats(),
+            }
+
+    def _use_settings(self, cache_mode: str, verify: bool):
+        self.cache.mode = cache_mode
+        self.store.offline = cache_mode == 'offline'
+        self.store.verify = verify
+
+    def install(self, job: dict, stream: _EventStream):
+        """
+        Runs an install for a client, one at a time
+        :param job: project_id, JOB_OPTIONS and JOB_SETTINGS
+        :param stream: where its progress and logs go
+        :return: the InstallResult json
+        """
+        with self._lock:
+            self.queued += 1
+        if not self._job_lock.acquire(blocking=False):
+            stream.send('queued', {'running': self.running})
+            self._job_lock.acquire()
+
+        forwarder = _LogForwarder(stream)
+        try:
+            with self._lock:
+                self.queued -= 1
+                self.running = job['project_id']
+
+            # Fresh counters for every install, the store hands them to the downloads
+            _interval = float(job.get('progress_interval') or self.progress_interval)
+            self.store.progress = Progress(JsonSink(stream), _interval)
+            self._use_settings(job.get('cache_mode') or self.cache_mode,
+                               self.verify if job.get('verify') is None else bool(job['verify']))
+            options = {k: job[k] for k in JOB_OPTIONS if job.get(k) is not None}
+            installer = AsyncCMPD(job['project_id'], store_dir=self.store_dir, jobs=self.jobs, session=self.session,
+                                  store=self.store, cache=self.cache, **options)
+            stream.on_close = installer.cancel
+
+            logger.addHandler(forwarder)
+            result = asyncio.run(installer.download_modpack())
+            return result.get_json()
+        except Exception as e:
+            logger.h_except(e)
+            return {'project_id': job['project_id'], 'ok': False, 'error': '{}: {}'.format(type(e).__name__, e)}
+        finally:
+            logger.removeHandler(forwarder)
+            self._use_settings(self.cache_mode, self.verify)
+            with self._lock:
+                self.running = None
+                self.installs += 1
+            self._job_lock.release()
+
+    def serve(self):
+        """
+        Serves until shutdown() (or ctrl+c), telling clients where to find us meanwhile
+        """
+        host, port = self.server_address[:2]
+        # Has the token, never readable by anyone else, not even for a moment
+        with atomic_write(self.daemon_file, perms=0o600) as f:
+            json.dump({'host': host, 'port': port, 'pid': os.getpid(), 'token': self.token}, f)
+
+        logger.info('-- Daemon serving [{}] on [{}:{}]'.format(os.path.abspath(self.store_dir), host, port))
+        try:
+            self.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            self.server_close()
+            if os.path.isfile(self.daemon_file):
+                os.remove(self.daemon_file)
+            self.store.save_verified()
+            self.store.usage.save()
+            self.cache.save()
+            logger.info('-- Daemon stopped after [{}] installs'.format(self.installs))
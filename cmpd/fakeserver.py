@@ -0,0 +1,292 @@
+import argparse
+import io
+import json
+import random
+import re
+import threading
+import time
+import zipfile
+import zlib
+
+from datetime import datetime, timedelta
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+from cmpd.fingerprint import fingerprint_bytes
+
+
+# ------------------------------------
+# Local stand-in for the CurseForge api
+# ------------------------------------
+#  GET  /api/v2/addon/{addon_id}
+#  GET  /api/v2/addon/{addon_id}/file/{file_id}
+#  POST /api/v2/addon/files
+#  GET  /files/{file_id}/{file_name}   (supports Range)
+#  GET  /stats
+#  everything is generated from a seed, so runs can be compared
+# ------------------------------------
+
+class Fixtures:
+    def __init__(self, mods: int = 50, min_size: int = 16 * 1024, max_size: int = 512 * 1024,
+                 overrides: int = 20, seed: int = 1, base_url: str = ''):
+        """
+        A modpack with its mods, generated up front
+        :param mods: how many mods the pack has
+        :param min_size: smallest mod size in bytes
+        :param max_size: biggest mod size in bytes
+        :param overrides: how many config files the pack overrides
+        :param seed: what the contents are generated from
+        :param base_url: where the files get downloaded from
+        """
+        rand = random.Random(seed)
+
+        self.pack_id = 100000 + seed
+        self.files = {}
+        self.data = {}
+
+        manifest_files = []
+        for i in range(mods):
+            file_id = 2000000 + i
+            project_id = 200000 + i
+            size = rand.randint(min_size, max_size)
+            self._add_file(file_id, project_id, 'mod-{}'.format(i), 'mod-{}.jar'.format(i),
+                           rand.getrandbits(8 * size).to_bytes(size, 'little'), base_url)
+            manifest_files.append({'projectID': project_id, 'fileID': file_id, 'required': True})
+
+        pack = io.BytesIO()
+        with zipfile.ZipFile(pack, 'w', zipfile.ZIP_DEFLATED) as z:
+            z.writestr('manifest.json', json.dumps({
+                'manifestType': 'minecraftModpack',
+                'name': 'Fake Pack {}'.format(seed),
+                'files': manifest_files,
+                'overrides': 'overrides',
+            }))
+            for i in range(overrides):
+                z.writestr('overrides/config/mod-{}.cfg'.format(i),
+                           '\n'.join('option{}={}'.format(j, rand.random()) for j in range(50)))
+
+        self.pack_file_id = 1000000 + seed
+        self._add_file(self.pack_file_id, self.pack_id, 'Fake Pack {}'.format(seed),
+                       'fake-pack-{}.zip'.format(seed), pack.getvalue(), base_url)
+
+    def _add_file(self, file_id: int, project_id: int, d_name: str, file_name: str, data: bytes, base_url: str):
+        self.data[file_id] = data
+        self.files[file_id] = {
+            'id': file_id,
+            'projectId': project_id,
+            'displayName': d_name,
+            'fileName': file_name,
+            'fileLength': len(data),
+            'fingerprint': fingerprint_bytes(data),
+            'fileDate': (datetime(2020, 1, 1) + timedelta(minutes=file_id % 100000)).isoformat() + '.000Z',
+            'downloadUrl': '{}/files/{}/{}'.format(base_url, file_id, file_name),
+        }
+
+    def addon(self, addon_id: int):
+        if addon_id != self.pack_id:
+            return None
+
+        return {
+            'id': self.pack_id,
+            'name': self.files[self.pack_file_id]['displayName'],
+            'summary': 'Generated by cmpd.fakeserver',
+            'websiteUrl': 'http://localhost/',
+            'latestFiles': [self.files[self.pack_file_id]],
+        }
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    server: 'FakeCurse'
+
+    def log_message(self, fmt, *args):
+        pass
+
+    def _send(self, code: int, body: bytes = b'', content_type: str = 'application/json', headers: dict = None):
+        self.send_response(code)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        for k, v in (headers or {}).items():
+            self.send_header(k, v)
+        self.end_headers()
+        self._write(body)
+
+    def _json(self, data):
+        if data is None:
+            return self._send(404)
+
+        body = json.dumps(data).encode('utf-8')
+        etag = '"{:08x}"'.format(zlib.crc32(body))
+        if self.headers.get('If-None-Match') == etag:
+            self.server.count('not_modified')
+            self.send_response(304)
+            self.send_header('ETag', etag)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+        self._send(200, body, headers={'ETag': etag})
+
+    def _write(self, body: bytes):
+        rate = self.server.bandwidth
+        if not rate:
+            self.wfile.write(body)
+            self.server.count('bytes', len(body))
+            return
+
+        # Throttled per connection, 64 KB at a time
+        step = 64 * 1024
+        started = time.monotonic()
+        for i in range(0, len(body), step):
+            self.wfile.write(body[i:i + step])
+            self.server.count('bytes', len(body[i:i + step]))
+            ahead = (i + step) / rate - (time.monotonic() - started)
+            if ahead > 0:
+                time.sleep(ahead)
+
+    def _misbehave(self):
+        if self.server.latency:
+            time.sleep(self.server.latency)
+        if self.server.error_rate and self.server.random() < self.server.error_rate:
+            self.server.count('errors')
+            self._send(500, b'{"error": "injected"}')
+            return True
+        return False
+
+    def do_GET(self):
+        fixtures = self.server.fixtures
+
+        if self.path == '/stats':
+            return self._json(self.server.stats())
+
+        self.server.count('requests')
+        if self._misbehave():
+            return
+
+        m = re.match(r'^/api/v2/addon/(\d+)$', self.path)
+        if m:
+            self.server.count('addon')
+            return self._json(fixtures.addon(int(m.group(1))))
+
+        m = re.match(r'^/api/v2/addon/(\d+)/file/(\d+)$', self.path)
+        if m:
+            self.server.count('file_info')
+            return self._json(fixtures.files.get(int(m.group(2))))
+
+        m = re.match(r'^/files/(\d+)/', self.path)
+        if m:
+            self.server.count('download')
+            data = fixtures.data.get(int(m.group(1)))
+            if data is None:
+                return self._send(404)
+
+            _range = re.match(r'^bytes=(\d+)-$', self.headers.get('Range', ''))
+            if _range and int(_range.group(1)) < len(data):
+                start = int(_range.group(1))
+                return self._send(206, data[start:], 'application/octet-stream', {
+                    'Content-Range': 'bytes {}-{}/{}'.format(start, len(data) - 1, len(data)),
+                })
+            return self._send(200, data, 'application/octet-stream')
+
+        self._send(404)
+
+    def do_POST(self):
+        fixtures = self.server.fixtures
+        body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+
+        self.server.count('requests')
+        if self._misbehave():
+            return
+
+        if self.path == '/api/v2/addon/files':
+            self.server.count('files')
+            ids = json.loads(body.decode('utf-8'))
+            return self._json({str(i): [fixtures.files[i]] for i in ids if i in fixtures.files})
+
+        self._send(404)
+
+
+class FakeCurse(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, port: int = 0, latency: float = 0, bandwidth: int = 0, error_rate: float = 0,
+                 seed: int = 1, **fixture_args):
+        """
+        :param port: port to listen on (127.0.0.1), 0 for any free one
+        :param latency: seconds added to every request
+        :param bandwidth: bytes/s per connection, 0 for unlimited
+        :param error_rate: chance of a request getting a 500
+        :param seed: what fixtures and errors are generated from
+        :param fixture_args: passed on to Fixtures
+        """
+        super().__init__(('127.0.0.1', port), _Handler)
+
+        self.latency = latency
+        self.bandwidth = bandwidth
+        self.error_rate = error_rate
+        self.fixtures = Fixtures(seed=seed, base_url=self.base_url, **fixture_args)
+
+        self._rand = random.Random(seed)
+        self._lock = threading.Lock()
+        self._counters = {}
+        self._thread = None
+
+    @property
+    def base_url(self):
+        return 'http://127.0.0.1:{}'.format(self.server_address[1])
+
+    @property
+    def api_base(self):
+        return self.base_url + '/api/v2/'
+
+    def random(self):
+        with self._lock:
+            return self._rand.random()
+
+    def count(self, key: str, amount: int = 1):
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + amount
+
+    def stats(self):
+        with self._lock:
+            return dict(self._counters)
+
+    def reset_stats(self):
+        with self._lock:
+            self._counters = {}
+
+    def start(self):
+        self._thread = threading.Thread(target=self.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m cmpd.fakeserver',
+                                     description='Serves a generated modpack the way the CurseForge api does')
+    parser.add_argument('-p', '--port', type=int, default=8765)
+    parser.add_argument('--mods', type=int, default=50, help='how many mods the pack has')
+    parser.add_argument('--min-size', type=int, default=16 * 1024, help='smallest mod size in bytes')
+    parser.add_argument('--max-size', type=int, default=512 * 1024, help='biggest mod size in bytes')
+    parser.add_argument('--overrides', type=int, default=20, help='how many config files the pack overrides')
+    parser.add_argument('--latency', type=float, default=0, help='seconds added to every request')
+    parser.add_argument('--bandwidth', type=int, default=0, help='bytes/s per connection, 0 for unlimited')
+    parser.add_argument('--error-rate', type=float, default=0, help='chance of a request getting a 500')
+    parser.add_argument('--seed', type=int, default=1)
+
+    args = parser.parse_args(argv)
+
+    server = FakeCurse(args.port, latency=args.latency, bandwidth=args.bandwidth, error_rate=args.error_rate,
+                       seed=args.seed, mods=args.mods, min_size=args.min_size, max_size=args.max_size,
+                       overrides=args.overrides)
+    print('Serving pack [{}] at [{}]'.format(server.fixtures.pack_id, server.api_base))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        server.server_close()
+
+
+if __name__ == '__main__':
+    main()
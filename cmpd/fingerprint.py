@@ -0,0 +1,166 @@
+import os
+import sys
+
+try:
+    # Optional, hashes at memory speed instead of a few dozen MB/s
+    from murmurhash2 import murmurhash2 as _c_murmur2
+except ImportError:
+    _c_murmur2 = None
+
+# ------------------------------------
+# CurseForge fingerprints
+# ------------------------------------
+#  murmur2 (32 bit, seed 1) of the file contents
+#   with every tab, lf, cr and space byte taken out
+#  uses the murmurhash2 package when it's installed, else the python version below
+#   which mixes the blocks of a whole chunk at once (big int lanes) and only loops for the chaining.
+#  murmurhash2 only hashes whole buffers, so contents bigger than _C_MAX (pack archives)
+#   stream through the python version instead of being loaded in full
+# ------------------------------------
+
+_WHITESPACE = b'\x09\x0a\x0d\x20'
+_M = 0x5bd1e995
+_MASK = 0xffffffff
+_SEED = 1
+_BIG_ENDIAN = sys.byteorder == 'big'
+
+# 1024 B * 1024 = 1 MB
+_CHUNK = 1024 * 1024
+# Most stripped bytes handed to murmurhash2 in one buffer, verify_store hashes on every core at once
+_C_MAX = 32 * _CHUNK
+
+
+def _stripped_file(path: str):
+    with open(path, 'rb') as f:
+        while True:
+            data = f.read(_CHUNK)
+            if not data:
+                return
+            yield data.translate(None, _WHITESPACE)
+
+
+def _stripped_bytes(data: bytes):
+    for i in range(0, len(data), _CHUNK):
+        yield data[i:i + _CHUNK].translate(None, _WHITESPACE)
+
+
+def stripped_length(data: bytes):
+    """
+    :param data: some of a file's contents
+    :return: how many of its bytes the fingerprint hashes
+    """
+    return len(data.translate(None, _WHITESPACE))
+
+
+def _mix_blocks(data: bytes):
+    """
+    The per block part of murmur2 (k *= m, k ^= k >> 24, k *= m) for every block of data at once,
+    each block gets a 64 bit lane of one big int so the multiplications can't spill into the next one
+    :param data: little endian blocks, a multiple of 4 bytes
+    :return: the mixed blocks, same layout
+    """
+    count = len(data) // 4
+    lanes = bytearray(count * 8)
+    for i in range(4):
+        lanes[i::8] = data[i::4]
+
+    mask = int.from_bytes(b'\xff\xff\xff\xff\x00\x00\x00\x00' * count, 'little')
+    k = int.from_bytes(lanes, 'little')
+    k = k * _M & mask
+    k = (k ^ k >> 24) & mask
+    k = k * _M & mask
+
+    lanes = k.to_bytes(count * 8, 'little')
+    mixed = bytearray(count * 4)
+    for i in range(4):
+        mixed[i::4] = lanes[i::8]
+    return mixed
+
+
+def _murmur2(chunks, length: int = None):
+    """
+    :param chunks: callable giving a fresh iterator of stripped chunks
+    :param length: total length of the stripped chunks if it's already known, else they get read twice
+    """
+    if _c_murmur2 is not None and (length is None or length <= _C_MAX):
+        buffered = []
+        size = 0
+        for data in chunks():
+            size += len(data)
+            if size > _C_MAX:
+                break
+            buffered.append(data)
+        else:
+            return _c_murmur2(b''.join(buffered), _SEED)
+
+    # The hash is seeded with the (stripped) length, so that has to be known first,
+    #  the second read is served from the page cache most of the time
+    if length is None:
+        length = 0
+        for data in chunks():
+            length += len(data)
+
+    m = _M
+    mask = _MASK
+    h = (_SEED ^ length) & mask
+
+    # Leftover bytes of the previous chunk that didn't fill a block
+    rest = b''
+    for data in chunks():
+        if rest:
+            data = rest + data
+        _full = len(data) - (len(data) % 4)
+        rest = data[_full:]
+
+        # Blocks are little endian, a native cast is way faster than struct on most machines
+        mixed = _mix_blocks(data[:_full])
+        blocks = memoryview(mixed).cast('I')
+        if _BIG_ENDIAN:
+            blocks = memoryview(bytes(reversed(mixed))).cast('I')[::-1]
+
+        for k in blocks:
+            h = (h * m & mask) ^ k
+
+    if len(rest) == 3:
+        h ^= rest[2] << 16
+    if len(rest) >= 2:
+        h ^= rest[1] << 8
+    if len(rest) >= 1:
+        h ^= rest[0]
+        h = (h * m) & mask
+
+    h ^= h >> 13
+    h = (h * m) & mask
+    h ^= h >> 15
+
+    return h
+
+
+def fingerprint_file(path: str, length: int = None):
+    """
+    Computes the CurseForge fingerprint of a file
+    :param path: the file to hash
+    :param length: its stripped length (see stripped_length) if it was counted while writing it,
+                   saves reading the file twice
+    :return: the fingerprint as an unsigned 32 bit int
+    """
+    return _murmur2(lambda: _stripped_file(path), length)
+
+
+def fingerprint_bytes(data: bytes):
+    """
+    Computes the CurseForge fingerprint of some bytes
+    :param data: the contents to hash
+    :return: the fingerprint as an unsigned 32 bit int
+    """
+    return _murmur2(lambda: _stripped_bytes(data))
+
+
+def file_stamp(path: str):
+    """
+    What a cached verification is keyed by, if any of it changes the file gets hashed again
+    :param path: the file to stamp
+    :return: (size, mtime in ns)
+    """
+    st = os.stat(path)
+    return st.st_size, st.st_mtime_ns
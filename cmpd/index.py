@@ -0,0 +1,289 @@
+import json
+import os
+import sqlite3
+import threading
+
+from pathlib import Path
+
+from cmpd.locks import atomic_write
+from cmpd.logger import logger
+
+
+# ------------------------------------
+# Metadata indexes
+# ------------------------------------
+#  where ModStore keeps the addon and file infos
+#   json   : one file per addon/file under data/ (the original layout)
+#   sqlite : a single data/index.sqlite3
+#  both take and give back the plain dicts from get_json()
+# ------------------------------------
+
+class JsonIndex:
+    name = 'json'
+
+    def __init__(self, store_dir: str):
+        self.store_dir = store_dir
+
+    def _path(self, kind: str, uid):
+        return os.path.join(self.store_dir, 'data', kind, '{}.json'.format(uid))
+
+    def _read(self, kind: str, uid):
+        p = os.path
+        data_file = self._path(kind, uid)
+
+        # Check if it exists first
+        if not (p.exists(data_file) and p.isfile(data_file)):
+            return None
+
+        # TODO : Handle Exceptions
+        with open(data_file, 'r') as f:
+            a_data = f.read()
+        if len(a_data) == 0:
+            logger.critical('XX [{}] data for [{}] is empty!! returning a false!'.format(kind, uid))
+            return None
+        return json.loads(a_data)
+
+    def _write(self, kind: str, data: dict):
+        Path(os.path.join(self.store_dir, 'data', kind)).mkdir(parents=True, exist_ok=True)
+        # Never leaves a half written (or empty) file for another process to read
+        with atomic_write(self._path(kind, data['uid'])) as f:
+            json.dump(data, f)
+
+    def get_addon(self, addon_id):
+        return self._read('addons', addon_id)
+
+    def get_file(self, file_id):
+        return self._read('files', file_id)
+
+    def get_newest_file(self, file_ids: list, timestamps: dict = None):
+        """
+        :param file_ids: the files to pick from, the first one wins on ties
+        :param timestamps: their timestamps (str keys) from the addon record, only the newest file gets
+                           opened when it has them all
+        :return: the most recent one the index has, None if it has none of them
+        """
+        if timestamps and all(str(i) in timestamps for i in file_ids):
+            ordered = sorted(file_ids, key=lambda i: -timestamps[str(i)])
+            # sorted is stable so ties keep their order, files gone from the index fall back to the next one
+            for i in ordered:
+                data = self._read('files', i)
+                if data:
+                    return data
+            return None
+
+        newest = None
+        for i in file_ids:
+            data = self._read('files', i)
+            if data and (newest is None or data['timestamp'] > newest['timestamp']):
+                newest = data
+        return newest
+
+    def put_addon(self, data: dict):
+        self._write('addons', data)
+
+    def put_file(self, data: dict):
+        self._write('files', data)
+
+    def put_files(self, data: list):
+        for i in data:
+            self._write('files', i)
+
+    def drop_files(self, file_ids: list):
+        for i in file_ids:
+            data_file = self._path('files', i)
+            if os.path.isfile(data_file):
+                os.remove(data_file)
+
+    def iter_addons(self):
+        return self._iter('addons')
+
+    def iter_files(self):
+        return self._iter('files')
+
+    def _iter(self, kind: str):
+        folder = os.path.join(self.store_dir, 'data', kind)
+        if not os.path.isdir(folder):
+            return
+
+        for i in os.listdir(folder):
+            if not i.endswith('.json'):
+                continue
+            data = self._read(kind, i[:-5])
+            if data:
+                yield data
+
+    def close(self):
+        pass
+
+
+class SqliteIndex:
+    name = 'sqlite'
+    file_name = 'index.sqlite3'
+
+    _FILE_COLUMNS = ('uid', 'addon_uid', 'd_name', 'file_name', 'url', 'length', 'fingerprint', 'timestamp')
+
+    def __init__(self, store_dir: str):
+        self.store_dir = store_dir
+
+        Path(os.path.join(store_dir, 'data')).mkdir(parents=True, exist_ok=True)
+        self.db_file = os.path.join(store_dir, 'data', self.file_name)
+
+        # One connection shared by all the worker threads, guarded by the lock
+        self._lock = threading.Lock()
+        self.db = sqlite3.connect(self.db_file, check_same_thread=False, timeout=30)
+        self.db.execute('PRAGMA journal_mode=WAL')
+        self.db.execute('PRAGMA synchronous=NORMAL')
+        with self.db:
+            self.db.execute('CREATE TABLE IF NOT EXISTS addons ('
+                            ' uid INTEGER PRIMARY KEY, d_name TEXT, summary TEXT, url TEXT,'
+                            ' latest_files TEXT, categories TEXT)')
+            self.db.execute('CREATE TABLE IF NOT EXISTS files ('
+                            ' uid INTEGER PRIMARY KEY, addon_uid INTEGER, d_name TEXT, file_name TEXT, url TEXT,'
+                            ' length INTEGER, fingerprint INTEGER, timestamp REAL)')
+            self.db.execute('CREATE INDEX IF NOT EXISTS files_addon ON files (addon_uid, timestamp)')
+
+    @classmethod
+    def exists_in(cls, store_dir: str):
+        return os.path.isfile(os.path.join(store_dir, 'data', cls.file_name))
+
+    @staticmethod
+    def _uid(uid):
+        try:
+            return int(uid)
+        except (TypeError, ValueError):
+            return None
+
+    def get_addon(self, addon_id):
+        uid = self._uid(addon_id)
+        if uid is None:
+            return None
+
+        with self._lock:
+            row = self.db.execute('SELECT uid, d_name, summary, url, latest_files, categories FROM addons '
+                                  'WHERE uid = ?', (uid,)).fetchone()
+        if row is None:
+            return None
+
+        return {
+            'uid': row[0],
+            'd_name': row[1],
+            'summary': row[2],
+            'url': row[3],
+            'latest_files': json.loads(row[4]),
+            'categories': json.loads(row[5]) if row[5] else None,
+        }
+
+    def get_file(self, file_id):
+        uid = self._uid(file_id)
+        if uid is None:
+            return None
+
+        with self._lock:
+            row = self.db.execute('SELECT {} FROM files WHERE uid = ?'.format(', '.join(self._FILE_COLUMNS)),
+                                  (uid,)).fetchone()
+        if row is None:
+            return None
+
+        return dict(zip(self._FILE_COLUMNS, row))
+
+    def get_newest_file(self, file_ids: list, timestamps: dict = None):
+        """
+        :param file_ids: the files to pick from, the first one wins on ties
+        :param timestamps: not needed, the timestamps come from the files table
+        :return: the most recent one the index has, None if it has none of them.
+                 Only that one's row gets loaded
+        """
+        uids = [self._uid(i) for i in file_ids if self._uid(i) is not None]
+        if len(uids) == 0:
+            return None
+
+        with self._lock:
+            timestamps = dict(self.db.execute('SELECT uid, timestamp FROM files WHERE uid IN ({})'
+                                              .format(', '.join('?' * len(uids))), uids).fetchall())
+
+        newest = None
+        for i in uids:
+            if i in timestamps and (newest is None or timestamps[i] > timestamps[newest]):
+                newest = i
+        return self.get_file(newest) if newest is not None else None
+
+    def put_addon(self, data: dict):
+        self.put_addons([data])
+
+    def put_addons(self, data: list):
+        rows = [(i['uid'], i['d_name'], i['summary'], i['url'], json.dumps(i['latest_files']),
+                 json.dumps(i['categories']) if i.get('categories') else None) for i in data]
+
+        with self._lock, self.db:
+            self.db.executemany('INSERT OR REPLACE INTO addons VALUES (?, ?, ?, ?, ?, ?)', rows)
+
+    def put_file(self, data: dict):
+        self.put_files([data])
+
+    def put_files(self, data: list):
+        """
+        Writes several file infos in a single transaction
+        :param data: the file infos
+        """
+        rows = [tuple(i[c] for c in self._FILE_COLUMNS) for i in data]
+
+        with self._lock, self.db:
+            self.db.executemany('INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?, ?, ?, ?, ?)', rows)
+
+    def drop_files(self, file_ids: list):
+        rows = [(self._uid(i),) for i in file_ids]
+
+        with self._lock, self.db:
+            self.db.executemany('DELETE FROM files WHERE uid = ?', rows)
+
+    def iter_addons(self):
+        with self._lock:
+            uids = [i[0] for i in self.db.execute('SELECT uid FROM addons')]
+        for i in uids:
+            yield self.get_addon(i)
+
+    def iter_files(self):
+        with self._lock:
+            rows = self.db.execute('SELECT {} FROM files'.format(', '.join(self._FILE_COLUMNS))).fetchall()
+        for i in rows:
+            yield dict(zip(self._FILE_COLUMNS, i))
+
+    def import_from(self, other):
+        """
+        Copies everything from another index in one go
+        :param other: the index to import, usually the JsonIndex of the same store
+        :return: (addons imported, files imported)
+        """
+        addons = list(other.iter_addons())
+        files = list(other.iter_files())
+
+        self.put_addons(addons)
+        self.put_files(files)
+
+        return len(addons), len(files)
+
+    def close(self):
+        with self._lock:
+            self.db.close()
+
+
+INDEXES = {
+    JsonIndex.name: JsonIndex,
+    SqliteIndex.name: SqliteIndex,
+}
+
+
+def open_index(store_dir: str, kind: str = None):
+    """
+    Opens the metadata index of a store
+    :param store_dir: the store
+    :param kind: json, sqlite or None to use sqlite only if the store already has one
+    :return: the index
+    """
+    if kind is None or kind == 'auto':
+        kind = SqliteIndex.name if SqliteIndex.exists_in(store_dir) else JsonIndex.name
+
+    if kind not in INDEXES:
+        raise ValueError('Unknown index [{}], expected one of {}'.format(kind, list(INDEXES.keys())))
+
+    return INDEXES[kind](store_dir)
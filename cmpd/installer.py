@@ -0,0 +1,746 @@
+import json
+import os
+import shutil
+import threading
+import time
+import zipfile
+import zlib
+
+from argparse import Namespace
+from functools import partial
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import List
+
+from cmpd.ModStore import ModStore, AddonInfo, AddonFile
+from cmpd.archive import PackArchive, override_target
+from cmpd.cache import ApiCache
+from cmpd.linker import Linker, is_materialized
+from cmpd.logger import logger
+from cmpd.metrics import Metrics, NullMetrics, stage
+from cmpd.pipeline import ModPipeline
+from cmpd.policy import DownloadPolicy
+from cmpd.progress import Progress, make_sink
+from cmpd.session import HttpSession
+from cmpd.state import PackState
+from cmpd.usage import parse_size
+
+# What plan_modpack sorts the mods into
+#  unchanged : already in the output folder since the last run
+#  cached    : in the store
+#  reused    : identical contents stored under another file id
+#  partial   : a download that stopped halfway, only the rest gets fetched
+#  download  : fetched in full
+#  failed    : no info for it
+PLAN_CATEGORIES = ('unchanged', 'cached', 'reused', 'partial', 'download', 'failed')
+
+
+class CMPD:
+    def __init__(self, project_id, store_dir=None, out_dir=None, jobs: int = None, batch_size: int = None,
+                 timeout=None, verify: bool = True, index: str = None, link_mode: str = 'copy',
+                 progress: str = None, progress_interval: float = 1.0, api_base: str = None, full: bool = False,
+                 cache_mode: str = 'normal', cache_ttls: dict = None, session: HttpSession = None,
+                 store: ModStore = None, cache: ApiCache = None, max_store_size=None, metrics=None,
+                 metrics_path: str = None, metrics_format: str = 'json', policy: DownloadPolicy = None,
+                 retries: int = 3, mirrors: list = None, hedge_after: float = None):
+        # Data
+        _root = api_base or 'https://addons-ecs.forgesvc.net/api/v2/'
+        if not _root.endswith('/'):
+            _root += '/'
+        _api = {
+            'root': _root,
+            'addon_info': _root + 'addon/{0}',
+            'addon_desc': _root + 'addon/{0}/description',
+            'addon_files': _root + 'addon/{0}/files',
+            'file_info': _root + 'addon/{0}/file/{1}',
+            'files': _root + 'addon/files',
+            'file_link': _root + 'addon/{0}/file/{1}/download-url',
+        }
+
+        # Self vars
+        self.headers = {
+            'user-agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) '
+                          'Chrome/79.0.3945.88 Safari/537.36',
+            'dnt': '1',
+            'accept': '*/*',
+            'sec-fetch-site': 'cross-site',
+            'sec-fetch-mode': 'cors',
+            'accept-encoding': 'gzip, deflate, br',
+            'accept-language': 'en-US,en;q=0.9,ja;q=0.8,fil;q=0.7',
+        }
+        self.project_id = project_id
+        self.store_dir = store_dir or 'cmpd_store'
+        self.out_dir = out_dir or 'modpack'
+        # How many mods get resolved/downloaded at the same time
+        self.jobs = max(1, jobs or 4)
+        # How many file ids get asked for in a single api call
+        self.batch_size = max(1, batch_size or 50)
+        self.api = Namespace(**_api)
+        self.info = None
+        # Ignore what the last run left in out_dir and apply everything again
+        self.full = full
+        # How store files get into out_dir/mods
+        self.linker = Linker(link_mode)
+        # Least recently used store files get evicted after the run to fit in this (bytes or 10G, 500M, ...)
+        self.max_store_size = parse_size(max_store_size) if max_store_size else None
+
+        # session/store/cache can be handed in to share them with other instances (see CMPDBatch)
+        if session is not None:
+            # A shared session keeps its own headers, ours only fill in what's missing
+            for k, v in self.headers.items():
+                session.headers.setdefault(k, v)
+            self.headers = session.headers
+
+        # Aggregated over every download, reported every progress_interval seconds
+        #  progress is the sink kind (tty, log, json, none), or a sink object
+        if store is not None:
+            self.progress = store.progress
+        else:
+            _sink = make_sink(progress) if progress is None or isinstance(progress, str) else progress
+            self.progress = Progress(_sink, progress_interval)
+
+        # Timers and counters of every stage, only kept if asked for (a Metrics, or a metrics_path to write them to)
+        if metrics is None:
+            metrics = store.metrics if store is not None else (Metrics() if metrics_path else NullMetrics())
+        self.metrics = metrics
+        self.metrics_path = metrics_path
+        self.metrics_format = metrics_format
+
+        # Retries with backoff, mirrors to fail over to and hedging of slow downloads
+        policy = policy or DownloadPolicy(retries=retries, mirrors=mirrors, hedge_after=hedge_after,
+                                          metrics=self.metrics)
+
+        # One pool for the api and the downloads, sized so every download worker keeps its connection(s)
+        self.session = session or HttpSession(self.headers, pool_size=self.jobs * (2 if policy.hedge_after else 1),
+                                              timeout=timeout, metrics=self.metrics)
+        self.store = store or ModStore(self.store_dir, session=self.session, verify=verify, index=index,
+                                       progress=self.progress, offline=cache_mode == 'offline', metrics=self.metrics,
+                                       policy=policy)
+        # Api answers, refresh revalidates everything, offline never touches the network
+        self.cache = cache or ApiCache(self.store_dir, ttls=cache_ttls, mode=cache_mode, metrics=self.metrics)
+        self.manifest = None
+
+        # Filled in by prepare_modpack
+        self.pack_file: AddonFile = None
+        self.pack_archive: PackArchive = None
+        self.pack_files = []
+        self.new_files = []
+        self.state: PackState = None
+
+        self.mod_files: List[AddonFile] = []
+        self.failed_mods = []
+
+        # Set by cancel(), downloads stop between chunks and nothing new gets started
+        self.cancelled = threading.Event()
+
+    def set_header_val(self, ref, val=None):
+        if ref in self.headers and val is None:
+            self.headers.pop(ref)
+            return
+        self.headers[ref] = val
+
+    def unset_header_val(self, ref):
+        if ref in self.headers:
+            self.headers.pop(ref)
+
+    def cancel(self):
+        """
+        Stops the run as soon as the downloads in flight get to their next chunk,
+        safe to call from any thread
+        """
+        self.cancelled.set()
+
+    def download_modpack(self):
+        """
+        Begins the downloading of the assigned modpack
+        :return:
+        """
+        if not self.prepare_modpack():
+            self.export_metrics()
+            if self.info is None:
+                exit(-1)
+            return
+
+        # TODO : Handle Exceptions and Edge Cases
+        #   ps : no idea wtf the edge case I was talking about then, lol
+        # Resolving, downloading and copying to the output folder all overlap,
+        #  the lists are filled in manifest order below so the results
+        #  don't depend on which download finished first
+        logger.info('-- Downloading and copying files to output folder [{}].'.format(self.out_dir))
+
+        results = self.run_pipeline()
+        self.apply_results(results)
+
+        if self.cancelled.is_set():
+            self.abort_modpack()
+            self.export_metrics()
+            return
+
+        logger.info(' / Done copying mod files to output folder.')
+        self.finish_modpack()
+        self.export_metrics()
+
+    def export_metrics(self):
+        """
+        Writes the run's metrics to metrics_path, if there is one
+        """
+        if not self.metrics_path:
+            return
+
+        self.metrics.write(self.metrics_path, self.metrics_format)
+        logger.info(' / Metrics written to [{}].'.format(self.metrics_path))
+
+    @stage('pipeline')
+    def run_pipeline(self):
+        """
+        Resolves, downloads and copies every entry of new_files
+        :return: (addon file, failed name) for each entry of new_files, in the same order
+        """
+        pipeline = ModPipeline(self.resolve_file_infos, partial(self.store.download_to_store, cancel=self.cancelled),
+                               self.copy_mod_file, self.jobs, cost=self.store.bytes_to_fetch, cancel=self.cancelled)
+        self.progress.start()
+        try:
+            return pipeline.run(self.new_files)
+        finally:
+            self.progress.stop()
+
+    def plan_modpack(self):
+        """
+        Resolves every mod and works out what a run would do, without downloading
+        or touching the output folder (only the pack file itself gets downloaded, for its manifest)
+        :return: {category: {count, bytes}}, None if the pack couldn't be prepared
+        """
+        if not self.prepare_modpack(dry_run=True):
+            return None
+
+        plan = {i: {'count': 0, 'bytes': 0} for i in PLAN_CATEGORIES}
+
+        def add(category, size):
+            plan[category]['count'] += 1
+            plan[category]['bytes'] += size or 0
+
+        _new = set(str(i['fileID']) for i in self.new_files)
+        for i in self.pack_files:
+            if str(i['fileID']) not in _new:
+                stored = self.store.get_file_info(i['fileID'])
+                add('unchanged', stored.length if stored else 0)
+
+        for _, info in self.resolve_file_infos(self.new_files):
+            if info is None:
+                add('failed', 0)
+                continue
+            add(*self.store.plan_file(info))
+
+        self.pack_archive.close()
+        self.cache.save()
+
+        self.print_plan(plan)
+        self.export_metrics()
+        return plan
+
+    @staticmethod
+    def print_plan(plan: dict):
+        import humanize
+
+        logger.info('-- Plan')
+        for category in PLAN_CATEGORIES:
+            logger.info('    {} :: {} files :: {}'.format(
+                category.ljust(10),
+                str(plan[category]['count']).rjust(5),
+                humanize.naturalsize(plan[category]['bytes']).rjust(9),
+            ))
+        logger.info(' / [{}] to download.'.format(
+            humanize.naturalsize(plan['download']['bytes'] + plan['partial']['bytes'])))
+
+    @stage('prepare')
+    def prepare_modpack(self, dry_run: bool = False):
+        """
+        Everything before the mods get downloaded: gets the pack info and archive,
+        loads the manifest and works out which entries changed since the last run
+        :param dry_run: leave the output folder alone (for plan_modpack)
+        :return: whether there's anything to go on with
+        """
+
+        # Makes things easier
+        o_dir = self.out_dir
+        p = os.path
+
+        # TODO : Handle exceptions
+        # Make sure the output dir exists
+        if not (p.exists(o_dir) and p.isdir(o_dir)) and not dry_run:
+            os.makedirs(o_dir)
+
+        # Get modpack info
+        self.info = self.get_addon_info(self.project_id)
+
+        if self.info is None:
+            logger.critical(' x Halting process as the main modpack file cannot be retrieved')
+            return False
+
+        # Print info
+        self.print_pack_info(self.info)
+
+        # Get which one is the newest, a stored info picks it from the index without loading the others
+        self.pack_file = self.info.newest_file()
+
+        # Random sanity check
+        if self.pack_file is None:
+            logger.warning('Mod has no files ?')
+            return False
+
+        # Save modpack info to store, the pack file's too unless the index already has it
+        self.store.create_addon_details(self.info)
+        if not self.store.get_file_info(self.pack_file.uid):
+            self.store.create_file_details(self.pack_file)
+
+        logger.info('-- Downloading modpack file.')
+
+        # TODO   : Sanity check on whether this could also potentially download server files instead of client (BAD)
+        # UPDATE : It seems like it might (which is bad, really bad, for me anyways, lol)
+        #        :  will have to add a selection screen of sorts, hopefully can make it bearable
+        #        :  and not annoying at all, lol
+        # Download latest modpack file
+        mod_file = self.store.download_to_store(self.pack_file, cancel=self.cancelled)
+        if not mod_file:
+            logger.warning(' x Modpack download failed.')
+            return False
+
+        logger.info('-- Loading Manifest.')
+
+        # TODO : Handle Exceptions
+        #      : possibly fileExceptions from zipfile and jsonExceptions from json
+        # Cached in the store after the first read, the zip only gets opened if overrides changed
+        self.pack_archive = self.store.open_pack(self.pack_file, mod_file)
+        self.manifest = self.pack_archive.manifest
+        self.pack_files = self.manifest['files']
+
+        logger.info('-- Manifest Loaded.')
+
+        # Only what changed since the last run gets touched, full applies everything again
+        #  but still needs the last run's state to remove what the pack dropped since
+        self.state = PackState.load(o_dir, self.project_id)
+        self.new_files, dropped_files = self.state.diff_files(self.pack_files, self.full)
+        if len(self.pack_files) > len(self.new_files):
+            logger.info(' / [{}] mods unchanged since the last run.'
+                        .format(len(self.pack_files) - len(self.new_files)))
+
+        if dry_run:
+            return True
+
+        # Until finish_modpack records what the folder ended up with, gc and eviction in other processes
+        #  have to leave what this run is about to download or apply alone
+        self.store.usage.set_refs(o_dir, self.project_id, [self.pack_file.uid] + [i['fileID'] for i in self.pack_files],
+                                  self.linker.mode, pending=True)
+        self.store.usage.save()
+
+        self.remove_mod_files(self.state, dropped_files, self.pack_files)
+        Path(p.join(o_dir, 'mods')).mkdir(parents=True, exist_ok=True)
+
+        return True
+
+    def apply_results(self, results: list):
+        """
+        Records what happened to the new manifest entries
+        :param results: (addon file, failed name) for each entry of new_files, in the same order
+        """
+        p = os.path
+
+        for item, (info, failed) in zip(self.new_files, results):
+            if failed is not None:
+                self.failed_mods.append(failed)
+                continue
+            self.mod_files.append(info)
+            self.state.files[str(item['fileID'])] = {
+                'project_id': item['projectID'],
+                'file_name': p.split(info.linked_file_loc)[1],
+            }
+
+    @stage('finish')
+    def finish_modpack(self):
+        """
+        Everything after the mods are in place: overrides, the state file and the failure report
+        """
+        o_dir = self.out_dir
+        p = os.path
+        state = self.state
+
+        logger.info('-- Copying mod overrides to output folder.')
+        overrides = self.pack_archive.overrides
+        changed, dropped = state.diff_overrides(overrides, self.full)
+        root = p.abspath(o_dir)
+        for i in dropped:
+            # The state file could have come from a pack that listed ../ entries
+            target = override_target(root, i)
+            if target is None:
+                logger.warning(' ! Not removing dropped override [{}] as it points outside the output folder'
+                               .format(i))
+            elif p.isfile(target):
+                os.remove(target)
+        written, skipped = self.extract_overrides(self.pack_archive, changed) if len(changed) > 0 else (0, 0)
+        state.overrides = overrides
+        logger.info(' / Done copying overrides, [{}] written, [{}] already matching, [{}] removed.'
+                    .format(written, skipped, len(dropped)))
+
+        self.pack_archive.close()
+        state.pack_file_id = self.pack_file.uid
+        state.save()
+
+        if len(self.failed_mods) > 0:
+            logger.warning(' x [{}] Items Failed/Missing'.format(len(self.failed_mods)))
+            f_len = len(self.failed_mods)
+            fs_len = len(str(f_len))
+            for i in range(f_len):
+                item = self.failed_mods[i]
+                logger.warning('   #{} {}'.format(str(i).ljust(fs_len), item))
+
+        # What this output folder is made of, gc and eviction keep those
+        self.store.usage.set_refs(o_dir, self.project_id, [self.pack_file.uid] + list(state.files.keys()),
+                                  self.linker.mode)
+
+        self.store.save_verified()
+        self.store.usage.save()
+        self.cache.save()
+
+        if self.max_store_size:
+            self.store.evict(self.max_store_size)
+
+        _stats = self.session.stats()
+        logger.debug(' * [{}] requests over [{}] connections'.format(_stats['requests'], _stats['connections']))
+        for host, health in self.store.policy.stats().items():
+            logger.debug(' * [{}] :: {}'.format(host, health))
+        logger.info('-- Finished ?')
+
+    def abort_modpack(self):
+        """
+        Wraps up a run that stopped early, what made it to the output folder is recorded
+        so the next run picks up from there, overrides are left for that run
+        """
+        if self.pack_archive is not None:
+            self.pack_archive.close()
+        if self.state is not None:
+            self.state.save()
+
+        self.store.save_verified()
+        self.store.usage.save()
+        self.cache.save()
+        logger.warning(' x Stopped early, [{}] mods applied.'.format(len(self.mod_files)))
+
+    def copy_mod_files(self):
+        """
+        Copies every downloaded mod to the output folder
+        """
+        p = os.path
+        # Make sure we're good with the dirs
+        Path(p.join(self.out_dir, 'mods')).mkdir(parents=True, exist_ok=True)
+
+        for i in self.mod_files:
+            if not i:
+                continue
+            if not self.copy_mod_file(i):
+                self.failed_mods.append(i.d_name)
+
+    def copy_mod_file(self, addon_file: AddonFile):
+        """
+        Copies a single downloaded mod to the output folder
+        :param addon_file: the mod, already linked to its stored file
+        :return: whether the file is in place
+        """
+        p = os.path
+        src = addon_file.linked_file_loc
+
+        # TODO : Handle Exceptions
+        if src is None:
+            logger.error(' x Cannot find file linked to mod! skipping!')
+            return False
+
+        target = p.join(self.out_dir, 'mods', p.split(src)[1])
+
+        # Random sanity (?) check (? lol)
+        if not is_materialized(src, target):
+            logger.debug(' * Copying [{}] to out dir.'.format(addon_file.get_linked_file()))
+            _started = time.monotonic()
+            mode = self.linker.materialize(src, target)
+            self.metrics.observe('cmpd_copy_seconds', time.monotonic() - _started, mode=mode)
+            logger.info(' / {} [{}] to out dir.'.format(
+                'Copied ' if mode == 'copy' else 'Linked ({})'.format(mode),
+                addon_file.get_linked_file()
+            ))
+        else:
+            logger.debug(' / File [{}] already exists in target folder and matches.'
+                         .format(addon_file.get_linked_file()))
+
+        return True
+
+    def remove_mod_files(self, state: PackState, dropped: dict, pack_files: list):
+        """
+        Removes the mods a pack no longer has from the output folder
+        :param state: the state of the output folder
+        :param dropped: {file_id: state entry} of the mods that got dropped
+        :param pack_files: the manifest entries being applied
+        """
+        p = os.path
+        wanted = set(str(i['fileID']) for i in pack_files)
+        # Another (kept) file id might use the same file name
+        kept_names = set(v['file_name'] for k, v in state.files.items() if k in wanted)
+
+        for file_id, entry in dropped.items():
+            state.files.pop(file_id)
+            if entry['file_name'] in kept_names:
+                continue
+
+            target = override_target(p.abspath(p.join(self.out_dir, 'mods')), entry['file_name'])
+            if target is None:
+                logger.warning(' ! Not removing [{}] as it points outside the mods folder'.format(entry['file_name']))
+            elif p.isfile(target) or p.islink(target):
+                os.remove(target)
+                logger.info(' - Removed [{}], no longer part of the pack.'.format(entry['file_name']))
+
+    @stage('extract')
+    def extract_overrides(self, pack_archive: PackArchive, names: list = None):
+        """
+        Streams the overrides of the pack straight to their place in the output folder,
+        entries already on disk with the same size and crc are left alone
+        :param pack_archive: the modpack archive
+        :param names: only these overrides (relative to the output folder), None for all of them
+        :return: (written, skipped)
+        """
+        p = os.path
+        names = set(names) if names is not None else None
+        root = p.abspath(self.out_dir)
+
+        # TODO : Slight chance of 'override' folder being a flexibly named dir
+        #      :  that is hard referenced within the addon info json from the api
+        archive = pack_archive.zip
+        entries = []
+        for i in archive.infolist():
+            if not i.filename.startswith('overrides/'):
+                continue
+            rel = i.filename[len('overrides/'):]
+            # Folders are not tracked in the state, creating them again is cheap (and keeps empty ones around)
+            if names is not None and rel not in names and not i.is_dir():
+                continue
+
+            target = override_target(root, rel)
+            if target is None:
+                if len(rel.strip('/')) > 0:
+                    logger.warning(' ! Skipping override [{}] as it points outside the output folder'.format(rel))
+                continue
+            if i.is_dir():
+                Path(target).mkdir(parents=True, exist_ok=True)
+                continue
+            entries.append((i, target))
+
+        # Workers share the mapped archive, decompression runs outside the gil
+        def extract(job):
+            info, target = job
+            if self._override_matches(info, target):
+                return False
+
+            Path(p.dirname(target)).mkdir(parents=True, exist_ok=True)
+            temp = '{}.{}.tmp'.format(target, threading.get_ident())
+            with archive.open(info, 'r') as src, open(temp, 'wb') as dst:
+                shutil.copyfileobj(src, dst, 1024 * 256)
+            os.replace(temp, target)
+            return True
+
+        with ThreadPoolExecutor(max_workers=self.jobs) as pool:
+            written = sum(pool.map(extract, entries))
+
+        return written, len(entries) - written
+
+    @staticmethod
+    def _override_matches(info: zipfile.ZipInfo, target: str):
+        p = os.path
+        if not p.isfile(target) or p.getsize(target) != info.file_size:
+            return False
+
+        crc = 0
+        with open(target, 'rb') as f:
+            for data in iter(lambda: f.read(1024 * 256), b''):
+                crc = zlib.crc32(data, crc)
+        return crc == info.CRC
+
+    def get_addon_info(self, addon_id):
+        api = self.api
+        url = api.addon_info.format(addon_id)
+
+        # The stored copy is good until its ttl runs out (forever when offline)
+        if self.cache.offline or self.cache.is_fresh('addon_info', url):
+            f_store = self.store.get_addon_info(addon_id)
+            if f_store:
+                return f_store
+
+        try:
+            status, j_source = self.cache.fetch(self.session, 'addon_info', url)
+            if status == 200:
+                return AddonInfo.create_from_json(json.loads(j_source))
+        except Exception as e:
+            logger.h_except(e)
+
+        # Better an old copy than nothing
+        f_store = self.store.get_addon_info(addon_id)
+        if f_store:
+            logger.warning(' ! Could not refresh addon info for [{}], using the stored one'.format(addon_id))
+            return f_store
+
+        logger.error(' x Failed getting addon info for [{}]'.format(addon_id))
+        return None
+
+    def get_addon_file_info(self, addon_id, file_id):
+        if not self.cache.refresh:
+            f_store = self.store.get_file_info(file_id)
+            if f_store:
+                return f_store
+
+        return self.fetch_addon_file_info(addon_id, file_id)
+
+    def fetch_addon_file_info(self, addon_id, file_id):
+        """
+        Gets a file's info straight from the api, skipping the store
+        :param addon_id: the id of the addon the file belongs to
+        :param file_id: the id of the file
+        :return: the file info, None if it cannot be retrieved
+        """
+        api = self.api
+
+        try:
+            # The store keeps the good answers, the cache only has to remember the failed ones
+            status, j_source = self.cache.fetch(self.session, 'file_info', api.file_info.format(addon_id, file_id),
+                                                remember=False, key=self._file_info_url(file_id))
+            if status == 200:
+                return AddonFile.create_from_json(json.loads(j_source), addon_id)
+        except Exception as e:
+            logger.h_except(e)
+
+        logger.error(' x Failed getting file info for [{}]'.format(file_id))
+        return None
+
+    def fetch_addon_file_infos(self, file_ids: list):
+        """
+        Gets the info of several files with a single api call
+        :param file_ids: the ids of the files
+        :return: dict of file id to file info, None if the batch call failed as a whole
+        """
+        api = self.api
+
+        if self.cache.offline:
+            return {}
+
+        try:
+            with self.metrics.timer('cmpd_api_seconds', endpoint='files'):
+                _r = self.session.post(api.files, json=file_ids)
+            _r.raise_for_status()
+            j_data = json.loads(_r.content.decode('utf-8'))
+        except Exception as e:
+            logger.h_except(e)
+            logger.warning(' ! Batch file info call failed for [{}] files'.format(len(file_ids)))
+            return None
+
+        # The endpoint maps each requested id to a list of files,
+        #  be lenient in case it ever returns a plain list instead
+        entries = []
+        for i in (j_data.values() if isinstance(j_data, dict) else j_data):
+            entries.extend(i if isinstance(i, list) else [i])
+
+        found = {}
+        for i in entries:
+            try:
+                found[i['id']] = AddonFile.create_from_json(i)
+            except Exception as e:
+                logger.h_except(e)
+
+        # Remember what the api doesn't know about, so it isn't asked for again right away
+        for i in file_ids:
+            if i not in found:
+                self.cache.put_negative(self._file_info_url(i))
+
+        return found
+
+    def _file_info_url(self, file_id):
+        # Cache key, the project id isn't always known so it's left out
+        return self.api.file_info.format('*', file_id)
+
+    def resolve_file_infos(self, pack_files: list):
+        """
+        Resolves the info of every manifest entry, store hits are handed out
+        right away, the rest is asked from the api in chunks of batch_size.
+        Falls back to concurrent single lookups if a batch call fails.
+        :param pack_files: the manifest entries
+        :return: generator of (index, file info or None)
+        """
+        _p_len = len(pack_files)
+        _count = 0
+        misses = []
+
+        for i in range(_p_len):
+            f_store = None if self.cache.refresh else self.store.get_file_info(pack_files[i]['fileID'])
+            if not f_store:
+                misses.append(i)
+                continue
+
+            _count += 1
+            logger.info('-- #{} of {} :: ID [{}] (stored)'.format(str(_count).rjust(3), str(_p_len).rjust(3),
+                                                                 f_store.uid))
+            self.metrics.inc('cmpd_resolve_total', source='store')
+            yield i, f_store
+
+        # Looked up recently and it didn't exist, no point in asking again yet
+        _dead = [i for i in misses if self.cache.is_negative('file_info', self._file_info_url(pack_files[i]['fileID']))]
+        for i in _dead:
+            _count += 1
+            logger.warning(' ! Skipping [{}] as it was unavailable recently'.format(pack_files[i]['fileID']))
+            self.metrics.inc('cmpd_resolve_total', source='dead')
+            yield i, None
+        _dead = set(_dead)
+        misses = [i for i in misses if i not in _dead]
+
+        for c in range(0, len(misses), self.batch_size):
+            chunk = misses[c:c + self.batch_size]
+            found = self.fetch_addon_file_infos([pack_files[i]['fileID'] for i in chunk])
+
+            if found is None:
+                with ThreadPoolExecutor(max_workers=self.jobs) as pool:
+                    singles = pool.map(
+                        lambda i: self.fetch_addon_file_info(pack_files[i]['projectID'], pack_files[i]['fileID']),
+                        chunk
+                    )
+                    found = {pack_files[i]['fileID']: info for i, info in zip(chunk, singles)}
+
+            resolved = []
+            for i in chunk:
+                item = pack_files[i]
+                info = found.get(item['fileID'])
+                _count += 1
+
+                if info is None:
+                    logger.warning(' ! Skipping [{}] as it seems unavailable'.format(item['fileID']))
+                    self.metrics.inc('cmpd_resolve_total', source='unavailable')
+                    resolved.append((i, None))
+                    continue
+
+                if info.addon_uid == -1:
+                    info.addon_uid = item['projectID']
+
+                logger.info('-- #{} of {} :: ID [{}]'.format(str(_count).rjust(3), str(_p_len).rjust(3), info.uid))
+                self.metrics.inc('cmpd_resolve_total', source='api')
+                resolved.append((i, info))
+
+            # What came from the api goes to the index in one go per chunk, before any of it gets downloaded
+            #  (downloading doesn't write infos, and a cancelled run never gets to the end of this)
+            self.store.create_file_details_many([info for _, info in resolved if info is not None])
+            yield from resolved
+
+    @staticmethod
+    def print_pack_info(pack_info: AddonInfo):
+        logger.info('''
+        -----------------------------------
+        :: {}
+        -----------------------------------
+         : {}
+        -----------------------------------
+        :: Project ID:    {}
+        -----------------------------------'''.format(
+            pack_info.d_name,
+            pack_info.summary,
+            pack_info.uid,
+        ))
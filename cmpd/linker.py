@@ -0,0 +1,127 @@
+import errno
+import os
+import shutil
+import threading
+
+from cmpd.logger import logger
+
+# ------------------------------------
+# Materializing store files elsewhere
+# ------------------------------------
+#  copy     : plain copy, works everywhere
+#  hardlink : same inode, needs the same filesystem
+#  reflink  : copy-on-write clone (btrfs, xfs, ...), linux only for now
+#  symlink  : points back to the store, needs privileges on windows
+# ------------------------------------
+
+LINK_MODES = ('copy', 'hardlink', 'reflink', 'symlink')
+
+# linux/fs.h :: _IOW(0x94, 9, int)
+_FICLONE = 0x40049409
+
+# Errors meaning "this filesystem/os can't do that", anything else is a real failure
+_UNSUPPORTED = {errno.EXDEV, errno.EPERM, errno.EACCES, errno.ENOTSUP, errno.EOPNOTSUPP, errno.EINVAL,
+                errno.ENOSYS, errno.ENOTTY, errno.EBADF}
+
+
+def _reflink(src: str, target: str):
+    try:
+        import fcntl
+    except ImportError:
+        raise OSError(errno.ENOSYS, 'reflink is not supported on this os')
+
+    with open(src, 'rb') as s, open(target, 'wb') as t:
+        fcntl.ioctl(t.fileno(), _FICLONE, s.fileno())
+
+
+def _hardlink(src: str, target: str):
+    os.link(src, target)
+
+
+def _symlink(src: str, target: str):
+    os.symlink(os.path.abspath(src), target)
+
+
+def _copy(src: str, target: str):
+    shutil.copyfile(src, target)
+
+
+_METHODS = {
+    'copy': _copy,
+    'hardlink': _hardlink,
+    'reflink': _reflink,
+    'symlink': _symlink,
+}
+
+
+def is_materialized(src: str, target: str):
+    """
+    Checks if the target already holds the src file
+    :param src: the store file
+    :param target: the materialized file
+    :return: whether there's nothing left to do
+    """
+    p = os.path
+    if p.islink(target):
+        return p.realpath(target) == p.realpath(src)
+    if not p.isfile(target):
+        return False
+
+    s_stat = os.stat(src)
+    t_stat = os.stat(target)
+    # Hardlinked, or the same size (what copy_mod_files always checked)
+    return p.samestat(s_stat, t_stat) or s_stat.st_size == t_stat.st_size
+
+
+class Linker:
+    def __init__(self, mode: str = 'copy'):
+        """
+        Puts store files into output folders with the chosen method,
+        falling back to a plain copy once the method turns out to be unsupported
+        :param mode: one of LINK_MODES
+        """
+        if mode not in LINK_MODES:
+            raise ValueError('Unknown link mode [{}], expected one of {}'.format(mode, LINK_MODES))
+
+        self.mode = mode
+        self._lock = threading.Lock()
+        # (src device, target dir device) pairs the mode didn't work on
+        self._unsupported = set()
+
+    def materialize(self, src: str, target: str):
+        """
+        Puts src at target, replacing whatever was there
+        :param src: the store file
+        :param target: where it should show up
+        :return: the method that was actually used
+        """
+        p = os.path
+        mode = self.mode
+        key = None
+
+        if mode != 'copy':
+            key = (os.stat(src).st_dev, os.stat(p.dirname(target) or '.').st_dev)
+            with self._lock:
+                if key in self._unsupported:
+                    mode = 'copy'
+
+        # Build it next to the target then swap it in, never leaves a half written file behind
+        temp = '{}.{}.tmp'.format(target, threading.get_ident())
+        try:
+            _METHODS[mode](src, temp)
+        except OSError as e:
+            if p.lexists(temp):
+                os.remove(temp)
+            if mode == 'copy' or e.errno not in _UNSUPPORTED:
+                raise
+
+            with self._lock:
+                if key not in self._unsupported:
+                    logger.warning(' ! Cannot {} [{}] here ({}), copying instead.'.format(mode, src, e.strerror))
+                    self._unsupported.add(key)
+
+            mode = 'copy'
+            _METHODS[mode](src, temp)
+
+        os.replace(temp, target)
+        return mode
@@ -0,0 +1,171 @@
+import json
+import os
+import threading
+import time
+
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+    import msvcrt
+
+
+# ------------------------------------
+# Cross process locks and atomic writes
+# ------------------------------------
+#  several cmpd processes can share one store, so
+#   - FileLock      : an advisory lock on a lock file (flock / msvcrt.locking),
+#                     held per open file so threads of one process exclude each other too
+#   - atomic_write  : writes a temp file next to the target then renames it over,
+#                     readers only ever see the old or the new contents
+#  lock files are left in place, deleting them would race with whoever opens them next
+# ------------------------------------
+
+class FileLock:
+    # How often a blocked lock is tried again where the os can't wait for us (windows)
+    poll_interval = 0.05
+
+    def __init__(self, path: str):
+        """
+        :param path: the lock file, created if missing
+        """
+        self.path = path
+        self._f = None
+
+    def _try_lock(self, blocking: bool):
+        fd = self._f.fileno()
+        if fcntl is not None:
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX if blocking else fcntl.LOCK_EX | fcntl.LOCK_NB)
+                return True
+            except BlockingIOError:
+                return False
+
+        while True:
+            try:
+                self._f.seek(0)
+                msvcrt.locking(fd, msvcrt.LK_NBLCK, 1)
+                return True
+            except OSError:
+                if not blocking:
+                    return False
+                time.sleep(self.poll_interval)
+
+    def acquire(self, blocking: bool = True):
+        """
+        :param blocking: wait for whoever holds it, instead of giving up right away
+        :return: whether the lock is now held
+        """
+        if self._f is not None:
+            raise RuntimeError('Lock [{}] is already held'.format(self.path))
+
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        self._f = open(self.path, 'a+')
+        if not self._try_lock(blocking):
+            self._f.close()
+            self._f = None
+            return False
+        return True
+
+    def release(self):
+        if self._f is None:
+            return
+
+        try:
+            if fcntl is not None:
+                fcntl.flock(self._f.fileno(), fcntl.LOCK_UN)
+            else:
+                self._f.seek(0)
+                msvcrt.locking(self._f.fileno(), msvcrt.LK_UNLCK, 1)
+        finally:
+            self._f.close()
+            self._f = None
+
+    @property
+    def locked(self):
+        return self._f is not None
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.release()
+
+
+def temp_path(path: str):
+    """
+    :return: a temp file name next to path, unique to this process and thread
+    """
+    return '{}.{}.{}.tmp'.format(path, os.getpid(), threading.get_ident())
+
+
+@contextmanager
+def atomic_write(path: str, mode: str = 'w', perms: int = None):
+    """
+    Opens a temp file that replaces path once the block is done, or gets removed if it fails
+    :param path: the file to write
+    :param mode: w or wb
+    :param perms: permissions the file is created with (0o600 for secrets), the umask's default otherwise
+    """
+    temp = temp_path(path)
+    try:
+        if perms is None:
+            f = open(temp, mode)
+        else:
+            # A leftover temp file would keep its own permissions
+            if os.path.exists(temp):
+                os.remove(temp)
+            f = os.fdopen(os.open(temp, os.O_CREAT | os.O_EXCL | os.O_WRONLY | getattr(os, 'O_BINARY', 0), perms),
+                          mode)
+        with f:
+            yield f
+        os.replace(temp, path)
+    except BaseException:
+        if os.path.exists(temp):
+            os.remove(temp)
+        raise
+
+
+def update_json(path: str, update):
+    """
+    Read-modify-writes a json file while holding its lock, so updates from other processes aren't lost
+    :param path: the json file
+    :param update: called with the current contents ({} if missing or unreadable), returns the new ones
+    :return: the new contents
+    """
+    with FileLock(path + '.lock'):
+        try:
+            with open(path, 'r') as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            data = {}
+
+        data = update(data)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with atomic_write(path) as f:
+            json.dump(data, f)
+
+    return data
+
+
+def merge_changed(data: dict, current: dict, changed, pick=None):
+    """
+    Puts the keys this process changed on top of what's on disk, for update_json,
+    the keys it didn't touch keep whatever other processes saved
+    :param data: the contents on disk, updated in place
+    :param current: this process' copy
+    :param changed: keys of current that changed, the ones no longer in it get removed
+    :param pick: (on disk, ours) -> value to keep when both have the key, ours by default
+    :return: data
+    """
+    for key in changed:
+        if key not in current:
+            data.pop(key, None)
+        elif pick is not None and key in data:
+            data[key] = pick(data[key], current[key])
+        else:
+            data[key] = current[key]
+    return data
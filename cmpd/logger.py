@@ -82,27 +82,62 @@ logging.HIDDEN_EXCEPTION = HIDDEN_EXCEPTION
 # -----------------------------------------------
 
 logger = logging.getLogger(__name__)
-logger.setLevel(logging.DEBUG)
 
 log_fmt = logging.Formatter('%(asctime)s :: %(filename)12s:%(lineno)-4s :: %(levelname)-7s :: %(message)s',
                             '%Y-%m-%d %I:%M:%S %p')
 
-# INFO only
-log_ich = logging.StreamHandler(sys.stdout)
-log_ich.setLevel(logging.DEBUG)
-log_ich.setFormatter(log_fmt)
-log_ich.addFilter(LogFilter(logging.INFO, FilterRestrictions.EXACT))
-
-# WARNING TILL CRITICAL (NO H_EXCEPT)
-log_ech = logging.StreamHandler(sys.stderr)
-log_ech.setLevel(logging.DEBUG)
-log_ech.setFormatter(log_fmt)
-log_ech.addFilter(LogFilter([logging.WARNING, logging.CRITICAL], FilterRestrictions.RANGE_INC))
-
-log_fh = logging.FileHandler('cmpd2.log', 'w')
-log_fh.setLevel(logging.DEBUG)
-log_fh.setFormatter(log_fmt)
-
-logger.addHandler(log_ich)
-logger.addHandler(log_ech)
-logger.addHandler(log_fh)
+LOG_LEVELS = ('debug', 'info', 'warning', 'error')
+
+# What setup_logging added, so calling it again replaces them
+_handlers = []
+
+
+def setup_logging(path: str = 'cmpd2.log', level='debug'):
+    """
+    Sends the logs to stdout (info), stderr (warning till critical) and a log file.
+    Importing cmpd leaves logging alone, entry points call this (library users can too, or add their own handlers)
+    :param path: the log file, truncated once the first record comes in, None to not keep one
+    :param level: the lowest level logged, a logging level or one of LOG_LEVELS
+    """
+    if isinstance(level, str):
+        level = logging.getLevelName(level.upper())
+
+    for i in _handlers:
+        logger.removeHandler(i)
+        i.close()
+    _handlers.clear()
+
+    logger.setLevel(level)
+
+    # INFO only
+    log_ich = logging.StreamHandler(sys.stdout)
+    log_ich.setLevel(logging.DEBUG)
+    log_ich.setFormatter(log_fmt)
+    log_ich.addFilter(LogFilter(logging.INFO, FilterRestrictions.EXACT))
+    _handlers.append(log_ich)
+
+    # WARNING TILL CRITICAL (NO H_EXCEPT)
+    log_ech = logging.StreamHandler(sys.stderr)
+    log_ech.setLevel(logging.DEBUG)
+    log_ech.setFormatter(log_fmt)
+    log_ech.addFilter(LogFilter([logging.WARNING, logging.CRITICAL], FilterRestrictions.RANGE_INC))
+    _handlers.append(log_ech)
+
+    if path:
+        log_fh = logging.FileHandler(path, 'w', delay=True)
+        log_fh.setLevel(logging.DEBUG)
+        log_fh.setFormatter(log_fmt)
+        _handlers.append(log_fh)
+
+    for i in _handlers:
+        logger.addHandler(i)
+
+
+def move_info_logs(stream):
+    """
+    Sends the info logs setup_logging put on stdout somewhere else, for when stdout is taken (json progress)
+    :param stream: where they go from now on
+    """
+    for i in _handlers:
+        if isinstance(i, logging.StreamHandler) and i.stream is sys.stdout:
+            i.setStream(stream)
@@ -0,0 +1,206 @@
+import json
+import threading
+import time
+
+from contextlib import contextmanager
+from functools import wraps
+
+from cmpd.locks import atomic_write
+
+
+# ------------------------------------
+# Run metrics
+# ------------------------------------
+#  counters   : cmpd_*_total, only go up
+#  histograms : cmpd_*_seconds / cmpd_*_bytes, bucketed like prometheus does
+#  both take labels as keyword arguments, timer() observes how long its block took.
+#  NullMetrics has the same surface and does nothing, it's what runs get by default
+# ------------------------------------
+
+# Seconds, from a local api answer to a big download
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+METRICS_FORMATS = ('json', 'prometheus')
+
+
+def _key(name: str, labels: dict):
+    if not labels:
+        return name, ()
+    return name, tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+def _prom_name(name: str, labels: tuple, extra: tuple = ()):
+    labels = labels + extra
+    if not labels:
+        return name
+    return '{}{{{}}}'.format(name, ','.join('{}="{}"'.format(k, v.replace('"', '\\"')) for k, v in labels))
+
+
+class _Histogram:
+    __slots__ = ('buckets', 'counts', 'count', 'sum', 'min', 'max')
+
+    def __init__(self, buckets: tuple):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.count = 0
+        self.sum = 0.0
+        self.min = None
+        self.max = None
+
+    def observe(self, value: float):
+        self.count += 1
+        self.sum += value
+        self.min = value if self.min is None else min(self.min, value)
+        self.max = value if self.max is None else max(self.max, value)
+        for i, le in enumerate(self.buckets):
+            if value <= le:
+                self.counts[i] += 1
+                break
+
+
+class Metrics:
+    enabled = True
+
+    def __init__(self, buckets: tuple = DEFAULT_BUCKETS):
+        """
+        :param buckets: upper bounds of the histogram buckets, in seconds
+        """
+        self.buckets = tuple(buckets)
+        self.started = time.time()
+
+        self._lock = threading.Lock()
+        self.counters = {}
+        self.histograms = {}
+
+    def inc(self, name: str, amount: float = 1, **labels):
+        key = _key(name, labels)
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + amount
+
+    def observe(self, name: str, value: float, **labels):
+        key = _key(name, labels)
+        with self._lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = _Histogram(self.buckets)
+            histogram.observe(value)
+
+    @contextmanager
+    def timer(self, name: str, **labels):
+        started = time.monotonic()
+        try:
+            yield
+        finally:
+            self.observe(name, time.monotonic() - started, **labels)
+
+    def report(self):
+        """
+        :return: every counter and histogram as a json friendly dict
+        """
+        with self._lock:
+            counters = {_prom_name(n, l): v for (n, l), v in sorted(self.counters.items())}
+            histograms = {}
+            for (n, l), h in sorted(self.histograms.items()):
+                histograms[_prom_name(n, l)] = {
+                    'count': h.count,
+                    'sum': round(h.sum, 6),
+                    'min': h.min,
+                    'max': h.max,
+                    'avg': h.sum / h.count if h.count else None,
+                    'buckets': {str(le): c for le, c in zip(h.buckets, h.counts)},
+                }
+
+        return {
+            'started': self.started,
+            'elapsed': round(time.time() - self.started, 3),
+            'counters': counters,
+            'histograms': histograms,
+        }
+
+    def to_prometheus(self):
+        """
+        :return: the metrics in the prometheus text exposition format
+        """
+        lines = []
+        typed = set()
+
+        def _type(name: str, kind: str):
+            if name not in typed:
+                typed.add(name)
+                lines.append('# TYPE {} {}'.format(name, kind))
+
+        with self._lock:
+            for (n, l), v in sorted(self.counters.items()):
+                _type(n, 'counter')
+                lines.append('{} {}'.format(_prom_name(n, l), v))
+
+            for (n, l), h in sorted(self.histograms.items()):
+                _type(n, 'histogram')
+                cumulative = 0
+                for le, c in zip(h.buckets, h.counts):
+                    cumulative += c
+                    lines.append('{} {}'.format(_prom_name(n + '_bucket', l, (('le', str(le)),)), cumulative))
+                lines.append('{} {}'.format(_prom_name(n + '_bucket', l, (('le', '+Inf'),)), h.count))
+                lines.append('{} {}'.format(_prom_name(n + '_sum', l), h.sum))
+                lines.append('{} {}'.format(_prom_name(n + '_count', l), h.count))
+
+        return '\n'.join(lines) + '\n'
+
+    def write(self, path: str, fmt: str = 'json'):
+        """
+        :param path: where the report goes
+        :param fmt: json or prometheus
+        """
+        if fmt not in METRICS_FORMATS:
+            raise ValueError('Unknown metrics format [{}], expected one of {}'.format(fmt, METRICS_FORMATS))
+
+        with atomic_write(path) as f:
+            if fmt == 'json':
+                json.dump(self.report(), f, indent=2)
+            else:
+                f.write(self.to_prometheus())
+
+
+def stage(name: str):
+    """
+    Times a method as a run stage (cmpd_stage_seconds{stage=name}), through its object's metrics
+    """
+    def decorator(func):
+        @wraps(func)
+        def timed(self, *args, **kwargs):
+            with self.metrics.timer('cmpd_stage_seconds', stage=name):
+                return func(self, *args, **kwargs)
+        return timed
+    return decorator
+
+
+class _NullTimer:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        return False
+
+
+class NullMetrics:
+    enabled = False
+
+    _timer = _NullTimer()
+
+    def inc(self, name: str, amount: float = 1, **labels):
+        pass
+
+    def observe(self, name: str, value: float, **labels):
+        pass
+
+    def timer(self, name: str, **labels):
+        return self._timer
+
+    def report(self):
+        return {}
+
+    def to_prometheus(self):
+        return ''
+
+    def write(self, path: str, fmt: str = 'json'):
+        pass
@@ -0,0 +1,158 @@
+import queue
+import threading
+
+from typing import Callable, List, Optional, Tuple
+
+from cmpd.Addons import AddonFile
+from cmpd.logger import logger
+
+
+# ------------------------------------
+# Mod pipeline
+# ------------------------------------
+#  manifest entries
+#    -> resolve  (store + batched api calls)
+#    -> download (network, jobs threads)
+#    -> copy     (disk, single thread)
+#  each stage hands its items to the next one through a queue
+#   so api latency, bandwidth and disk io overlap instead of adding up.
+#  downloads are handed out biggest first (longest processing time first),
+#   small files fill in the gaps so a big one doesn't end up running alone at the end.
+#   files with nothing to fetch go before all of them, they only keep the copy stage busy
+# ------------------------------------
+
+class ModPipeline:
+    # Marks the end of a queue
+    _DONE = object()
+
+    def __init__(self, resolve: Callable, download: Callable, copy: Callable, jobs: int = 4,
+                 cost: Callable = None, cancel: threading.Event = None):
+        """
+        :param resolve: takes all the manifest entries, yields (index, AddonFile or None)
+                        as soon as each one is known
+        :param download: takes an AddonFile, returns the stored file location or None
+        :param copy: takes a downloaded AddonFile, returns whether it made it to the output folder
+        :param jobs: how many workers the download stage gets
+        :param cost: takes an AddonFile, returns how much work downloading it is (bytes to fetch),
+                     defaults to the file's length
+        :param cancel: once set, nothing new gets resolved or downloaded, what's left counts as failed
+        """
+        self.resolve = resolve
+        self.download = download
+        self.copy = copy
+        self.jobs = max(1, jobs)
+        self.cost = cost or (lambda info: info.length or 0)
+        self.cancel = cancel or threading.Event()
+
+        # (done?, fetches?, -cost, seq, job), seq keeps equal costs in manifest order and jobs from being compared
+        self.resolved = queue.PriorityQueue()
+        self._seq = 0
+        self.landed = queue.Queue()
+        self.results: List[Tuple[Optional[AddonFile], Optional[object]]] = []
+
+    def run(self, items: list):
+        """
+        Pushes all the items through the pipeline
+        :param items: the manifest entries
+        :return: list of (addon file, failed name) in the same order as the items,
+                 only one of the two is ever set
+        """
+        self.results = [(None, None)] * len(items)
+
+        resolver = threading.Thread(target=self._resolve_stage, args=(items,), daemon=True)
+        downloaders = [threading.Thread(target=self._download_stage, daemon=True) for _ in range(self.jobs)]
+        copier = threading.Thread(target=self._copy_stage, daemon=True)
+
+        resolver.start()
+        for i in downloaders:
+            i.start()
+        copier.start()
+
+        resolver.join()
+        for i in downloaders:
+            i.join()
+
+        # Downloaders are all done, nothing else will land
+        self.landed.put(self._DONE)
+        copier.join()
+
+        return self.results
+
+    def _resolve_stage(self, items: list):
+        pending = set(range(len(items)))
+
+        try:
+            for index, info in self.resolve(items):
+                if self.cancel.is_set():
+                    break
+                pending.discard(index)
+
+                if info is None:
+                    # UID since we still have no clue about the file name atm
+                    self.results[index] = (None, items[index]['fileID'])
+                    continue
+
+                try:
+                    cost = self.cost(info)
+                except Exception as e:
+                    logger.h_except(e)
+                    cost = 0
+                self._put(False, cost, (index, info))
+        except Exception as e:
+            logger.h_except(e)
+            logger.error(' x Resolving stopped early, [{}] entries left unresolved'.format(len(pending)))
+
+        for index in pending:
+            self.results[index] = (None, items[index]['fileID'])
+
+        # One for each downloader, they sort after every real job
+        for _ in range(self.jobs):
+            self._put(True, 0, self._DONE)
+
+    def _put(self, done: bool, cost: int, job):
+        self._seq += 1
+        self.resolved.put((done, cost > 0, -cost, self._seq, job))
+
+    def _download_stage(self):
+        while True:
+            job = self.resolved.get()[-1]
+            if job is self._DONE:
+                return
+
+            index, info = job
+            if self.cancel.is_set():
+                self.results[index] = (None, info.d_name)
+                continue
+
+            try:
+                file_loc = self.download(info)
+            except Exception as e:
+                logger.h_except(e)
+                file_loc = None
+
+            if file_loc is None:
+                logger.warning(' x Cannot download [{}]'.format(info.d_name))
+                self.results[index] = (None, info.d_name)
+                continue
+
+            info.set_linked_file(file_loc)
+            self.landed.put((index, info))
+
+    def _copy_stage(self):
+        while True:
+            job = self.landed.get()
+            if job is self._DONE:
+                return
+
+            index, info = job
+            try:
+                copied = self.copy(info)
+            except Exception as e:
+                logger.h_except(e)
+                copied = False
+
+            if not copied:
+                self.results[index] = (None, info.d_name)
+                continue
+
+            self.results[index] = (info, None)
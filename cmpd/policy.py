@@ -0,0 +1,230 @@
+import random
+import threading
+import time
+
+from concurrent.futures import Future, FIRST_COMPLETED, wait
+from urllib.parse import urlsplit
+
+from cmpd.logger import logger
+from cmpd.metrics import NullMetrics
+
+
+# ------------------------------------
+# Download policy
+# ------------------------------------
+#  how download_to_store goes about getting a file
+#   - timeouts   : (connect, read) of every download request, read applies to each chunk too
+#   - backoff    : exponential with full jitter between attempts (random between 0 and base * 2^attempt)
+#   - mirrors    : other base urls with the same paths, tried once the ones before them fail
+#   - hedging    : no response headers after hedge_after seconds, a second request goes out
+#                  (to the next candidate) and whichever answers first is used
+#  every host gets its own health (latency, failures), candidates are ordered by it
+#   so a failing or slow mirror stops being asked first. hosts failing over and over
+#   cool down for a while before they're tried first again
+# ------------------------------------
+
+class HostHealth:
+    __slots__ = ('requests', 'failures', 'consecutive', 'latency', 'last_failure')
+
+    # Weight of the newest latency in the moving average
+    alpha = 0.3
+
+    def __init__(self):
+        self.requests = 0
+        self.failures = 0
+        self.consecutive = 0
+        self.latency = None
+        self.last_failure = 0
+
+    def success(self, seconds: float):
+        self.requests += 1
+        self.consecutive = 0
+        self.latency = seconds if self.latency is None else self.alpha * seconds + (1 - self.alpha) * self.latency
+
+    def failure(self):
+        self.requests += 1
+        self.failures += 1
+        self.consecutive += 1
+        self.last_failure = time.monotonic()
+
+    def get_json(self):
+        return {
+            'requests': self.requests,
+            'failures': self.failures,
+            'consecutive_failures': self.consecutive,
+            'latency': round(self.latency, 4) if self.latency is not None else None,
+        }
+
+
+class DownloadPolicy:
+    def __init__(self, retries: int = 3, timeout=None, backoff: float = 0.5, backoff_max: float = 30,
+                 mirrors: list = None, hedge_after: float = None, cooldown: float = 60, metrics=None):
+        """
+        :param retries: attempts per file, over all the candidates
+        :param timeout: (connect, read) timeout in seconds, defaults to the session's
+        :param backoff: base delay between attempts, in seconds
+        :param backoff_max: longest delay between attempts
+        :param mirrors: base urls (scheme://host[/prefix]) serving the same paths as the download urls
+        :param hedge_after: seconds without response headers before a second request goes out, None to never
+        :param cooldown: seconds a host that kept failing is tried last
+        :param metrics: where hedges and failovers are counted
+        """
+        self.retries = max(1, retries)
+        self.timeout = timeout
+        self.backoff = backoff
+        self.backoff_max = backoff_max
+        self.mirrors = [i.rstrip('/') for i in (mirrors or [])]
+        self.hedge_after = hedge_after
+        self.cooldown = cooldown
+        self.metrics = metrics or NullMetrics()
+
+        self._lock = threading.Lock()
+        self.hosts = {}
+
+    def delay(self, attempt: int):
+        """
+        :param attempt: how many attempts failed so far (1 for the first retry)
+        :return: seconds to wait before the next one
+        """
+        if attempt <= 0 or self.backoff <= 0:
+            return 0
+        return random.uniform(0, min(self.backoff_max, self.backoff * 2 ** (attempt - 1)))
+
+    def _health(self, host: str):
+        health = self.hosts.get(host)
+        if health is None:
+            health = self.hosts[host] = HostHealth()
+        return health
+
+    def record(self, url: str, ok: bool, seconds: float = None):
+        """
+        :param url: the url a request went to
+        :param ok: whether it got a usable response
+        :param seconds: how long the response headers took
+        """
+        with self._lock:
+            health = self._health(urlsplit(url).netloc)
+            if ok:
+                health.success(seconds)
+            else:
+                health.failure()
+
+    def candidates(self, url: str):
+        """
+        :param url: the file's download url
+        :return: the url and its mirrored versions, healthiest host first
+        """
+        urls = [url]
+        parts = urlsplit(url)
+        path = parts.path + ('?' + parts.query if parts.query else '')
+        for i in self.mirrors:
+            mirrored = i + path
+            if mirrored not in urls:
+                urls.append(mirrored)
+
+        if len(urls) == 1:
+            return urls
+
+        now = time.monotonic()
+
+        def rank(item):
+            index, candidate = item
+            health = self.hosts.get(urlsplit(candidate).netloc)
+            if health is None:
+                # Never asked, after the ones that work but before the ones that don't
+                return False, 0, float('inf'), index
+            cooling = health.consecutive >= 3 and now - health.last_failure < self.cooldown
+            return cooling, health.consecutive, health.latency if health.latency is not None else float('inf'), index
+
+        with self._lock:
+            return [i for _, i in sorted(enumerate(urls), key=rank)]
+
+    def _get(self, session, url: str, headers: dict):
+        started = time.monotonic()
+        try:
+            _r = session.get(url, stream=True, headers=headers,
+                             **({'timeout': self.timeout} if self.timeout else {}))
+            # Server side trouble, another host might do better
+            if _r.status_code >= 500 or _r.status_code == 429:
+                # Already loaded by the session at this point
+                from requests import HTTPError
+                _r.close()
+                raise HTTPError('{} from [{}]'.format(_r.status_code, urlsplit(url).netloc), response=_r)
+        except Exception:
+            self.record(url, False)
+            raise
+
+        self.record(url, True, time.monotonic() - started)
+        return _r
+
+    def open(self, session, urls: list, headers: dict = None):
+        """
+        Sends the GET for a download, hedged if it takes too long to answer
+        :param session: the HttpSession
+        :param urls: the candidates, from candidates()
+        :param headers: extra headers (range, ...)
+        :return: (streamed response, url it came from)
+        :raise Exception: whatever the last request failed with
+        """
+        if not self.hedge_after:
+            return self._get(session, urls[0], headers), urls[0]
+
+        first = _submit(self._get, session, urls[0], headers)
+        done, _ = wait([first], timeout=self.hedge_after)
+        if first in done:
+            return first.result(), urls[0]
+
+        # Same url again if there's no mirror, might still land on a better edge
+        hedge_url = urls[1] if len(urls) > 1 else urls[0]
+        logger.debug(' * No answer from [{}] after [{}s], hedging with [{}]'
+                     .format(urlsplit(urls[0]).netloc, self.hedge_after, urlsplit(hedge_url).netloc))
+        futures = {first: urls[0], _submit(self._get, session, hedge_url, headers): hedge_url}
+
+        pending = set(futures.keys())
+        error = None
+        while len(pending) > 0:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            winner = None
+            for i in done:
+                try:
+                    _r = i.result()
+                except Exception as e:
+                    error = e
+                    continue
+                if winner is None:
+                    winner = i
+                    response = _r
+                else:
+                    _r.close()
+
+            if winner is not None:
+                self.metrics.inc('cmpd_download_hedges_total', won='first' if winner is first else 'hedge')
+                # Whatever is still on its way gets dropped once it arrives
+                for i in pending:
+                    i.add_done_callback(_close_result)
+                return response, futures[winner]
+
+        raise error
+
+    def stats(self):
+        with self._lock:
+            return {k: v.get_json() for k, v in self.hosts.items()}
+
+
+def _submit(func, *args):
+    # A thread per request, only used while hedging so they're few and short lived
+    future = Future()
+
+    def run():
+        try:
+            future.set_result(func(*args))
+        except BaseException as e:
+            future.set_exception(e)
+
+    threading.Thread(target=run, daemon=True).start()
+    return future
+
+
+def _close_result(future: Future):
+    if future.exception() is None:
+        future.result().close()
@@ -0,0 +1,239 @@
+import json
+import sys
+import threading
+import time
+
+from cmpd.logger import logger
+
+
+# ------------------------------------
+# Download progress
+# ------------------------------------
+#  downloads only bump counters, a single reporter thread
+#   turns them into a snapshot every interval and hands it to a sink
+# ------------------------------------
+
+def _eta(seconds):
+    if seconds is None:
+        return '--:--'
+    seconds = int(seconds)
+    return '{}:{:02d}:{:02d}'.format(seconds // 3600, (seconds // 60) % 60, seconds % 60)
+
+
+def _size(value: int):
+    # Only imported once something gets shown, json and none never need it
+    import humanize
+    return humanize.naturalsize(value)
+
+
+class LogSink:
+    """
+    A log line every interval
+    """
+
+    def report(self, snap: dict):
+        logger.info('   {}% :: {} of {} :: {}/s :: ETA {} :: [{}] active, [{}] of [{}] files'.format(
+            str(snap['percent']).rjust(3),
+            _size(snap['done']).rjust(8),
+            _size(snap['total']).rjust(8),
+            _size(snap['rate']).rjust(8),
+            _eta(snap['eta']),
+            snap['active'],
+            snap['files_done'],
+            snap['files_total'],
+        ))
+
+    def event(self, kind: str, data: dict):
+        pass
+
+    def close(self, snap: dict):
+        self.report(snap)
+
+
+class TtySink:
+    """
+    A single progress bar redrawn in place
+    """
+
+    def __init__(self, stream=None, width: int = 30):
+        self.stream = stream or sys.stderr
+        self.width = width
+
+    def report(self, snap: dict):
+        filled = int(self.width * snap['percent'] / 100)
+        self.stream.write('\r[{}{}] {}% {} of {} {}/s ETA {} ({} active) '.format(
+            '#' * filled,
+            '-' * (self.width - filled),
+            str(snap['percent']).rjust(3),
+            _size(snap['done']),
+            _size(snap['total']),
+            _size(snap['rate']),
+            _eta(snap['eta']),
+            snap['active'],
+        ))
+        self.stream.flush()
+
+    def event(self, kind: str, data: dict):
+        pass
+
+    def close(self, snap: dict):
+        self.report(snap)
+        self.stream.write('\n')
+        self.stream.flush()
+
+
+class JsonSink:
+    """
+    One json object per line, for whatever is driving us
+    """
+
+    def __init__(self, stream=None):
+        self.stream = stream or sys.stdout
+        self._lock = threading.Lock()
+
+    def _write(self, data: dict):
+        with self._lock:
+            self.stream.write(json.dumps(data) + '\n')
+            self.stream.flush()
+
+    def report(self, snap: dict):
+        self._write(dict(snap, type='progress'))
+
+    def event(self, kind: str, data: dict):
+        self._write(dict(data, type=kind))
+
+    def close(self, snap: dict):
+        self._write(dict(snap, type='done'))
+
+
+SINKS = {
+    'log': LogSink,
+    'tty': TtySink,
+    'json': JsonSink,
+}
+
+
+def make_sink(kind: str = None, stream=None):
+    """
+    :param kind: log, tty, json, none or None to pick tty/log depending on the terminal
+    :param stream: where the tty/json sinks write to
+    :return: the sink, None for none
+    """
+    if kind is None or kind == 'auto':
+        kind = 'tty' if sys.stderr.isatty() else 'log'
+    if kind == 'none':
+        return None
+    if kind == 'log':
+        return LogSink()
+    return SINKS[kind](stream)
+
+
+class Progress:
+    def __init__(self, sink=None, interval: float = 1.0):
+        """
+        Aggregates bytes across every download in flight
+        :param sink: where snapshots go, None to only keep count
+        :param interval: seconds between snapshots
+        """
+        self.sink = sink
+        self.interval = interval
+
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+        self.total = 0
+        self.done = 0
+        self.files_total = 0
+        self.files_done = 0
+        self.active = 0
+        self.started = None
+
+        # Bytes/s, smoothed so a single slow tick doesn't throw off the eta
+        self._rate = 0.0
+        self._last = (0.0, 0)
+
+    def start(self):
+        self.started = time.monotonic()
+        self._last = (self.started, self.done)
+        if self.sink is None or self._thread is not None:
+            return
+
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._report_loop, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        if self._thread is not None:
+            self._stop.set()
+            self._thread.join()
+            self._thread = None
+
+        if self.sink is not None:
+            self.sink.close(self.snapshot())
+
+    def begin(self, name: str, size: int, already: int = 0):
+        """
+        A download is starting
+        :param name: what is being downloaded
+        :param size: its full size
+        :param already: bytes already there (resumed downloads)
+        """
+        with self._lock:
+            self.total += size
+            self.done += already
+            self.files_total += 1
+            self.active += 1
+        if self.sink is not None:
+            self.sink.event('begin', {'name': name, 'size': size, 'already': already})
+
+    def advance(self, amount: int):
+        with self._lock:
+            self.done += amount
+
+    def end(self, name: str, size: int, ok: bool, left: int = 0):
+        """
+        A download is over
+        :param name: what was being downloaded
+        :param size: its full size
+        :param ok: whether it made it
+        :param left: bytes that never came, taken off the total so the percent stays honest
+        """
+        with self._lock:
+            self.total -= left
+            self.active -= 1
+            self.files_done += 1
+        if self.sink is not None:
+            self.sink.event('end', {'name': name, 'size': size, 'ok': ok})
+
+    def snapshot(self):
+        now = time.monotonic()
+        with self._lock:
+            done, total = self.done, self.total
+            files_done, files_total, active = self.files_done, self.files_total, self.active
+
+        last_t, last_done = self._last
+        if now > last_t:
+            _instant = (done - last_done) / (now - last_t)
+            self._rate = _instant if self._rate == 0 else (self._rate * 0.7 + _instant * 0.3)
+            self._last = (now, done)
+
+        left = max(0, total - done)
+        return {
+            'done': done,
+            'total': total,
+            'percent': int(done * 100 / total) if total > 0 else 100,
+            'rate': int(self._rate),
+            'eta': left / self._rate if self._rate > 0 else None,
+            'elapsed': round(now - self.started, 3) if self.started else 0,
+            'active': active,
+            'files_done': files_done,
+            'files_total': files_total,
+        }
+
+    def _report_loop(self):
+        while not self._stop.wait(self.interval):
+            try:
+                self.sink.report(self.snapshot())
+            except Exception as e:
+                logger.h_except(e)
@@ -0,0 +1,115 @@
+import threading
+import time
+
+from urllib.parse import urlsplit
+
+from cmpd.metrics import NullMetrics
+
+
+class HttpSession:
+    def __init__(self, headers: dict = None, pool_size: int = 4, timeout=None, metrics=None):
+        """
+        Pooled, keep-alive http client shared by everything that talks to the network
+        :param headers: headers sent with every request, kept by reference so
+                        later changes to the dict apply right away
+        :param pool_size: max connections kept alive per host
+        :param timeout: (connect, read) timeout in seconds
+        :param metrics: where request timings go (time to the response headers)
+        """
+        self.headers = headers if headers is not None else {}
+        self.pool_size = max(1, pool_size)
+        self.timeout = timeout or (10, 60)
+        self.metrics = metrics or NullMetrics()
+
+        # Built on the first request, requests takes a while to import and plenty of runs never need it
+        self._session = None
+        self.adapter = None
+
+        self._lock = threading.Lock()
+        self.counters = {
+            'requests': 0,
+            'errors': 0,
+            'hosts': {},
+        }
+
+    @property
+    def session(self):
+        if self._session is None:
+            with self._lock:
+                if self._session is None:
+                    import requests
+                    from requests.adapters import HTTPAdapter
+
+                    session = requests.Session()
+                    self.adapter = HTTPAdapter(pool_connections=10, pool_maxsize=self.pool_size)
+                    session.mount('http://', self.adapter)
+                    session.mount('https://', self.adapter)
+                    self._session = session
+        return self._session
+
+    def request(self, method: str, url: str, headers: dict = None, **kwargs):
+        """
+        Sends a request through the pool
+        :param method: the http method
+        :param url: the target url
+        :param headers: extra headers, applied on top of the shared ones
+        :return: the response
+        """
+        _headers = dict(self.headers)
+        if headers:
+            _headers.update(headers)
+        kwargs.setdefault('timeout', self.timeout)
+
+        host = urlsplit(url).netloc
+        with self._lock:
+            self.counters['requests'] += 1
+            self.counters['hosts'][host] = self.counters['hosts'].get(host, 0) + 1
+
+        started = time.monotonic()
+        try:
+            _r = self.session.request(method, url, headers=_headers, **kwargs)
+        except Exception:
+            with self._lock:
+                self.counters['errors'] += 1
+            self.metrics.inc('cmpd_http_errors_total', method=method, host=host)
+            raise
+
+        self.metrics.observe('cmpd_http_request_seconds', time.monotonic() - started, method=method, host=host)
+        self.metrics.inc('cmpd_http_responses_total', method=method, status=_r.status_code)
+        return _r
+
+    def get(self, url: str, **kwargs):
+        return self.request('GET', url, **kwargs)
+
+    def post(self, url: str, **kwargs):
+        return self.request('POST', url, **kwargs)
+
+    def stats(self):
+        """
+        Request counters along with what the connection pools actually did,
+        requests going well above connections means keep-alive is working
+        :return: dict of counters
+        """
+        pools = {}
+        # TODO : Peeks into urllib3 internals, no public api for this :c
+        for key in list(self.adapter.poolmanager.pools.keys()) if self.adapter is not None else []:
+            pool = self.adapter.poolmanager.pools.get(key)
+            if pool is None:
+                continue
+            pools['{}://{}:{}'.format(key.key_scheme, key.key_host, key.key_port)] = {
+                'connections': pool.num_connections,
+                'requests': pool.num_requests,
+            }
+
+        with self._lock:
+            return {
+                'requests': self.counters['requests'],
+                'errors': self.counters['errors'],
+                'hosts': dict(self.counters['hosts']),
+                'connections': sum(i['connections'] for i in pools.values()),
+                'pools': pools,
+            }
+
+    def close(self):
+        if self._session is not None:
+            self._session.close()
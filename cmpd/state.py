@@ -0,0 +1,84 @@
+import json
+import os
+
+from cmpd.locks import atomic_write
+
+
+# ------------------------------------
+# Output folder state
+# ------------------------------------
+#  out_dir/.cmpd_state.json remembers what the last run applied
+#   {
+#     pack_id, pack_file_id,
+#     files     : {file_id: {project_id, file_name}},
+#     overrides : {relative path: [size, crc]}
+#   }
+#  so a new pack version only has to touch what changed
+# ------------------------------------
+
+class PackState:
+    file_name = '.cmpd_state.json'
+
+    def __init__(self, out_dir: str, pack_id=None):
+        self.path = os.path.join(out_dir, self.file_name)
+        self.pack_id = pack_id
+        self.pack_file_id = None
+        self.files = {}
+        self.overrides = {}
+
+    @classmethod
+    def load(cls, out_dir: str, pack_id):
+        """
+        Loads the state of an output folder
+        :param out_dir: the output folder
+        :param pack_id: the pack about to be applied, a state left by another pack is ignored
+        :return: the state, empty if there's none (or it's unusable)
+        """
+        state = cls(out_dir, pack_id)
+
+        try:
+            with open(state.path, 'r') as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return state
+
+        if str(data.get('pack_id')) != str(pack_id):
+            return state
+
+        state.pack_file_id = data.get('pack_file_id')
+        state.files = data.get('files', {})
+        state.overrides = data.get('overrides', {})
+        return state
+
+    def save(self):
+        with atomic_write(self.path) as f:
+            json.dump({
+                'pack_id': self.pack_id,
+                'pack_file_id': self.pack_file_id,
+                'files': self.files,
+                'overrides': self.overrides,
+            }, f)
+
+    def diff_files(self, pack_files: list, full: bool = False):
+        """
+        :param pack_files: the manifest entries about to be applied
+        :param full: every entry counts as not applied yet, what got dropped still does
+        :return: (entries not applied yet, {file_id: state entry} of what the manifest dropped)
+        """
+        wanted = set(str(i['fileID']) for i in pack_files)
+        added = list(pack_files) if full else [i for i in pack_files if str(i['fileID']) not in self.files]
+        removed = {k: v for k, v in self.files.items() if k not in wanted}
+
+        return added, removed
+
+    def diff_overrides(self, overrides: dict, full: bool = False):
+        """
+        :param overrides: {relative path: [size, crc]} of the pack about to be applied
+        :param full: every override counts as changed, what got dropped still does
+        :return: (paths that are new or changed, paths the pack dropped)
+        """
+        changed = list(overrides.keys()) if full else [k for k, v in overrides.items()
+                                                         if self.overrides.get(k) != list(v)]
+        removed = [k for k in self.overrides.keys() if k not in overrides]
+
+        return changed, removed
@@ -0,0 +1,190 @@
+import json
+import os
+import re
+import threading
+import time
+
+from cmpd.locks import merge_changed, update_json
+from cmpd.state import PackState
+
+
+# ------------------------------------
+# Store usage
+# ------------------------------------
+#  store/data/usage.json
+#   {
+#     files : {file_id: last time a run used it},
+#     refs  : {output folder: {pack_id, link_mode, files: [file ids], updated}}
+#   }
+#  touch() is only a dict update, everything gets written once at the end of a run,
+#  merged into whatever other processes sharing the store saved meanwhile.
+#  refs whose output folder lost its .cmpd_state.json no longer count,
+#   unless they're pending (an install still running, see set_refs)
+#  files with no usage entry at all are from before usage was tracked,
+#   gc and eviction treat them as in use
+# ------------------------------------
+
+# Seconds an install is assumed to still be running for, pending refs and files
+#  another process wrote meanwhile stay off limits to gc and eviction that long
+BUSY_FOR = 24 * 60 * 60
+
+_SIZE_UNITS = {'': 1, 'k': 1024, 'm': 1024 ** 2, 'g': 1024 ** 3, 't': 1024 ** 4}
+
+
+def parse_size(size):
+    """
+    :param size: bytes, or a string like 500M, 10G, 1.5TiB
+    :return: the size in bytes
+    """
+    if isinstance(size, (int, float)):
+        return int(size)
+
+    m = re.match(r'^\s*(\d+(?:\.\d+)?)\s*([kmgt]?)(?:i?b)?\s*$', str(size).lower())
+    if not m:
+        raise ValueError('Cannot read size [{}], expected something like 500M or 10G'.format(size))
+    return int(float(m.group(1)) * _SIZE_UNITS[m.group(2)])
+
+
+class StoreUsage:
+    def __init__(self, store_dir: str):
+        self.usage_file = os.path.join(store_dir, 'data', 'usage.json')
+
+        self._lock = threading.Lock()
+        self._loaded = False
+        self.files = {}
+        self.refs = {}
+        # Keys touched by this process, merged on save
+        self._changed_files = set()
+        self._changed_refs = set()
+        # Files this process used, saved or not
+        self._touched = set()
+
+    def _read(self):
+        try:
+            with open(self.usage_file, 'r') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def _load(self):
+        if self._loaded:
+            return
+
+        data = self._read()
+        self.files = data.get('files', {})
+        self.refs = data.get('refs', {})
+        self._loaded = True
+
+    def _reload(self):
+        # What other processes saved since, with what this process changed on top
+        data = self._read()
+        self.files = merge_changed(data.get('files', {}), self.files, self._changed_files, max)
+        self.refs = merge_changed(data.get('refs', {}), self.refs, self._changed_refs)
+        self._loaded = True
+
+    def touch(self, file_id):
+        """
+        Marks a file as just used
+        :param file_id: the file
+        """
+        with self._lock:
+            self._load()
+            self.files[str(file_id)] = time.time()
+            self._changed_files.add(str(file_id))
+            self._touched.add(str(file_id))
+
+    def last_used(self, file_id, default: float = 0):
+        with self._lock:
+            self._load()
+            return self.files.get(str(file_id), default)
+
+    def touched(self, file_id):
+        """
+        :return: whether this process used the file
+        """
+        with self._lock:
+            return str(file_id) in self._touched
+
+    def tracked(self, file_id):
+        """
+        :return: whether the file has been used since usage got tracked
+        """
+        with self._lock:
+            self._load()
+            return str(file_id) in self.files
+
+    def set_refs(self, out_dir: str, pack_id, file_ids: list, link_mode: str = 'copy', pending: bool = False):
+        """
+        Records which files an output folder is made of, replacing what it had before
+        :param out_dir: the output folder
+        :param pack_id: the pack applied to it
+        :param file_ids: every file it uses, the pack file included
+        :param link_mode: how they got there, symlinked files must stay in the store
+        :param pending: an install is about to apply file_ids, they're added to what the folder already
+                        uses and kept for BUSY_FOR even if the folder has no state file yet
+        """
+        key = os.path.abspath(out_dir)
+        with self._lock:
+            self._load()
+            files = set(str(i) for i in file_ids)
+            if pending and key in self.refs:
+                files.update(self.refs[key]['files'])
+            self.refs[key] = {
+                'pack_id': str(pack_id),
+                'link_mode': link_mode,
+                'files': sorted(files),
+                'updated': time.time(),
+            }
+            if pending:
+                self.refs[key]['pending'] = True
+            self._changed_refs.add(key)
+
+    def referenced(self):
+        """
+        Drops refs of output folders that are gone, and pending ones whose install is long dead
+        :return: (file ids used by an output folder, file ids an output folder symlinks to
+                  or a running install is applying)
+        """
+        used = set()
+        pinned = set()
+        with self._lock:
+            # Installs that started elsewhere since we loaded have saved their pending refs
+            self._reload()
+            for key, ref in list(self.refs.items()):
+                _running = ref.get('pending') and time.time() - ref['updated'] < BUSY_FOR
+                if not _running and not os.path.isfile(os.path.join(key, PackState.file_name)):
+                    self.refs.pop(key)
+                    self._changed_refs.add(key)
+                    continue
+                used.update(ref['files'])
+                if _running or ref.get('link_mode') == 'symlink':
+                    pinned.update(ref['files'])
+
+        return used, pinned
+
+    def forget(self, file_ids):
+        """
+        :param file_ids: files no longer in the store
+        """
+        with self._lock:
+            self._load()
+            for i in file_ids:
+                self.files.pop(str(i), None)
+                self._changed_files.add(str(i))
+
+    def save(self):
+        with self._lock:
+            if len(self._changed_files) == 0 and len(self._changed_refs) == 0:
+                return
+
+            def merge(data: dict):
+                # Last use only ever moves forward, whoever saw the latest one wins
+                merge_changed(data.setdefault('files', {}), self.files, self._changed_files, max)
+                merge_changed(data.setdefault('refs', {}), self.refs, self._changed_refs)
+                return data
+
+            data = update_json(self.usage_file, merge)
+            self.files = data['files']
+            self.refs = data['refs']
+            self._changed_files = set()
+            self._changed_refs = set()
@@ -1,4 +1,5 @@
 from cmpd import CMPD
+from cmpd.logger import setup_logging
 from argparse import ArgumentParser
 
 parser = ArgumentParser()
@@ -6,6 +7,8 @@ parser.add_argument('pack_id', type=int, help='Project ID of the modpack')
 
 args = parser.parse_args()
 
+setup_logging()
+
 pack_id = args.pack_id
 downloader = CMPD(pack_id)
 downloader.download_modpack()
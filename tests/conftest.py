@@ -0,0 +1,78 @@
+import io
+import json
+import zipfile
+
+import pytest
+
+from cmpd.Addons import AddonFile
+from cmpd.fakeserver import FakeCurse
+from cmpd.installer import CMPD
+from cmpd.ModStore import ModStore
+from cmpd.policy import DownloadPolicy
+
+
+# ------------------------------------
+# Shared fixtures
+# ------------------------------------
+#  every test gets its own fake CurseForge server (small mods, so the suite stays quick),
+#   its own store and its own output folder
+# ------------------------------------
+
+@pytest.fixture
+def server():
+    fake = FakeCurse(mods=5, min_size=16 * 1024, max_size=64 * 1024, overrides=3).start()
+    yield fake
+    fake.stop()
+
+
+@pytest.fixture
+def store_dir(tmp_path):
+    return str(tmp_path / 'store')
+
+
+@pytest.fixture
+def out_dir(tmp_path):
+    return str(tmp_path / 'out')
+
+
+def make_store(store_dir: str, **kwargs):
+    # No backoff between attempts, the fake server doesn't need it
+    kwargs.setdefault('policy', DownloadPolicy(backoff=0))
+    return ModStore(store_dir, **kwargs)
+
+
+def make_cmpd(server: FakeCurse, store_dir: str, out_dir: str, **kwargs):
+    kwargs.setdefault('policy', DownloadPolicy(backoff=0))
+    return CMPD(server.fixtures.pack_id, store_dir=store_dir, out_dir=out_dir, api_base=server.api_base,
+                progress='none', **kwargs)
+
+
+def mod_file(server: FakeCurse, file_id: int = 2000000):
+    """
+    :return: the AddonFile of one of the server's files, the pack's first mod by default
+    """
+    return AddonFile.create_from_json(dict(server.fixtures.files[file_id]))
+
+
+def publish(server: FakeCurse, file_id: int, overrides: dict = None, extra_files: list = None, drop: list = None):
+    """
+    Puts out a new version of the pack, with the same mods as the first one
+    :param file_id: the new pack file id
+    :param overrides: {name in the zip: contents}, replaces the generated ones
+    :param extra_files: manifest entries added to the mods
+    :param drop: file ids of the mods left out
+    """
+    fx = server.fixtures
+    with zipfile.ZipFile(io.BytesIO(fx.data[fx.pack_file_id])) as old:
+        manifest = json.loads(old.read('manifest.json'))
+
+    manifest['files'] = [i for i in manifest['files'] if i['fileID'] not in (drop or [])] + list(extra_files or [])
+    pack = io.BytesIO()
+    with zipfile.ZipFile(pack, 'w') as z:
+        z.writestr('manifest.json', json.dumps(manifest))
+        for name, data in (overrides or {}).items():
+            z.writestr(name, data)
+
+    fx._add_file(file_id, fx.pack_id, 'Fake Pack v{}'.format(file_id), 'fake-pack-{}.zip'.format(file_id),
+                 pack.getvalue(), server.base_url)
+    fx.pack_file_id = file_id
@@ -0,0 +1,36 @@
+import os
+
+import pytest
+
+from cmpd.batch import CMPDBatch, read_jobs
+from cmpd.policy import DownloadPolicy
+
+
+def test_shared_mods_are_downloaded_once(server, store_dir, tmp_path):
+    outs = [str(tmp_path / 'out_a'), str(tmp_path / 'out_b')]
+    # An unknown pack fails on its own, the others still get installed
+    jobs = [(server.fixtures.pack_id, outs[0]), (999999, str(tmp_path / 'out_bad')),
+            (server.fixtures.pack_id, outs[1])]
+
+    runner = CMPDBatch(jobs, store_dir=store_dir, api_base=server.api_base, progress='none',
+                       policy=DownloadPolicy(backoff=0))
+    summary = runner.run()
+
+    assert [i['ok'] for i in summary] == [True, False, True]
+    assert summary[0]['shared'] == 5
+    assert summary[2]['updated'] == 5
+    for out in outs:
+        assert len(os.listdir(os.path.join(out, 'mods'))) == 5
+
+    # The pack file and each mod, once for both packs
+    assert server.stats()['download'] == 6
+
+
+def test_read_jobs():
+    assert read_jobs(['1 a', '2:b  # comment', '', '# nothing', '3\tc d']) == [('1', 'a'), ('2', 'b'), ('3', 'c d')]
+    assert read_jobs(['123:my packs/a\n', '456 my packs/b  # comment\n', '789: packs/#1']) == \
+        [('123', 'my packs/a'), ('456', 'my packs/b'), ('789', 'packs/#1')]
+
+    for line in ('123', 'abc:packs', 'abc packs', '12a my packs'):
+        with pytest.raises(ValueError):
+            read_jobs([line])
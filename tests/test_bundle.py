@@ -0,0 +1,43 @@
+import os
+
+from cmpd.bundle import export_bundle, import_bundle
+
+from conftest import make_cmpd, make_store, mod_file
+
+
+def test_export_import_round_trip(server, store_dir, out_dir, tmp_path):
+    make_cmpd(server, store_dir, out_dir).download_modpack()
+
+    bundle = str(tmp_path / 'pack.cmpd.zip')
+    exported = export_bundle(make_store(store_dir), server.fixtures.pack_id, bundle)
+    assert exported['files'] == 6
+
+    other_dir = str(tmp_path / 'other_store')
+    imported = import_bundle(make_store(other_dir), bundle)
+    assert imported['imported'] == 6
+    assert imported['failed'] == 0
+
+    # Everything the pack needs is there, an offline install never touches the server
+    server.reset_stats()
+    offline = make_cmpd(server, other_dir, str(tmp_path / 'other_out'), cache_mode='offline')
+    offline.download_modpack()
+    assert offline.failed_mods == []
+    assert len(os.listdir(str(tmp_path / 'other_out' / 'mods'))) == 5
+    assert server.stats() == {}
+
+    # Importing again only finds what's already there
+    again = import_bundle(make_store(other_dir), bundle)
+    assert again['present'] == 6
+    assert again['imported'] == 0
+
+
+def test_export_refuses_corrupted_mods(server, store_dir, out_dir, tmp_path):
+    make_cmpd(server, store_dir, out_dir).download_modpack()
+
+    store = make_store(store_dir)
+    with open(store.file_path(mod_file(server)), 'r+b') as f:
+        f.write(b'\0' * 64)
+
+    bundle = str(tmp_path / 'pack.cmpd.zip')
+    assert export_bundle(store, server.fixtures.pack_id, bundle) is None
+    assert not os.path.exists(bundle)
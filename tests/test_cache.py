@@ -0,0 +1,33 @@
+import json
+import time
+
+from cmpd.cache import ApiCache
+
+
+def test_save_drops_expired_entries(store_dir):
+    day = 24 * 60 * 60
+    old = time.time() - 30 * day
+    entries = {
+        'dead': {'status': 404, 'body': None, 'fetched': time.time() - 3600},
+        'dead recently': {'status': 404, 'body': None, 'fetched': time.time()},
+        'stale': {'status': 200, 'body': '{}', 'fetched': old, 'endpoint': 'addon_info'},
+        'stale, from before endpoints were kept': {'status': 200, 'body': '{}', 'fetched': old},
+        'stale a bit': {'status': 200, 'body': '{}', 'fetched': time.time() - 2 * 3600, 'endpoint': 'addon_info'},
+        'never stale': {'status': 200, 'body': '{}', 'fetched': old, 'endpoint': 'file_info'},
+    }
+
+    # Offline can't ask again, it keeps everything
+    cache = ApiCache(store_dir, mode='offline')
+    for k, v in entries.items():
+        cache._put(k, v)
+    cache.save()
+    assert set(cache.entries) == set(entries)
+
+    cache = ApiCache(store_dir)
+    cache.put_negative('new')
+    cache.save()
+
+    expected = {'dead recently', 'stale a bit', 'never stale', 'new'}
+    assert set(cache.entries) == expected
+    with open(cache.cache_file, 'r') as f:
+        assert set(json.load(f)) == expected
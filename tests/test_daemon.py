@@ -0,0 +1,75 @@
+import json
+import os
+import socket
+import stat
+import threading
+import time
+
+from cmpd.client import DAEMON_FILE, DaemonClient
+from cmpd.daemon import CMPDDaemon
+from cmpd.policy import DownloadPolicy
+
+
+def test_install_through_the_daemon(server, store_dir, out_dir):
+    daemon = CMPDDaemon(store_dir, jobs=2, policy=DownloadPolicy(backoff=0), progress_interval=0.05)
+    thread = threading.Thread(target=daemon.serve, daemon=True)
+    thread.start()
+    try:
+        client = None
+        for _ in range(100):
+            client = DaemonClient.find(store_dir)
+            if client is not None:
+                break
+            time.sleep(0.05)
+        assert client is not None
+        assert stat.S_IMODE(os.stat(daemon.daemon_file).st_mode) == 0o600
+
+        job = {'project_id': server.fixtures.pack_id, 'out_dir': out_dir, 'api_base': server.api_base,
+               'progress_interval': 0.05}
+        events = []
+        result = client.install(job, events.append)
+        assert result['ok']
+        assert len(result['files']) == 5
+        assert len(os.listdir(os.path.join(out_dir, 'mods'))) == 5
+        kinds = set(i['type'] for i in events)
+        assert 'begin' in kinds and 'end' in kinds and 'done' in kinds
+
+        # Warm the second time, nothing new to apply or download
+        server.reset_stats()
+        again = client.install(job)
+        assert again['ok']
+        assert again['unchanged'] == 5
+        assert server.stats().get('download', 0) == 0
+        assert client.status()['installs'] == 2
+    finally:
+        if client is not None:
+            client.shutdown()
+        else:
+            daemon.shutdown()
+        thread.join(5)
+
+    assert not os.path.exists(daemon.daemon_file)
+
+
+def test_stale_daemon_file_is_ignored(store_dir):
+    # Whatever took the port since then doesn't speak http
+    listener = socket.socket()
+    listener.bind(('127.0.0.1', 0))
+    listener.listen(1)
+
+    def answer():
+        conn, _ = listener.accept()
+        conn.recv(1024)
+        conn.sendall(b'SSH-2.0-OpenSSH\r\n')
+        conn.close()
+
+    thread = threading.Thread(target=answer, daemon=True)
+    thread.start()
+    try:
+        os.makedirs(store_dir, exist_ok=True)
+        with open(os.path.join(store_dir, DAEMON_FILE), 'w') as f:
+            json.dump({'host': '127.0.0.1', 'port': listener.getsockname()[1], 'token': 'stale'}, f)
+        assert DaemonClient.find(store_dir) is None
+    finally:
+        thread.join(5)
+        listener.close()
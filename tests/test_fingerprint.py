@@ -0,0 +1,35 @@
+import os
+
+import pytest
+
+from cmpd import fingerprint
+from cmpd.fingerprint import fingerprint_bytes, fingerprint_file, stripped_length
+
+
+def test_python_and_c_agree(monkeypatch):
+    if fingerprint._c_murmur2 is None:
+        pytest.skip('murmurhash2 is not installed')
+
+    data = os.urandom(3 * 1024 * 1024 + 3) + b' \t\r\n' * 1000
+    expected = fingerprint_bytes(data)
+
+    monkeypatch.setattr(fingerprint, '_c_murmur2', None)
+    assert fingerprint_bytes(data) == expected
+
+
+def test_big_contents_are_not_loaded_in_full(monkeypatch, tmp_path):
+    path = str(tmp_path / 'pack.zip')
+    data = os.urandom(3 * 1024 * 1024 + 1)
+    with open(path, 'wb') as f:
+        f.write(data)
+
+    monkeypatch.setattr(fingerprint, '_c_murmur2', None)
+    expected = fingerprint_file(path)
+
+    # Anything over the limit never reaches the c hash, with or without a known length
+    hashed = []
+    monkeypatch.setattr(fingerprint, '_c_murmur2', lambda buf, seed: hashed.append(len(buf)))
+    monkeypatch.setattr(fingerprint, '_C_MAX', 1024 * 1024)
+    assert fingerprint_file(path) == expected
+    assert fingerprint_file(path, stripped_length(data)) == expected
+    assert hashed == []
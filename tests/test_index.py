@@ -0,0 +1,55 @@
+import os
+
+from cmpd.index import JsonIndex, SqliteIndex, open_index
+
+from conftest import make_cmpd, make_store
+
+
+def test_migrated_store_installs_from_sqlite(server, store_dir, out_dir, tmp_path):
+    make_cmpd(server, store_dir, out_dir, index='json').download_modpack()
+    json_index = JsonIndex(store_dir)
+
+    sqlite_index = SqliteIndex(store_dir)
+    assert sqlite_index.import_from(json_index) == (1, 6)
+    sqlite_index.close()
+
+    # Picked over the json files from now on, and hands back the same records
+    store = make_store(store_dir)
+    assert store.index.name == 'sqlite'
+    for data in json_index.iter_files():
+        assert store.index.get_file(data['uid']) == data
+        assert store.index.get_file(str(data['uid'])) == data
+    assert store.index.get_file('not an id') is None
+
+    pack = store.get_addon_info(server.fixtures.pack_id)
+    assert pack.newest_file().uid == server.fixtures.pack_file_id
+
+    # Everything it needs comes out of the index, the api only gets asked for the pack
+    server.reset_stats()
+    again = make_cmpd(server, store_dir, str(tmp_path / 'other_out'), index='auto')
+    again.download_modpack()
+    assert again.failed_mods == []
+    assert len(os.listdir(str(tmp_path / 'other_out' / 'mods'))) == 5
+    assert server.stats().get('files', 0) == 0
+    assert server.stats().get('download', 0) == 0
+
+
+def test_newest_file_picks_by_timestamp(store_dir):
+    for kind in ('json', 'sqlite'):
+        index = open_index(os.path.join(store_dir, kind), kind)
+        index.put_files([
+            {'uid': 1, 'addon_uid': 10, 'd_name': 'old', 'file_name': 'old.zip', 'url': 'u', 'length': 1,
+             'fingerprint': 1, 'timestamp': 100.0},
+            {'uid': 2, 'addon_uid': 10, 'd_name': 'new', 'file_name': 'new.zip', 'url': 'u', 'length': 1,
+             'fingerprint': 2, 'timestamp': 200.0},
+        ])
+
+        assert index.get_newest_file([1, 2])['uid'] == 2
+        # Files the index doesn't have are skipped
+        assert index.get_newest_file([3, 1])['uid'] == 1
+        assert index.get_newest_file([3]) is None
+
+        index.drop_files([2])
+        assert index.get_file(2) is None
+        assert [i['uid'] for i in index.iter_files()] == [1]
+        index.close()
@@ -0,0 +1,190 @@
+import asyncio
+import json
+import os
+import threading
+
+from cmpd.aio import AsyncCMPD
+from cmpd.fakeserver import FakeCurse
+from cmpd.state import PackState
+
+from conftest import make_cmpd, make_store, mod_file, publish
+
+
+def test_rerun_without_changes_downloads_nothing(server, store_dir, out_dir):
+    first = make_cmpd(server, store_dir, out_dir)
+    first.download_modpack()
+    assert len(first.mod_files) == 5
+    mods = {i.name: i.stat().st_mtime_ns for i in os.scandir(os.path.join(out_dir, 'mods'))}
+
+    server.reset_stats()
+    again = make_cmpd(server, store_dir, out_dir)
+    again.download_modpack()
+
+    assert again.new_files == []
+    assert again.failed_mods == []
+    stats = server.stats()
+    assert stats.get('download', 0) == 0
+    assert stats.get('files', 0) == 0
+    assert {i.name: i.stat().st_mtime_ns for i in os.scandir(os.path.join(out_dir, 'mods'))} == mods
+
+
+def test_warm_run_writes_no_file_infos(server, store_dir, out_dir):
+    make_cmpd(server, store_dir, out_dir).download_modpack()
+
+    # Everything goes through download_to_store again, all of it already stored
+    again = make_cmpd(server, store_dir, out_dir, full=True)
+    writes = []
+    again.store.index.put_file = lambda data: writes.append(data['uid'])
+    again.store.index.put_files = lambda data: writes.extend(i['uid'] for i in data)
+    again.download_modpack()
+
+    assert len(again.mod_files) == 5
+    assert writes == []
+
+
+def test_full_run_still_removes_what_the_pack_dropped(server, store_dir, out_dir):
+    first = make_cmpd(server, store_dir, out_dir)
+    first.download_modpack()
+    dropped = os.path.join(out_dir, 'mods', mod_file(server).file_name)
+    old_overrides = list(first.state.overrides)
+    assert os.path.isfile(dropped)
+    assert len(old_overrides) > 0
+
+    publish(server, 1900001, {'overrides/config/new.cfg': 'new'}, drop=[2000000])
+    full = make_cmpd(server, store_dir, out_dir, full=True, cache_mode='refresh')
+    full.download_modpack()
+
+    # Everything got applied again, minus what's gone from the pack
+    assert len(full.new_files) == 4
+    assert not os.path.exists(dropped)
+    assert len(os.listdir(os.path.join(out_dir, 'mods'))) == 4
+    for i in old_overrides:
+        assert not os.path.exists(os.path.join(out_dir, i))
+    with open(os.path.join(out_dir, 'config', 'new.cfg'), 'r') as f:
+        assert f.read() == 'new'
+    with open(os.path.join(out_dir, PackState.file_name), 'r') as f:
+        assert '2000000' not in json.load(f)['files']
+
+
+def test_unknown_files_are_not_asked_for_again(server, store_dir, out_dir):
+    publish(server, 1900001, extra_files=[{'projectID': 299999, 'fileID': 2999999, 'required': True}])
+
+    first = make_cmpd(server, store_dir, out_dir)
+    first.download_modpack()
+    assert len(first.mod_files) == 5
+    assert len(first.failed_mods) == 1
+
+    # Failed entries aren't recorded, so the next run has it as new again
+    server.reset_stats()
+    again = make_cmpd(server, store_dir, out_dir)
+    again.download_modpack()
+    assert [i['fileID'] for i in again.new_files] == [2999999]
+    assert len(again.failed_mods) == 1
+
+    stats = server.stats()
+    assert stats.get('files', 0) == 0
+    assert stats.get('file_info', 0) == 0
+
+
+def test_overrides_cannot_escape_the_output_folder(server, store_dir, out_dir, tmp_path):
+    victim = tmp_path / 'victim.txt'
+    victim.write_text('keep me')
+
+    publish(server, 1900001, {'overrides/../victim.txt': 'overwritten', 'overrides/config/a.cfg': 'a'})
+    make_cmpd(server, store_dir, out_dir).download_modpack()
+    assert victim.read_text() == 'keep me'
+    assert (tmp_path / 'out' / 'config' / 'a.cfg').read_text() == 'a'
+
+    # A state file listing a ../ entry, that the next version drops
+    state_file = os.path.join(out_dir, PackState.file_name)
+    with open(state_file, 'r') as f:
+        state = json.load(f)
+    state['overrides']['../victim.txt'] = [7, 0]
+    with open(state_file, 'w') as f:
+        json.dump(state, f)
+
+    # The cached addon info wouldn't know about the new version yet
+    publish(server, 1900002, {'overrides/config/a.cfg': 'b'})
+    make_cmpd(server, store_dir, out_dir, cache_mode='refresh').download_modpack()
+    assert victim.read_text() == 'keep me'
+    assert (tmp_path / 'out' / 'config' / 'a.cfg').read_text() == 'b'
+
+
+def test_empty_override_folders_are_created(server, store_dir, out_dir, tmp_path):
+    publish(server, 1900001, {'overrides/': '', 'overrides/emptydir/': '', 'overrides/../outside/': '',
+                              'overrides/config/a.cfg': 'a'})
+    make_cmpd(server, store_dir, out_dir).download_modpack()
+    assert (tmp_path / 'out' / 'emptydir').is_dir()
+    assert (tmp_path / 'out' / 'config' / 'a.cfg').read_text() == 'a'
+    assert not (tmp_path / 'outside').exists()
+
+
+def test_cancelled_install_keeps_what_it_got(store_dir, out_dir):
+    # Big and slow enough to still be downloading mods when the cancel comes in
+    server = FakeCurse(bandwidth=256 * 1024, mods=3, min_size=512 * 1024, max_size=768 * 1024, overrides=1).start()
+    try:
+        # Small chunks, so the part files have something in them
+        store = make_store(store_dir, chunk_size=16 * 1024)
+        installer = AsyncCMPD(server.fixtures.pack_id, store_dir=store_dir, out_dir=out_dir, store=store,
+                              api_base=server.api_base, jobs=2, policy=store.policy)
+
+        def parts():
+            # Of the mods, the pack file is small enough to show up as a part for a moment too
+            found = []
+            for folder, _, files in os.walk(os.path.join(store_dir, 'files')):
+                for i in files:
+                    if not (i.endswith('.part') and os.path.basename(folder).startswith('2000')):
+                        continue
+                    try:
+                        if os.path.getsize(os.path.join(folder, i)) > 0:
+                            found.append(i)
+                    except OSError:
+                        # Finished meanwhile
+                        pass
+            return found
+
+        async def run():
+            task = asyncio.ensure_future(installer.download_modpack())
+            while len(parts()) == 0 and not task.done():
+                await asyncio.sleep(0.02)
+            installer.cancel()
+            return await task
+
+        result = asyncio.run(run())
+        assert result.cancelled
+        assert not result.ok
+        assert result.error == 'Cancelled'
+
+        # What was in flight stays as part files, the next run resumes from them
+        assert len(parts()) > 0
+
+        server.bandwidth = 0
+        server.reset_stats()
+        again = make_cmpd(server, store_dir, out_dir)
+        again.download_modpack()
+        assert again.failed_mods == []
+        assert len(os.listdir(os.path.join(out_dir, 'mods'))) == 3
+        assert server.stats()['bytes'] < sum(len(server.fixtures.data[2000000 + i]) for i in range(3))
+    finally:
+        server.stop()
+
+
+def test_async_install_builds_off_the_loop(server, store_dir, out_dir):
+    installer = AsyncCMPD(server.fixtures.pack_id, store_dir=store_dir, out_dir=out_dir, api_base=server.api_base)
+    # Nothing touched the disk yet, the store gets opened on the executor
+    assert installer.cmpd is None
+    assert not os.path.exists(store_dir)
+
+    built_on = []
+
+    async def run():
+        loop_thread = threading.get_ident()
+        build = installer._build
+        installer._build = lambda: built_on.append(threading.get_ident() != loop_thread) or build()
+        return await installer.download_modpack()
+
+    result = asyncio.run(run())
+    assert built_on == [True]
+    assert result.ok
+    assert result.out_dir == out_dir
+    assert len(result.files) == 5
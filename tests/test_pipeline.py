@@ -0,0 +1,65 @@
+import threading
+import time
+
+from cmpd.Addons import AddonFile
+from cmpd.pipeline import ModPipeline
+
+
+def _items(sizes: list):
+    items = [{'projectID': 1, 'fileID': i} for i in range(len(sizes))]
+    infos = {i: AddonFile(i, 1, 'mod-{}'.format(i), 'mod-{}.jar'.format(i), 'http://x', size, None, 0)
+             for i, size in enumerate(sizes)}
+    return items, infos
+
+
+def test_results_keep_manifest_order_and_big_files_go_first():
+    items, infos = _items([1, 10, 50, 30, 20])
+    first_started = threading.Event()
+    resolved = threading.Event()
+    downloaded = []
+
+    def resolve(entries):
+        for i, item in enumerate(entries):
+            yield i, infos[item['fileID']]
+            if i == 0:
+                first_started.wait(5)
+        resolved.set()
+
+    def download(info):
+        # The first one holds the only worker until everything else is queued
+        if len(downloaded) == 0:
+            first_started.set()
+            resolved.wait(5)
+        downloaded.append(info.uid)
+        # Finish out of order
+        time.sleep(0.01 * (5 - info.uid))
+        return '/store/{}'.format(info.uid)
+
+    results = ModPipeline(resolve, download, lambda info: True, jobs=1).run(items)
+
+    assert downloaded == [0, 2, 3, 4, 1]
+    assert [info.uid for info, failed in results] == [0, 1, 2, 3, 4]
+    assert all(failed is None for _, failed in results)
+
+
+def test_cancel_stops_new_downloads():
+    items, infos = _items([5, 4, 3, 2, 1])
+    cancel = threading.Event()
+    downloaded = []
+
+    def resolve(entries):
+        for i, item in enumerate(entries):
+            yield i, infos[item['fileID']]
+
+    def download(info):
+        downloaded.append(info.uid)
+        cancel.set()
+        return '/store/{}'.format(info.uid)
+
+    pipeline = ModPipeline(resolve, download, lambda info: True, jobs=1, cancel=cancel)
+    results = pipeline.run(items)
+
+    # What was in flight still lands, nothing else gets started and the rest counts as failed
+    assert len(downloaded) == 1
+    assert results[downloaded[0]][0] is not None
+    assert sum(1 for info, failed in results if failed is not None) == 4
@@ -0,0 +1,44 @@
+import time
+
+from cmpd.fakeserver import FakeCurse
+from cmpd.policy import DownloadPolicy
+
+from conftest import make_store, mod_file
+
+
+def test_fails_over_to_a_mirror(server, store_dir):
+    # Nothing listens there, the mirror has the same paths
+    policy = DownloadPolicy(backoff=0, mirrors=[server.base_url])
+    store = make_store(store_dir, policy=policy)
+    info = mod_file(server)
+    info.url = info.url.replace(server.base_url, 'http://127.0.0.1:1')
+
+    assert store.download_to_store(info) == store.file_path(info)
+    with open(store.file_path(info), 'rb') as f:
+        assert f.read() == server.fixtures.data[info.uid]
+
+    hosts = policy.stats()
+    assert hosts['127.0.0.1:1']['failures'] == 1
+    assert hosts[server.base_url.split('//')[1]]['failures'] == 0
+
+    # The dead host is asked last from now on
+    assert policy.candidates(info.url)[0].startswith(server.base_url)
+
+
+def test_slow_download_gets_hedged(server, store_dir):
+    # Same seed so the same files, but every request takes a while to answer
+    slow = FakeCurse(mods=5, min_size=16 * 1024, max_size=64 * 1024, overrides=3, latency=3).start()
+    try:
+        policy = DownloadPolicy(backoff=0, mirrors=[server.base_url], hedge_after=0.2)
+        store = make_store(store_dir, policy=policy)
+        info = mod_file(server)
+        info.url = info.url.replace(server.base_url, slow.base_url)
+
+        started = time.monotonic()
+        assert store.download_to_store(info) == store.file_path(info)
+        assert time.monotonic() - started < 2
+        assert server.stats()['download'] == 1
+        with open(store.file_path(info), 'rb') as f:
+            assert f.read() == server.fixtures.data[info.uid]
+    finally:
+        slow.stop()
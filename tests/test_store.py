@@ -0,0 +1,215 @@
+import os
+import shutil
+import subprocess
+import sys
+import time
+
+from conftest import make_cmpd, make_store, mod_file
+
+
+def test_resumes_part_file_with_range(server, store_dir):
+    store = make_store(store_dir)
+    info = mod_file(server)
+    data = server.fixtures.data[info.uid]
+
+    target = store.file_path(info)
+    os.makedirs(os.path.dirname(target))
+    with open(target + '.part', 'wb') as f:
+        f.write(data[:len(data) // 2])
+
+    assert store.plan_file(info) == ('partial', len(data) - len(data) // 2)
+    assert store.download_to_store(info) == target
+    with open(target, 'rb') as f:
+        assert f.read() == data
+
+    # Only the missing half came over the network
+    assert server.stats()['bytes'] == len(data) - len(data) // 2
+    assert not os.path.exists(target + '.part')
+
+
+def test_fingerprint_mismatch_is_retried(server, store_dir):
+    store = make_store(store_dir)
+    info = mod_file(server)
+    data = server.fixtures.data[info.uid]
+
+    # First download gets flipped bytes, the next one the real thing
+    class Flaky(dict):
+        served = 0
+
+        def get(self, key, default=None):
+            value = super().get(key, default)
+            if key == info.uid:
+                Flaky.served += 1
+                if Flaky.served == 1:
+                    return bytes(b ^ 0xff for b in value[:64]) + value[64:]
+            return value
+
+    server.fixtures.data = Flaky(server.fixtures.data)
+
+    target = store.download_to_store(info)
+    assert target is not None
+    with open(target, 'rb') as f:
+        assert f.read() == data
+    assert server.stats()['download'] == 2
+
+
+def test_short_body_is_not_stored_without_verify(server, store_dir):
+    store = make_store(store_dir, verify=False)
+    info = mod_file(server)
+    data = server.fixtures.data[info.uid]
+
+    # Content-length matches what gets sent, only the file's length says it's short
+    server.fixtures.data[info.uid] = data[:-100]
+    assert store.download_to_store(info) is None
+    assert not os.path.exists(store.file_path(info))
+
+    # What did come is kept and resumed from
+    server.fixtures.data[info.uid] = data
+    server.reset_stats()
+    assert store.download_to_store(info) == store.file_path(info)
+    assert server.stats()['bytes'] == 100
+    with open(store.file_path(info), 'rb') as f:
+        assert f.read() == data
+
+
+def test_corrupted_file_is_downloaded_again(server, store_dir):
+    store = make_store(store_dir)
+    info = mod_file(server)
+    data = server.fixtures.data[info.uid]
+    target = store.download_to_store(info)
+    store.save_verified()
+
+    # Same size, different bytes, its object shares the inode so it's corrupted too
+    with open(target, 'r+b') as f:
+        f.write(b'\0' * 64)
+
+    server.reset_stats()
+    store = make_store(store_dir)
+    assert store.download_to_store(info) == target
+    with open(target, 'rb') as f:
+        assert f.read() == data
+    assert server.stats()['download'] == 1
+
+
+def test_corrupted_object_is_not_reused(server, store_dir):
+    store = make_store(store_dir)
+    info = mod_file(server)
+    data = server.fixtures.data[info.uid]
+    target = store.download_to_store(info)
+    store.save_verified()
+
+    obj = store._object_path(info.fingerprint)
+    assert os.path.samefile(obj, target)
+
+    # Only the object is left, and it's gone bad
+    os.remove(target)
+    with open(obj, 'r+b') as f:
+        f.write(b'\0' * 64)
+
+    server.reset_stats()
+    store = make_store(store_dir)
+    assert store.download_to_store(info) == target
+    with open(target, 'rb') as f:
+        assert f.read() == data
+    assert server.stats()['download'] == 1
+
+
+_HOLD_LOCK = '''
+import os, sys, time
+from cmpd.ModStore import ModStore
+store_dir, uid, target, source = sys.argv[1:]
+with ModStore(store_dir).file_lock(uid):
+    print('locked', flush=True)
+    time.sleep(0.5)
+    os.makedirs(os.path.dirname(target), exist_ok=True)
+    with open(source, 'rb') as src, open(target, 'wb') as dst:
+        dst.write(src.read())
+'''
+
+
+def test_waits_for_another_process_holding_the_lock(server, store_dir, tmp_path):
+    store = make_store(store_dir)
+    info = mod_file(server)
+    target = store.file_path(info)
+
+    source = str(tmp_path / 'source.jar')
+    with open(source, 'wb') as f:
+        f.write(server.fixtures.data[info.uid])
+
+    # Stands in for another install that's downloading the same file
+    other = subprocess.Popen([sys.executable, '-c', _HOLD_LOCK, store_dir, str(info.uid), target, source],
+                             stdout=subprocess.PIPE, text=True, cwd=os.path.dirname(os.path.dirname(__file__)))
+    try:
+        assert other.stdout.readline().strip() == 'locked'
+        started = time.monotonic()
+        assert store.download_to_store(info) == target
+        assert time.monotonic() - started > 0.2
+    finally:
+        other.wait()
+
+    # Its file got reused instead of downloaded again
+    assert server.stats().get('download', 0) == 0
+    assert other.returncode == 0
+
+
+def test_gc_and_eviction_keep_what_output_folders_use(server, store_dir, out_dir):
+    make_cmpd(server, store_dir, out_dir).download_modpack()
+
+    # Two files no output folder uses
+    store = make_store(store_dir)
+    extra = set()
+    for i in range(2):
+        server.fixtures._add_file(3000000 + i, 300000 + i, 'extra-{}'.format(i), 'extra-{}.jar'.format(i),
+                                  os.urandom(8 * 1024), server.base_url)
+        assert store.download_to_store(mod_file(server, 3000000 + i))
+        extra.add(str(3000000 + i))
+    store.usage.save()
+
+    # The pack file, its 5 mods and the extras
+    stored = store._stored_files()
+    assert len(stored) == 8
+    used = sum(size for uid, (_, size, _, _) in stored.items() if uid not in extra)
+
+    summary = store.evict(used)
+    assert summary['files'] == 2
+    assert summary['size'] == used
+    assert set(store._stored_files()) == set(stored) - extra
+
+    # Still in use, gc leaves it alone until the output folder is gone
+    assert store.collect_garbage()['files'] == 0
+    shutil.rmtree(out_dir)
+    assert store.collect_garbage()['files'] == 6
+    assert store._stored_files() == {}
+    assert os.listdir(os.path.join(store_dir, 'objects')) == []
+
+
+def test_gc_leaves_a_running_install_alone(server, store_dir, out_dir):
+    running = make_cmpd(server, store_dir, out_dir)
+    assert running.prepare_modpack()
+    # Downloaded and saved, but the install hasn't recorded what its folder uses yet
+    info = mod_file(server)
+    assert running.store.download_to_store(info)
+    running.store.usage.save()
+
+    store = make_store(store_dir)
+    assert store.collect_garbage()['files'] == 0
+    assert store.evict(0)['files'] == 0
+    assert os.path.isfile(running.store.file_path(info))
+
+    # Another process wrote it after the gc started, it may not have any refs yet
+    server.fixtures._add_file(3000000, 300000, 'extra', 'extra.jar', os.urandom(8 * 1024), server.base_url)
+    other = make_store(store_dir)
+    assert other.download_to_store(mod_file(server, 3000000))
+    other.usage.save()
+    assert store.collect_garbage()['files'] == 0
+    assert make_store(store_dir).collect_garbage()['files'] == 1
+
+
+def test_gc_keeps_files_stored_before_usage_was_tracked(server, store_dir, out_dir):
+    make_cmpd(server, store_dir, out_dir).download_modpack()
+    os.remove(os.path.join(store_dir, 'data', 'usage.json'))
+    shutil.rmtree(out_dir)
+
+    store = make_store(store_dir)
+    assert store.collect_garbage()['files'] == 0
+    assert len(store._stored_files()) == 6